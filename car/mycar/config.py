@@ -19,15 +19,72 @@ import os
 CAR_PATH = PACKAGE_PATH = os.path.dirname(os.path.realpath(__file__))
 DATA_PATH = os.path.join(CAR_PATH, 'data')
 MODELS_PATH = os.path.join(CAR_PATH, 'models')
+LOGS_PATH = os.path.join(CAR_PATH, 'logs')
 
 #VEHICLE
 DRIVE_LOOP_HZ = 20
 MAX_LOOPS = 100000
+#freeze start up objects and disable automatic garbage collection while driving
+DRIVE_LOOP_GC_FREEZE = False
+#pin the drive loop and the camera thread to cores, ie [3], None to let the OS decide
+DRIVE_LOOP_CPUS = None
+CAMERA_CPUS = None
+#SCHED_FIFO priority (1-99) of the drive loop, needs root. None for normal scheduling
+DRIVE_LOOP_REALTIME = None
+
+#FLIGHT RECORDER
+FLIGHT_RECORDER = True
+FLIGHT_RECORDER_SECONDS = 30
+FLIGHT_RECORDER_THUMBNAIL_STRIDE = 4
+
+#TRACING
+#path of a chrome trace event json written on stop, None disables tracing
+TRACE_PATH = None
+TRACE_MAX_EVENTS = 100000
 
 #CAMERA
 CAMERA_RESOLUTION = (120, 160) #(height, width)
 CAMERA_FRAMERATE = DRIVE_LOOP_HZ
 
+#PILOT IMAGES
+#size (height, width) and crop ((top, bottom), (left, right)) of the images the
+#pilot is trained on and sees while driving. None keeps the camera frames as is.
+IMAGE_TARGET_SIZE = None
+IMAGE_ROI = None
+
+#LATENCY
+#stamp frames at capture and log capture->inference->actuation histograms
+LATENCY_TRACKING = True
+RECORD_LATENCY = False
+
+#PILOT
+#run inference on its own thread so slow models don't slow the drive loop,
+#outputs are the latest finished prediction with its age in pilot/age
+PILOT_ASYNC = False
+PILOT_EXTRAPOLATE = False  # move the angle along its trend for the age of the output
+PILOT_STALE_MS = 100  # outputs older than this are counted as stale
+#swap in models saved to MODELS_PATH while driving, they can also be posted to /model
+PILOT_WATCH_MODELS = False
+#models run in shadow next to the driving model on the same frames, their outputs and
+#differences go to shadow/* channels and the divergence stats are logged on stop
+PILOT_SHADOW_MODELS = []
+RECORD_SHADOW = False
+#only compute the dumping output when needed: None, 'pir', 'frame_diff' or 'interval'.
+#Steering and throttle are computed every loop, the logs show the time saved
+PILOT_CASCADE = None
+CASCADE_EVERY = 10  # full model every n loops without trigger, 0 for never
+CASCADE_HOLD = 20  # loops the full model keeps running after a trigger
+PIR_PIN = 4
+FRAME_DIFF_THRESHOLD = 8.0
+
+#REMOTE PILOT
+#run the pilot on `donkey serve` on another computer, None runs it on the car
+REMOTE_PILOT_HOST = None
+REMOTE_PILOT_PORT = 9091
+REMOTE_DEADLINE_MS = 40  # wait for the server, then use the fallback
+REMOTE_JPEG_QUALITY = None  # compress the frames sent, ie 80, None sends them raw
+REMOTE_FALLBACK_MODEL = None  # small local model used when the server is late, ie a tiny architecture
+
 #STEERING
 STEERING_CHANNEL = 1
 STEERING_LEFT_PWM = 590
@@ -46,7 +103,31 @@ THROTTLE_REVERSE_PWM = 340
 
 #TRAINING
 BATCH_SIZE = 128
+#pilot architecture: default, compact or tiny. Compare them with `donkey latency`
+MODEL_ARCHITECTURE = 'default'
 TRAIN_TEST_SPLIT = 0.8
+#'record' splits every tub by a hash of the record ix, 'session' keeps whole tubs in train or val
+SPLIT_BY = 'record'
+#old records replayed per new record by train --incremental
+INCREMENTAL_REPLAY = 0.5
+
+#BINNING
+#categorical outputs, label -> (number of bins, first bin value, last bin value)
+BINS = {'user/angle': (15, -1, 1),
+        'user/dumping': (15, -1, 1)}
+
+#DISTILLATION
+#train --teacher: weight of the teacher outputs in the targets and softmax temperature
+DISTILL_SOFT_WEIGHT = 0.7
+DISTILL_TEMPERATURE = 2.0
+
+#AUGMENTATION
+#applied to whole training batches, brightness and contrast are fractions
+AUG_BRIGHTNESS = 0.0
+AUG_CONTRAST = 0.0
+AUG_FLIP = False
+AUG_FLIP_KEYS = ['user/angle']  # labels negated on flipped images
+AUG_SHIFT = 0  # max shift in pixels
 
 
 #JOYSTICK
@@ -4,27 +4,40 @@ Scripts to drive a donkey 2 car and train a model for it.
 
 Usage:
     manage.py (drive) [--model=<model>] [--js] [--chaos]
-    manage.py (train) [--tub=<tub1,tub2,..tubn>]  (--model=<model>) [--base_model=<base_model>] [--no_cache]
+    manage.py (train) [--tub=<tub1,tub2,..tubn>]  (--model=<model>) [--base_model=<base_model>] [--no_cache] [--incremental] [--replay=<ratio>] [--heads] [--teacher=<model>]
 
 Options:
     -h --help        Show this screen.
     --tub TUBPATHS   List of paths to tubs. Comma separated. Use quotes to use wildcards. ie "~/tubs/*"
     --js             Use physical joystick.
     --chaos          Add periodic random steering when manually driving
+    --incremental    Only train the base model on records recorded after it was trained.
+    --replay RATIO   Old records replayed per new record in incremental mode. Defaults to cfg.INCREMENTAL_REPLAY.
+    --heads          Freeze the conv layers of the base model and only train its dense heads on cached features.
+    --teacher MODEL  Distill a large teacher model into a MODEL_ARCHITECTURE student, trained on the teacher outputs.
 """
 import os
+import numpy as np
 from docopt import docopt
 
 import donkeycar as dk
 
 #import parts
 from donkeycar.parts.camera import PiCamera
-from donkeycar.parts.transform import Lambda
-from donkeycar.parts.keras import KerasCategorical
+from donkeycar.parts.transform import Lambda, ImgPreprocess
+from donkeycar.parts.keras import KerasCategorical, KerasEnsemble, KerasCascade
 from donkeycar.parts.actuator import PCA9685, PWMSteering, PWMThrottle
 from donkeycar.parts.datastore import TubGroup, TubWriter
+from donkeycar.parts.augment import BatchAugmentation
 from donkeycar.parts.controller import LocalWebController, JoystickController
 from donkeycar.parts.clock import Timestamp
+from donkeycar.parts.recorder import FlightRecorder
+from donkeycar.parts.latency import FrameLatency
+from donkeycar.parts.motion import PIRSensor, FrameDifference
+from donkeycar.parts.remote import RemotePilot
+from donkeycar.parts.pilot import AsyncPilot, ModelWatcher, drive_mode
+from donkeycar.tracer import Tracer, set_tracer
+from donkeycar.util.times import Timings
 
 
 def drive(cfg, model_path=None, use_joystick=False, use_chaos=False):
@@ -38,13 +51,41 @@ def drive(cfg, model_path=None, use_joystick=False, use_chaos=False):
     to parts requesting the same named input.
     """
 
-    V = dk.vehicle.Vehicle()
+    if cfg.TRACE_PATH:
+        set_tracer(Tracer(cfg.TRACE_PATH, max_events=cfg.TRACE_MAX_EVENTS))
+
+    recorder = None
+    if cfg.FLIGHT_RECORDER:
+        # keep the last seconds of every channel, dump with `kill -USR1 <pid>`
+        recorder = FlightRecorder(path=cfg.LOGS_PATH,
+                                  seconds=cfg.FLIGHT_RECORDER_SECONDS,
+                                  rate_hz=cfg.DRIVE_LOOP_HZ,
+                                  thumbnail_stride=cfg.FLIGHT_RECORDER_THUMBNAIL_STRIDE)
+        recorder.install_signal_handler()
+
+    V = dk.vehicle.Vehicle(recorder=recorder)
 
     clock = Timestamp()
     V.add(clock, outputs='timestamp')
 
-    cam = PiCamera(resolution=cfg.CAMERA_RESOLUTION)
-    V.add(cam, outputs=['cam/image_array'], threaded=True)
+    if cfg.LATENCY_TRACKING:
+        cam = PiCamera(resolution=cfg.CAMERA_RESOLUTION, stamp_frames=True)
+        V.add(cam, outputs=['cam/image_array', 'cam/frame_time'], threaded=True,
+              cpus=cfg.CAMERA_CPUS)
+    else:
+        cam = PiCamera(resolution=cfg.CAMERA_RESOLUTION)
+        V.add(cam, outputs=['cam/image_array'], threaded=True,
+              cpus=cfg.CAMERA_CPUS)
+
+    def load_named_model(name):
+        # only models of MODELS_PATH can be swapped in from the web page
+        if not hasattr(kl, 'load_async'):
+            return False
+        path = os.path.join(cfg.MODELS_PATH, os.path.basename(name))
+        if not os.path.exists(path):
+            print('No model', path)
+            return False
+        return kl.load_async(path)
 
     if use_joystick or cfg.USE_JOYSTICK_AS_DEFAULT:
         ctr = JoystickController(max_throttle=cfg.JOYSTICK_MAX_THROTTLE,
@@ -54,7 +95,7 @@ def drive(cfg, model_path=None, use_joystick=False, use_chaos=False):
     else:
         # This web controller will create a web server that is capable
         # of managing steering, throttle, and modes, and more.
-        ctr = LocalWebController(use_chaos=use_chaos)
+        ctr = LocalWebController(use_chaos=use_chaos, model_loader=load_named_model)
 
     V.add(ctr,
             inputs=['cam/image_array'],
@@ -73,33 +114,86 @@ def drive(cfg, model_path=None, use_joystick=False, use_chaos=False):
     V.add(pilot_condition_part, inputs=['user/mode'],
                                 outputs=['run_pilot'])
 
-    # Run the pilot if the mode is not user.
-    kl = KerasCategorical()
-    if model_path:
-        kl.load(model_path)
+    # Crop and scale the frames like the training images.
+    pilot_image = 'cam/image_array'
+    if cfg.IMAGE_TARGET_SIZE or cfg.IMAGE_ROI:
+        pilot_image = 'cam/pilot_image'
+        V.add(ImgPreprocess(cfg.IMAGE_TARGET_SIZE, cfg.IMAGE_ROI),
+              inputs=['cam/image_array'], outputs=[pilot_image],
+              run_condition='run_pilot')
 
-    V.add(kl, inputs=['cam/image_array'],
-              outputs=['pilot/dumping', 'pilot/angle', 'pilot/throttle'],
+    # Run the pilot if the mode is not user.
+    shadow_outputs = []
+    if cfg.REMOTE_PILOT_HOST:
+        fallback = None
+        if cfg.REMOTE_FALLBACK_MODEL:
+            fallback = KerasCategorical(binners=dk.util.binning.make_binners(cfg.BINS))
+            fallback.load(cfg.REMOTE_FALLBACK_MODEL)
+        kl = RemotePilot(host=cfg.REMOTE_PILOT_HOST, port=cfg.REMOTE_PILOT_PORT,
+                         deadline_ms=cfg.REMOTE_DEADLINE_MS, fallback=fallback,
+                         jpeg_quality=cfg.REMOTE_JPEG_QUALITY)
+    elif model_path and cfg.PILOT_SHADOW_MODELS:
+        kl = KerasEnsemble(binners=dk.util.binning.make_binners(cfg.BINS))
+        kl.load([model_path] + list(cfg.PILOT_SHADOW_MODELS))
+        for i in range(1, len(kl.models)):
+            shadow_outputs += ['shadow/angle_{}'.format(i), 'shadow/throttle_{}'.format(i)]
+        shadow_outputs += ['shadow/angle_diff', 'shadow/throttle_diff']
+    elif cfg.PILOT_CASCADE:
+        kl = KerasCascade(input_shape=dk.util.img.image_shape(
+            cfg.CAMERA_RESOLUTION, cfg.IMAGE_TARGET_SIZE, cfg.IMAGE_ROI),
+            binners=dk.util.binning.make_binners(cfg.BINS),
+            architecture=cfg.MODEL_ARCHITECTURE,
+            every=cfg.CASCADE_EVERY, hold=cfg.CASCADE_HOLD)
+        if model_path:
+            kl.load(model_path)
+
+        if cfg.PILOT_CASCADE == 'pir':
+            V.add(PIRSensor(pin=cfg.PIR_PIN), outputs=['pilot/trigger'], threaded=True)
+        elif cfg.PILOT_CASCADE == 'frame_diff':
+            V.add(FrameDifference(threshold=cfg.FRAME_DIFF_THRESHOLD),
+                  inputs=[pilot_image], outputs=['pilot/trigger'],
+                  run_condition='run_pilot')
+    else:
+        kl = KerasCategorical(input_shape=dk.util.img.image_shape(
+            cfg.CAMERA_RESOLUTION, cfg.IMAGE_TARGET_SIZE, cfg.IMAGE_ROI),
+            binners=dk.util.binning.make_binners(cfg.BINS),
+            architecture=cfg.MODEL_ARCHITECTURE)
+        if model_path:
+            kl.load(model_path)
+
+    if cfg.PILOT_WATCH_MODELS and not cfg.REMOTE_PILOT_HOST:
+        V.add(ModelWatcher(cfg.MODELS_PATH, kl.load_async), threaded=True)
+
+    pilot_inputs = [pilot_image]
+    pilot_outputs = ['pilot/dumping', 'pilot/angle', 'pilot/throttle']
+    if cfg.LATENCY_TRACKING:
+        pilot_inputs += ['cam/frame_time']
+        pilot_outputs += ['pilot/frame_time', 'pilot/inference_time']
+    pilot_outputs += shadow_outputs
+    if cfg.PILOT_CASCADE and not isinstance(kl, KerasCascade):
+        print('PILOT_CASCADE is ignored with REMOTE_PILOT_HOST or PILOT_SHADOW_MODELS')
+    if isinstance(kl, KerasCascade):
+        # the trigger is the third input of KerasCascade, None without tracking
+        pilot_inputs = [pilot_image, 'cam/frame_time', 'pilot/trigger']
+
+    if cfg.PILOT_ASYNC:
+        pilot = AsyncPilot(kl, extrapolate=cfg.PILOT_EXTRAPOLATE, stale_ms=cfg.PILOT_STALE_MS,
+                           outputs=len(pilot_outputs))
+        V.add(pilot, inputs=pilot_inputs, outputs=pilot_outputs + ['pilot/age'],
+              run_condition='run_pilot', threaded=True)
+    else:
+        V.add(kl, inputs=pilot_inputs, outputs=pilot_outputs,
               run_condition='run_pilot')
 
     # Choose what inputs should change the car.
-    def drive_mode(mode,
-                   user_dumping, user_angle, user_throttle,
-                   pilot_dumping, pilot_angle, pilot_throttle):
-        if mode == 'user':
-            return user_dumping, user_angle, user_throttle
-
-        elif mode == 'local_angle':
-            return pilot_dumping, pilot_angle, user_throttle
-
-        else:
-            return pilot_dumping, pilot_angle, pilot_throttle
-
+    # The capture time of the frame behind the chosen values is passed on
+    # so the actuators can tell how old it is.
     drive_mode_part = Lambda(drive_mode)
     V.add(drive_mode_part,
           inputs=['user/mode', 'user/dumping', 'user/angle', 'user/throttle',
-                   'pilot/dumping', 'pilot/angle', 'pilot/throttle'],
-          outputs=['dumping', 'angle', 'throttle'])
+                  'pilot/dumping', 'pilot/angle', 'pilot/throttle',
+                  'cam/frame_time', 'pilot/frame_time', 'pilot/inference_time'],
+          outputs=['dumping', 'angle', 'throttle', 'frame_time', 'inference_time'])
 
     #Dumping control
     dumping_controller = PCA9685(cfg.DUMPING_CHANNEL)
@@ -119,12 +213,25 @@ def drive(cfg, model_path=None, use_joystick=False, use_chaos=False):
                            min_pulse=cfg.THROTTLE_REVERSE_PWM)
 
     V.add(dumping, inputs=['dumping'])
-    V.add(steering, inputs=['angle'])
+    V.add(steering, inputs=['angle', 'frame_time'], outputs=['steering/latency'])
     V.add(throttle, inputs=['throttle'])
 
     inputs = ['cam/image_array', 'user/dumping', 'user/angle', 'user/throttle', 'user/mode', 'timestamp']
     types = ['image_array', 'float', 'float', 'float', 'str', 'str']
 
+    if cfg.LATENCY_TRACKING:
+        latency = FrameLatency()
+        V.add(latency, inputs=['frame_time', 'inference_time', 'steering/latency'],
+                       outputs=['latency/inference_ms', 'latency/total_ms'])
+
+        if cfg.RECORD_LATENCY:
+            inputs += ['latency/inference_ms', 'latency/total_ms']
+            types += ['float', 'float']
+
+    if cfg.RECORD_SHADOW:
+        inputs += shadow_outputs
+        types += ['float'] * len(shadow_outputs)
+
 
     #multiple tubs
     #th = TubHandler(path=cfg.DATA_PATH)
@@ -136,60 +243,186 @@ def drive(cfg, model_path=None, use_joystick=False, use_chaos=False):
 
     # run the vehicle
     V.start(rate_hz=cfg.DRIVE_LOOP_HZ,
-            max_loop_count=cfg.MAX_LOOPS)
+            max_loop_count=cfg.MAX_LOOPS,
+            gc_freeze=cfg.DRIVE_LOOP_GC_FREEZE,
+            cpus=cfg.DRIVE_LOOP_CPUS,
+            realtime=cfg.DRIVE_LOOP_REALTIME)
 
 
 
 
-def train(cfg, tub_names, new_model_path, base_model_path=None ):
+def train(cfg, tub_names, new_model_path, base_model_path=None, incremental=False, replay=None,
+          heads=False, teacher_path=None):
     """
     use the specified data in tub_names to train an artifical neural network
     saves the output trained model as model_name
+
+    incremental fine tunes the base model on the records added after its
+    data watermark, plus `replay` old records per new record.
+
+    heads only trains the dense layers of the base model, on conv features
+    computed once per tub and cached.
+
+    teacher_path trains the model on the outputs of a teacher model,
+    computed once per tub and cached.
     """
     X_keys = ['cam/image_array']
     y_keys = ['user/dumping', 'user/angle', 'user/throttle']
-    def train_record_transform(record):
-        """ convert categorical steering to linear and apply image augmentations """
-        record['user/dumping'] = dk.util.data.linear_bin(record['user/dumping'])
-        record['user/angle'] = dk.util.data.linear_bin(record['user/angle'])
-        # TODO add augmentation that doesn't use opencv
-        return record
-
-    def val_record_transform(record):
-        """ convert categorical steering to linear """
-        record['user/dumping'] = dk.util.data.linear_bin(record['user/dumping'])
-        record['user/angle'] = dk.util.data.linear_bin(record['user/angle'])
-        return record
+    binners = dk.util.binning.make_binners(cfg.BINS)
 
     new_model_path = os.path.expanduser(new_model_path)
 
-    kl = KerasCategorical()
+    if cfg.TRACE_PATH:
+        set_tracer(Tracer(new_model_path + '.trace.json', max_events=cfg.TRACE_MAX_EVENTS))
+
+    kl = KerasCategorical(input_shape=dk.util.img.image_shape(
+        cfg.CAMERA_RESOLUTION, cfg.IMAGE_TARGET_SIZE, cfg.IMAGE_ROI), binners=binners,
+        architecture=cfg.MODEL_ARCHITECTURE)
+    watermark = {}
     if base_model_path is not None:
         base_model_path = os.path.expanduser(base_model_path)
         kl.load(base_model_path)
+        watermark = dk.util.files.load_model_meta(base_model_path).get('watermark', {})
+    elif incremental or heads:
+        raise ValueError('--incremental and --heads need a --base_model to start from')
 
     print('tub_names', tub_names)
     if not tub_names:
         tub_names = os.path.join(cfg.DATA_PATH, '*')
     tubgroup = TubGroup(tub_names)
+    tubgroup.set_image_options(cfg.IMAGE_TARGET_SIZE, cfg.IMAGE_ROI)
+    tubgroup.set_binners(binners)
+
+    soft_targets = {}
+    if teacher_path is not None:
+        soft_targets = add_teacher_outputs(cfg, tubgroup, binners, teacher_path)
+
+    # augment and bin whole batches with numpy instead of one record at a time
+    flip_keys = list(cfg.AUG_FLIP_KEYS) + [soft_targets[k] for k in cfg.AUG_FLIP_KEYS if k in soft_targets]
+    train_aug = BatchAugmentation(brightness=cfg.AUG_BRIGHTNESS,
+                                  contrast=cfg.AUG_CONTRAST,
+                                  flip=cfg.AUG_FLIP,
+                                  flip_keys=flip_keys,
+                                  shift=cfg.AUG_SHIFT,
+                                  binners=binners,
+                                  soft_targets=soft_targets,
+                                  soft_weight=cfg.DISTILL_SOFT_WEIGHT)
+    # validate on the labels so models stay comparable
+    val_aug = BatchAugmentation(binners=binners)
+
+    records = None
+    if incremental:
+        if replay is None:
+            replay = cfg.INCREMENTAL_REPLAY
+        records = tubgroup.get_incremental(watermark, replay=replay)
+        new_records = int(tubgroup.get_new_records(watermark).sum())
+        print('incremental: %d new records, %d replayed' % (new_records, records.sum() - new_records))
+        if new_records == 0:
+            print('no records newer than the base model, nothing to train')
+            return
+
+    # time spent sampling, decoding, transforming and assembling batches
+    pipeline_timings = {'train': Timings(), 'val': Timings()}
     train_gen, val_gen = tubgroup.get_train_val_gen(X_keys, y_keys,
-                                                    train_record_transform=train_record_transform,
-                                                    val_record_transform=val_record_transform,
+                                                    train_batch_transform=train_aug,
+                                                    val_batch_transform=val_aug,
                                                     batch_size=cfg.BATCH_SIZE,
-                                                    train_frac=cfg.TRAIN_TEST_SPLIT)
-
-    total_records = len(tubgroup.df)
-    total_train = int(total_records * cfg.TRAIN_TEST_SPLIT)
-    total_val = total_records - total_train
+                                                    train_frac=cfg.TRAIN_TEST_SPLIT,
+                                                    split_by=cfg.SPLIT_BY,
+                                                    records=records,
+                                                    train_timings=pipeline_timings['train'],
+                                                    val_timings=pipeline_timings['val'],
+                                                    extra_keys=list(soft_targets.values()))
+
+    # the split is saved in the tubs, this only reads it back
+    is_train = tubgroup.get_split(cfg.TRAIN_TEST_SPLIT, by=cfg.SPLIT_BY)
+    if records is not None:
+        is_train = is_train[records]
+    total_train = int(is_train.sum())
+    total_val = len(is_train) - total_train
     print('train: %d, validation: %d' % (total_train, total_val))
-    steps_per_epoch = total_train // cfg.BATCH_SIZE
+    steps_per_epoch = max(1, total_train // cfg.BATCH_SIZE)
     print('steps_per_epoch', steps_per_epoch)
 
-    kl.train(train_gen,
-             val_gen,
-             saved_model_path=new_model_path,
-             steps=steps_per_epoch,
-             train_split=cfg.TRAIN_TEST_SPLIT)
+    if heads:
+        train_heads(cfg, kl, tubgroup, binners, y_keys, new_model_path, records)
+    else:
+        kl.train(train_gen,
+                 val_gen,
+                 saved_model_path=new_model_path,
+                 steps=steps_per_epoch,
+                 train_split=cfg.TRAIN_TEST_SPLIT,
+                 pipeline_timings=pipeline_timings,
+                 batch_size=cfg.BATCH_SIZE)
+
+        print('train augmentation:', train_aug.timings)
+        print('val augmentation:', val_aug.timings)
+
+    # stamp the data the model has seen, the next incremental run starts there
+    watermark.update(tubgroup.get_watermark())
+    dk.util.files.save_model_meta(new_model_path, {'watermark': watermark,
+                                                   'base_model': base_model_path,
+                                                   'incremental': incremental,
+                                                   'teacher': teacher_path,
+                                                   'records': int(len(is_train))})
+
+
+def add_teacher_outputs(cfg, tubgroup, binners, teacher_path):
+    """
+    Run the teacher over the tubs in batches, or load its cached outputs,
+    and add them as 'teacher/...' columns. The pass is saved as it goes,
+    an interrupted run resumes where it stopped.
+    Returns the label key to teacher key dict of BatchAugmentation.
+    """
+    teacher = KerasCategorical(binners=binners)
+    teacher.load(os.path.expanduser(teacher_path))
+    name = 'teacher_' + teacher.backbone_hash(layer_name=None)
+
+    def compute(imgs):
+        dumping, angle, throttle = teacher.model.predict(imgs, batch_size=len(imgs))
+        return np.concatenate([dumping, angle, throttle], axis=1).astype(np.float32)
+
+    outputs = tubgroup.get_feature_array(name, compute, batch_size=cfg.BATCH_SIZE)
+    n_dumping = binners['user/dumping'].n_bins
+    n_angle = binners['user/angle'].n_bins
+    t = cfg.DISTILL_TEMPERATURE
+    tubgroup.add_array_column('teacher/dumping', dk.util.binning.soften(outputs[:, :n_dumping], t))
+    tubgroup.add_array_column('teacher/angle', dk.util.binning.soften(outputs[:, n_dumping:n_dumping + n_angle], t))
+    tubgroup.add_array_column('teacher/throttle', outputs[:, -1])
+    return {'user/dumping': 'teacher/dumping',
+            'user/angle': 'teacher/angle',
+            'user/throttle': 'teacher/throttle'}
+
+
+def train_heads(cfg, kl, tubgroup, binners, y_keys, new_model_path, records=None):
+    """
+    Train the dense layers of kl from the flattened conv features of the
+    images, cached in the tubs under a hash of the conv weights.
+    Augmentation isn't applied since the features are fixed.
+    """
+    backbone = kl.backbone()
+    name = 'flattened_' + kl.backbone_hash()
+    features = tubgroup.get_feature_array(name, lambda imgs: backbone.predict(imgs, batch_size=len(imgs)),
+                                          batch_size=cfg.BATCH_SIZE)
+
+    df = tubgroup.get_df()
+    labels = []
+    for key in y_keys:
+        if key in binners:
+            labels.append(binners[key].one_hot(df[dk.util.binning.bin_key(key)].values))
+        else:
+            labels.append(df[key].values.astype(np.float32))
+
+    is_train = tubgroup.get_split(cfg.TRAIN_TEST_SPLIT, by=cfg.SPLIT_BY)
+    is_val = ~is_train
+    if records is not None:
+        is_train = is_train & records
+        is_val = is_val & records
+
+    kl.train_heads(features[is_train], [y[is_train] for y in labels],
+                   features[is_val], [y[is_val] for y in labels],
+                   saved_model_path=new_model_path,
+                   batch_size=cfg.BATCH_SIZE)
 
 
 if __name__ == '__main__':
@@ -204,5 +437,8 @@ if __name__ == '__main__':
         new_model_path = args['--model']
         base_model_path = args['--base_model']
         cache = not args['--no_cache']
-        train(cfg, tub, new_model_path, base_model_path)
+        replay = float(args['--replay']) if args['--replay'] else None
+        train(cfg, tub, new_model_path, base_model_path,
+              incremental=args['--incremental'], replay=replay, heads=args['--heads'],
+              teacher_path=args['--teacher'])
 
@@ -236,6 +236,7 @@ class Sim(BaseCommand):
         parser.add_argument('--config', default='./config.py', help='location of config file to use. default: ./config.py')
         parser.add_argument('--type', default='categorical', help='model type to use when loading. categorical|linear')
         parser.add_argument('--top_speed', default='3', help='what is top speed to drive')
+        parser.add_argument('--batch_window', type=float, default=5, help='ms to wait for frames of other simulators. default: 5')
         parsed_args = parser.parse_args(args)
         return parsed_args, parser
 
@@ -256,7 +257,7 @@ class Sim(BaseCommand):
 
         #TODO: this logic should be in a pilot or modle handler part.
         if args.type == "categorical":
-            kl = KerasCategorical()
+            kl = KerasCategorical(binners=dk.util.binning.make_binners(cfg.BINS))
         elif args.type == "linear":
             kl = KerasLinear(num_outputs=2)
         else:
@@ -275,7 +276,8 @@ class Sim(BaseCommand):
         top_speed = float(args.top_speed)
 
         #start sim server handler
-        ss = SteeringServer(sio, kpart=kl, top_speed=top_speed, image_part=img_stack)
+        ss = SteeringServer(sio, kpart=kl, top_speed=top_speed, image_part=img_stack,
+                            batch_window_ms=args.batch_window)
 
         #register events and pass to server handlers
 
@@ -287,7 +289,17 @@ class Sim(BaseCommand):
         def connect(sid, environ):
             ss.connect(sid, environ)
 
-        ss.go(('0.0.0.0', 9090))
+        @sio.on('disconnect')
+        def disconnect(sid):
+            ss.disconnect(sid)
+
+        try:
+            ss.go(('0.0.0.0', 9090))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for line in ss.report():
+                print(line)
 
 
 
@@ -420,6 +432,227 @@ class ShowPredictionPlots(BaseCommand):
 
         plt.show()
 
+class Sweep(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='sweep', usage='%(prog)s [options]')
+        parser.add_argument('tubs', nargs='+', help='paths to tubs')
+        parser.add_argument('--grid', required=True, help='json file of parameter name to list of values')
+        parser.add_argument('--out', default='./sweep', help='folder of the dataset, models and results. default: ./sweep')
+        parser.add_argument('--config', default='./config.py', help='location of config file to use. default: ./config.py')
+        parser.add_argument('--workers', type=int, default=1, help='number of trials trained at the same time')
+        parser.add_argument('--cpus', type=int, default=None, help='cpus per trial. default: split evenly')
+        parser.add_argument('--epochs', type=int, default=100, help='max epochs of a trial unless set by the grid')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def run(self, args):
+        """
+        Train a model for every parameter combination of the grid and print
+        them ranked by validation loss.
+        """
+        import json
+        from donkeycar.parts.datastore import TubGroup
+        from . import sweep
+
+        args = self.parse_args(args)
+        cfg = load_config(args.config)
+        if cfg is None:
+            return
+
+        with open(os.path.expanduser(args.grid), 'r') as f:
+            grid = json.load(f)
+
+        # workers get plain values, the config module can't be pickled
+        settings = {k: getattr(cfg, k) for k in ('IMAGE_TARGET_SIZE', 'IMAGE_ROI', 'BINS', 'BATCH_SIZE',
+                                                 'TRAIN_TEST_SPLIT', 'SPLIT_BY')}
+        settings['EPOCHS'] = args.epochs
+
+        tubgroup = TubGroup(','.join(args.tubs))
+        results = sweep.run_sweep(tubgroup, grid, args.out, settings,
+                                  workers=args.workers, cpus_per_trial=args.cpus)
+        print(sweep.format_leaderboard(results))
+
+
+class ModelLatency(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='latency', usage='%(prog)s [options]')
+        parser.add_argument('models', nargs='+', help='model files, or architecture names (default, compact, tiny) to time untrained')
+        parser.add_argument('--budget', type=float, default=None, help='latency budget in ms, selects the best model that fits')
+        parser.add_argument('--runs', type=int, default=100, help='number of timed frames. default: 100')
+        parser.add_argument('--config', default='./config.py', help='location of config file to use. default: ./config.py')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def run(self, args):
+        """
+        Time single frame inference of each model on this cpu. Accuracy is
+        the lowest val_loss of the training log saved next to the model.
+        """
+        from tensorflow.python.keras.models import load_model
+        from donkeycar.parts.keras import CATEGORICAL_ARCHITECTURES
+        from . import benchmark
+
+        args = self.parse_args(args)
+        cfg = load_config(args.config)
+        if cfg is None:
+            return
+
+        input_shape = dk.util.img.image_shape(cfg.CAMERA_RESOLUTION, cfg.IMAGE_TARGET_SIZE, cfg.IMAGE_ROI)
+        binners = dk.util.binning.make_binners(cfg.BINS)
+
+        results = []
+        for name in args.models:
+            if name in CATEGORICAL_ARCHITECTURES:
+                model = CATEGORICAL_ARCHITECTURES[name](input_shape,
+                                                        dumping_bins=binners['user/dumping'].n_bins,
+                                                        angle_bins=binners['user/angle'].n_bins)
+                val_loss = None
+            else:
+                model = load_model(os.path.expanduser(name))
+                val_loss = benchmark.train_log_val_loss(name)
+
+            result = benchmark.measure_latency(model.predict, model.input_shape[1:], runs=args.runs)
+            result.update({'name': name, 'params': model.count_params(), 'val_loss': val_loss})
+            results.append(result)
+
+        print(benchmark.format_results(results, args.budget))
+
+        if args.budget is not None:
+            best = benchmark.select_model(results, args.budget)
+            if best is None:
+                print('no model fits in {}ms'.format(args.budget))
+            else:
+                print('best model within {}ms: {}'.format(args.budget, best['name']))
+
+
+class Prune(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='prune', usage='%(prog)s [options]')
+        parser.add_argument('model', help='trained categorical model to prune')
+        parser.add_argument('tubs', nargs='+', help='paths to tubs to fine tune and evaluate on')
+        parser.add_argument('--out', required=True, help='path of the pruned model')
+        parser.add_argument('--ratio', type=float, default=0.5, help='fraction of conv filters and dense units removed. default: 0.5')
+        parser.add_argument('--epochs', type=int, default=3, help='fine tuning epochs. default: 3')
+        parser.add_argument('--clusters', type=int, default=0, help='cluster the weights to this many values, 0 to skip. default: 0')
+        parser.add_argument('--runs', type=int, default=100, help='timed frames of the latency benchmark. default: 100')
+        parser.add_argument('--config', default='./config.py', help='location of config file to use. default: ./config.py')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def run(self, args):
+        """
+        Prune a model, fine tune it on the tubs and report the latency and
+        error change against the original.
+        """
+        import json
+        import numpy as np
+        from tensorflow.python.keras.models import load_model
+        from donkeycar.parts.datastore import TubGroup
+        from donkeycar.parts.keras import KerasCategorical
+        from . import benchmark, prune, sweep
+
+        args = self.parse_args(args)
+        cfg = load_config(args.config)
+        if cfg is None:
+            return
+
+        settings = {k: getattr(cfg, k) for k in ('IMAGE_TARGET_SIZE', 'IMAGE_ROI', 'BINS', 'BATCH_SIZE',
+                                                 'TRAIN_TEST_SPLIT', 'SPLIT_BY')}
+        binners = dk.util.binning.make_binners(cfg.BINS)
+        out_path = os.path.expanduser(args.out)
+        out_dir = os.path.dirname(os.path.abspath(out_path))
+
+        # decode the tubs once, shared with donkey sweep
+        tubgroup = TubGroup(','.join(args.tubs))
+        prefix = sweep.build_dataset(tubgroup, out_dir, settings)
+        images, labels, is_train = sweep.load_dataset(prefix)
+        raw = sweep.load_raw_labels(prefix)
+        train_rows = np.flatnonzero(is_train)
+        val_rows = np.flatnonzero(~is_train)
+
+        original = load_model(os.path.expanduser(args.model))
+        pruned, report = prune.prune_model(original, args.ratio)
+        for name, (before, after) in report.items():
+            print('{}: {} -> {}'.format(name, before, after))
+
+        one_hot = [binners['user/dumping'].one_hot, binners['user/angle'].one_hot, None]
+        kl = KerasCategorical(model=pruned, binners=binners)
+        kl.train(sweep.batch_gen(images, labels, train_rows, cfg.BATCH_SIZE, one_hot, seed=0),
+                 sweep.batch_gen(images, labels, val_rows, cfg.BATCH_SIZE, one_hot, seed=1),
+                 saved_model_path=out_path,
+                 epochs=args.epochs,
+                 steps=max(1, len(train_rows) // cfg.BATCH_SIZE),
+                 train_split=len(train_rows) / float(len(is_train)),
+                 use_early_stop=False,
+                 batch_size=cfg.BATCH_SIZE)
+        pruned = load_model(out_path)
+
+        if args.clusters:
+            prune.cluster_model(pruned, args.clusters)
+            pruned.save(out_path)
+
+        results = {}
+        for name, model in (('original', original), ('pruned', pruned)):
+            result = benchmark.measure_latency(model.predict, model.input_shape[1:], runs=args.runs)
+            result.update(prune.evaluate_pilot(model, images, val_rows, binners, raw))
+            result['params'] = model.count_params()
+            results[name] = result
+
+        print('{:<10} {:>10} {:>8} {:>8} {:>10} {:>12}'.format(
+            '', 'params', 'p50 ms', 'p90 ms', 'angle mae', 'throttle mae'))
+        for name, r in results.items():
+            print('{:<10} {:>10} {:>8.1f} {:>8.1f} {:>10.4f} {:>12.4f}'.format(
+                name, r['params'], r['p50_ms'], r['p90_ms'], r['angle_mae'], r['throttle_mae']))
+
+        with open(out_path + '.prune.json', 'w') as f:
+            json.dump({'model': args.model, 'ratio': args.ratio, 'clusters': args.clusters,
+                       'layers': report, 'results': results}, f, indent=2)
+
+
+class Serve(BaseCommand):
+
+    def parse_args(self, args):
+        parser = argparse.ArgumentParser(prog='serve', usage='%(prog)s [options]')
+        parser.add_argument('model', help='categorical model run for the cars')
+        parser.add_argument('--port', type=int, default=9091, help='port to listen on. default: 9091')
+        parser.add_argument('--max_batch', type=int, default=8, help='most frames predicted together. default: 8')
+        parser.add_argument('--max_wait', type=float, default=5, help='ms to wait for more frames once one arrived. default: 5')
+        parser.add_argument('--config', default='./config.py', help='location of config file to use. default: ./config.py')
+        parsed_args = parser.parse_args(args)
+        return parsed_args
+
+    def run(self, args):
+        """
+        Run a pilot for the cars of the local network, see RemotePilot.
+        """
+        import numpy as np
+        from donkeycar.parts.keras import KerasCategorical
+        from donkeycar.parts.remote import InferenceServer
+
+        args = self.parse_args(args)
+        cfg = load_config(args.config)
+        if cfg is None:
+            return
+
+        kl = KerasCategorical(binners=dk.util.binning.make_binners(cfg.BINS))
+        kl.load(os.path.expanduser(args.model))
+        # build the inference graph before the first car connects
+        kl.run_batch(np.zeros((1,) + tuple(kl.model.input_shape[1:]), dtype=np.uint8))
+
+        server = InferenceServer(kl.run_batch, port=args.port,
+                                 max_batch=args.max_batch, max_wait_ms=args.max_wait)
+        print('Serving {} on port {}'.format(args.model, server.port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
+
+
 def execute_from_command_line():
     """
     This is the fuction linked to the "donkey" terminal command.
@@ -434,6 +667,10 @@ def execute_from_command_line():
             'tubcheck': TubCheck,
             'makemovie': MakeMovie,
             'sim': Sim,
+            'sweep': Sweep,
+            'latency': ModelLatency,
+            'prune': Prune,
+            'serve': Serve,
                 }
 
     args = sys.argv[:]
@@ -0,0 +1,75 @@
+"""
+benchmark.py
+
+Measure the single frame inference latency of pilot models on this cpu
+and pick the most accurate one that fits a latency budget.
+"""
+
+import os
+import json
+import time
+
+import numpy as np
+
+
+def measure_latency(predict, input_shape, runs=100, warmup=10, dtype=np.uint8):
+    """
+    Time `predict` on a batch of one frame like the drive loop does.
+
+    Returns a dict with the mean, p50, p90 and max latency in ms.
+    """
+    batch = np.zeros((1,) + tuple(input_shape), dtype=dtype)
+    for _ in range(warmup):
+        predict(batch)
+
+    times = np.empty(runs)
+    for i in range(runs):
+        start = time.perf_counter()
+        predict(batch)
+        times[i] = time.perf_counter() - start
+    times *= 1000.0
+
+    return {'mean_ms': float(times.mean()),
+            'p50_ms': float(np.percentile(times, 50)),
+            'p90_ms': float(np.percentile(times, 90)),
+            'max_ms': float(times.max())}
+
+
+def train_log_val_loss(model_path):
+    """
+    Lowest validation loss in the training log saved next to a model,
+    or None if there is no log.
+    """
+    path = os.path.expanduser(model_path) + '.train_log.json'
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        epochs = json.load(f)['epochs']
+    losses = [e['metrics']['val_loss'] for e in epochs if 'val_loss' in e['metrics']]
+    return min(losses) if losses else None
+
+
+def select_model(results, budget_ms, stat='p90_ms'):
+    """
+    Return the result with the lowest val_loss whose latency fits the budget.
+    Models without a val_loss are only picked if no other fits, the
+    fastest one first. Returns None when nothing fits.
+    """
+    fits = [r for r in results if r[stat] <= budget_ms]
+    if not fits:
+        return None
+    return min(fits, key=lambda r: (r.get('val_loss') is None,
+                                    r.get('val_loss') or 0.0,
+                                    r[stat]))
+
+
+def format_results(results, budget_ms=None, stat='p90_ms'):
+    lines = ['{:<40} {:>10} {:>8} {:>8} {:>10}'.format('model', 'params', 'p50 ms', 'p90 ms', 'val_loss')]
+    for r in sorted(results, key=lambda r: r[stat]):
+        loss = r.get('val_loss')
+        over = budget_ms is not None and r[stat] > budget_ms
+        lines.append('{:<40} {:>10} {:>8.1f} {:>8.1f} {:>10} {}'.format(
+            r['name'][-40:], r['params'], r['p50_ms'], r['p90_ms'],
+            '-' if loss is None else '{:.5f}'.format(loss),
+            'over budget' if over else ''))
+    return '\n'.join(lines)
@@ -0,0 +1,239 @@
+"""
+prune.py
+
+Shrink a trained pilot by removing its least important conv filters and
+dense units. The layers are rebuilt smaller, so the pruned model does
+less work per frame, unlike zeroed weights.
+
+The pruning works on the keras model config and the layer weights as
+numpy arrays, the keras side only rebuilds the model from them.
+"""
+
+import numpy as np
+
+
+PRUNABLE = ('Conv2D', 'SeparableConv2D', 'Dense')
+# layers the filters of the previous layer pass through unchanged
+PASSTHROUGH = ('Dropout', 'Flatten', 'Activation', 'MaxPooling2D', 'AveragePooling2D',
+               'BatchNormalization', 'ReLU', 'LeakyReLU')
+
+
+def inbound_names(layer_config):
+    """
+    Names of the layers feeding a layer in a functional model config.
+    """
+    names = []
+    for node in layer_config.get('inbound_nodes', []):
+        for inbound in node:
+            names.append(inbound[0])
+    return names
+
+
+def importance(class_name, weights):
+    """
+    L1 norm of the weights of every output filter or unit of a layer.
+    """
+    if class_name == 'SeparableConv2D':
+        kernel = weights[1]
+    else:
+        kernel = weights[0]
+    return np.abs(kernel).reshape(-1, kernel.shape[-1]).sum(axis=0)
+
+
+def keep_indices(scores, ratio, min_keep=1):
+    """
+    Sorted indices of the filters kept when removing `ratio` of them,
+    the ones with the lowest scores.
+    """
+    n = len(scores)
+    k = max(min_keep, int(round(n * (1.0 - ratio))))
+    return np.sort(np.argsort(scores)[::-1][:k])
+
+
+def find_consumers(name, layers, consumers):
+    """
+    Follow the outputs of a layer through PASSTHROUGH layers to the layers
+    that use its filters. Returns a list of (layer name, flattened,
+    passthrough names), or None if a consumer can't be pruned with it.
+    """
+    found = []
+    stack = [(c, False, []) for c in consumers.get(name, [])]
+    while stack:
+        current, flat, through = stack.pop()
+        class_name = layers[current]['class_name']
+        if class_name in PRUNABLE:
+            found.append((current, flat, through))
+        elif class_name in PASSTHROUGH:
+            flat = flat or class_name == 'Flatten'
+            stack += [(c, flat, through + [current]) for c in consumers.get(current, [])]
+        else:
+            return None
+    return found
+
+
+def slice_input(class_name, weights, keep, channels, flattened):
+    """
+    Remove the input channels of a consumer layer that are not in keep.
+    """
+    weights = list(weights)
+    if class_name == 'Dense':
+        rows = weights[0].shape[0]
+        if flattened:
+            # channels last: row r of the flattened input is channel r % channels
+            mask = np.isin(np.arange(rows) % channels, keep)
+        else:
+            mask = np.zeros(rows, dtype=bool)
+            mask[keep] = True
+        weights[0] = weights[0][mask]
+    elif class_name == 'Conv2D':
+        weights[0] = weights[0][:, :, keep, :]
+    elif class_name == 'SeparableConv2D':
+        multiplier = weights[0].shape[3]
+        weights[0] = weights[0][:, :, keep, :]
+        # pointwise input c * multiplier + m comes from input channel c
+        rows = (keep[:, None] * multiplier + np.arange(multiplier)).ravel()
+        weights[1] = weights[1][:, :, rows, :]
+    return weights
+
+
+def slice_output(class_name, weights, keep):
+    weights = list(weights)
+    if class_name == 'SeparableConv2D':
+        weights[1] = weights[1][..., keep]
+        if len(weights) > 2:
+            weights[2] = weights[2][keep]
+    else:
+        weights[0] = weights[0][..., keep]
+        if len(weights) > 1:
+            weights[1] = weights[1][keep]
+    return weights
+
+
+def prune_config(config, weights, ratio, skip=()):
+    """
+    Remove `ratio` of the filters of every conv layer and of the units of
+    every dense layer, except the outputs and the layers in skip.
+
+    Parameters
+    ----------
+    config : dict
+        Functional model config, from model.get_config().
+    weights : dict
+        Layer name to the list of its weight arrays.
+    ratio : float
+        Fraction of the filters or units removed from each layer.
+
+    Returns
+    -------
+    The new config, the new weights and a dict of layer name to
+    (filters before, filters after).
+    """
+    import copy
+    config = copy.deepcopy(config)
+    weights = {name: list(w) for name, w in weights.items()}
+
+    layers = {l['config']['name']: l for l in config['layers']}
+    outputs = set(o[0] for o in config['output_layers'])
+    consumers = {}
+    for l in config['layers']:
+        for inbound in inbound_names(l):
+            consumers.setdefault(inbound, []).append(l['config']['name'])
+
+    report = {}
+    original = {name: list(w) for name, w in weights.items()}
+    for l in config['layers']:
+        name = l['config']['name']
+        class_name = l['class_name']
+        if class_name not in PRUNABLE or name in outputs or name in skip:
+            continue
+        found = find_consumers(name, layers, consumers)
+        if not found:
+            continue
+
+        scores = importance(class_name, original[name])
+        keep = keep_indices(scores, ratio)
+        if len(keep) == len(scores):
+            continue
+
+        weights[name] = slice_output(class_name, weights[name], keep)
+        l['config']['units' if class_name == 'Dense' else 'filters'] = len(keep)
+        for consumer, flattened, through in found:
+            for t in through:
+                if layers[t]['class_name'] == 'BatchNormalization':
+                    weights[t] = [w[keep] for w in weights[t]]
+            weights[consumer] = slice_input(layers[consumer]['class_name'], weights[consumer],
+                                            keep, len(scores), flattened)
+        report[name] = (len(scores), len(keep))
+
+    return config, weights, report
+
+
+def cluster_weights(w, n_clusters, iters=10):
+    """
+    Replace the weights by the nearest of n_clusters shared values found
+    with k-means, so the saved model compresses much better.
+    """
+    flat = w.ravel()
+    centers = np.linspace(flat.min(), flat.max(), n_clusters)
+    for _ in range(iters):
+        assign = np.abs(flat[:, None] - centers[None, :]).argmin(axis=1)
+        sums = np.bincount(assign, weights=flat, minlength=n_clusters)
+        counts = np.bincount(assign, minlength=n_clusters)
+        used = counts > 0
+        centers[used] = sums[used] / counts[used]
+    assign = np.abs(flat[:, None] - centers[None, :]).argmin(axis=1)
+    return centers[assign].reshape(w.shape).astype(w.dtype)
+
+
+def count_params(weights):
+    return int(sum(w.size for ws in weights.values() for w in ws))
+
+
+def prune_model(model, ratio, skip=()):
+    """
+    Return a smaller copy of a keras model with `ratio` of its filters and
+    units removed, see prune_config, and the pruning report.
+    """
+    from tensorflow.python.keras.models import Model
+
+    weights = {l.name: l.get_weights() for l in model.layers}
+    config, weights, report = prune_config(model.get_config(), weights, ratio, skip)
+    pruned = Model.from_config(config)
+    for layer in pruned.layers:
+        layer.set_weights(weights[layer.name])
+
+    optimizer = model.optimizer
+    pruned.compile(optimizer=optimizer.__class__.from_config(optimizer.get_config()),
+                   loss=model.loss, loss_weights=model.loss_weights)
+    return pruned, report
+
+
+def cluster_model(model, n_clusters):
+    """
+    Cluster the kernels of the conv and dense layers of a model in place.
+    """
+    for layer in model.layers:
+        if layer.__class__.__name__ in PRUNABLE:
+            weights = layer.get_weights()
+            kernels = 2 if layer.__class__.__name__ == 'SeparableConv2D' else 1
+            weights[:kernels] = [cluster_weights(w, n_clusters) for w in weights[:kernels]]
+            layer.set_weights(weights)
+
+
+def evaluate_pilot(model, images, rows, binners, raw, batch_size=64):
+    """
+    Mean absolute error of the decoded dumping, angle and throttle outputs
+    of a categorical pilot against the recorded values of the dataset rows.
+    raw is the list of recorded dumping, angle and throttle arrays.
+    """
+    errors = np.zeros(3)
+    for start in range(0, len(rows), batch_size):
+        ix = rows[start:start + batch_size]
+        dumping, angle, throttle = model.predict(np.asarray(images[ix]), batch_size=len(ix))
+        errors[0] += np.abs(binners['user/dumping'].decode(dumping) - raw[0][ix]).sum()
+        errors[1] += np.abs(binners['user/angle'].decode(angle) - raw[1][ix]).sum()
+        errors[2] += np.abs(throttle[:, 0] - raw[2][ix]).sum()
+    errors /= max(1, len(rows))
+    return {'dumping_mae': float(errors[0]),
+            'angle_mae': float(errors[1]),
+            'throttle_mae': float(errors[2])}
@@ -0,0 +1,310 @@
+"""
+sweep.py
+
+Train a grid of models on the same data in parallel and rank them.
+
+The tubs are decoded once into a memory mapped array shared by all the
+trials, and every finished trial is saved under a hash of its parameters
+so running the sweep again only trains the new ones.
+"""
+
+import os
+import json
+import time
+import hashlib
+import multiprocessing
+
+import numpy as np
+
+from donkeycar import util
+
+# bump when the files written by build_dataset change
+DATASET_VERSION = 2
+
+
+def trial_key(params, context=None):
+    """
+    Stable hash of the parameters of a trial and of the sweep context,
+    see sweep_context.
+    """
+    text = json.dumps([params, context] if context else params, sort_keys=True)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+def dataset_key(tubgroup, settings):
+    """
+    Hash of the records of the tubs and of the settings that change the
+    decoded dataset.
+    """
+    parts = [DATASET_VERSION]
+    parts += [[t.path, t.get_watermark(), len(t.get_df())] for t in tubgroup.tubs]
+    parts.append([settings[k] for k in ('IMAGE_TARGET_SIZE', 'IMAGE_ROI', 'BINS',
+                                        'TRAIN_TEST_SPLIT', 'SPLIT_BY')])
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+def sweep_context(tubgroup, settings):
+    """
+    Hash of the dataset and of the training settings shared by all the
+    trials, results of another context are not reused.
+    """
+    parts = [dataset_key(tubgroup, settings),
+             [settings.get(k) for k in ('BATCH_SIZE', 'EPOCHS')]]
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:12]
+
+
+def build_dataset(tubgroup, out_dir, settings, image_key='cam/image_array',
+                  y_keys=('user/dumping', 'user/angle', 'user/throttle')):
+    """
+    Decode the images of the tubs once into a .npy array and save the
+    labels and the train/val split next to it. Reused while the tubs and
+    settings don't change.
+
+    Returns the path prefix of the dataset, see load_dataset.
+    """
+    binners = util.binning.make_binners(settings['BINS'])
+    tubgroup.set_image_options(settings['IMAGE_TARGET_SIZE'], settings['IMAGE_ROI'])
+    tubgroup.set_binners(binners)
+
+    prefix = os.path.join(out_dir, 'dataset_' + dataset_key(tubgroup, settings))
+    if os.path.exists(prefix + '.labels.npz'):
+        return prefix
+
+    df = tubgroup.get_df()
+    paths = df[image_key].values
+    first = tubgroup.load_image(paths[0])
+    images = np.lib.format.open_memmap(prefix + '.images.npy', mode='w+',
+                                       dtype=first.dtype, shape=(len(df),) + first.shape)
+    for i, path in enumerate(paths):
+        images[i] = tubgroup.load_image(path)
+    images.flush()
+    del images
+
+    labels = {}
+    for i, key in enumerate(y_keys):
+        if key in binners:
+            # store the bin indices, trials build the one hot arrays per batch
+            labels['y{}'.format(i)] = df[util.binning.bin_key(key)].values.astype(np.int16)
+        else:
+            labels['y{}'.format(i)] = df[key].values.astype(np.float32)
+        # the recorded values, to measure the error of decoded outputs
+        labels['raw{}'.format(i)] = df[key].values.astype(np.float32)
+    is_train = tubgroup.get_split(settings['TRAIN_TEST_SPLIT'], by=settings['SPLIT_BY'])
+    # written last, its presence marks a complete dataset
+    np.savez(prefix + '.labels.npz', is_train=is_train, y_keys=np.array(y_keys), **labels)
+    return prefix
+
+
+def load_dataset(prefix):
+    """
+    Return the memory mapped images, the list of label arrays and the
+    train mask of a dataset created by build_dataset.
+    """
+    images = np.load(prefix + '.images.npy', mmap_mode='r')
+    with np.load(prefix + '.labels.npz') as f:
+        labels = [f['y{}'.format(i)] for i in range(len(f['y_keys']))]
+        is_train = f['is_train']
+    return images, labels, is_train
+
+
+def load_raw_labels(prefix):
+    """
+    Return the recorded values of the labels of a dataset, before binning.
+    """
+    with np.load(prefix + '.labels.npz') as f:
+        return [f['raw{}'.format(i)] for i in range(len(f['y_keys']))]
+
+
+def batch_gen(images, labels, rows, batch_size, one_hot, seed=None):
+    """
+    Yield random batches of the dataset rows. Labels stored as bin indices
+    are converted by the matching one_hot function (None for the others).
+    """
+    random = np.random.RandomState(seed)
+    while True:
+        # sorted rows read the memory map in order
+        ix = np.sort(random.choice(rows, batch_size))
+        X = [np.asarray(images[ix])]
+        Y = [f(y[ix]) if f else y[ix] for y, f in zip(labels, one_hot)]
+        yield X, Y
+
+
+def load_results(out_dir, context=None):
+    """
+    Return the results of the finished trials, keyed by trial key. Only
+    the ones of the sweep context are returned when it is given.
+    """
+    results = {}
+    results_dir = os.path.join(out_dir, 'results')
+    if not os.path.exists(results_dir):
+        return results
+    for name in os.listdir(results_dir):
+        if name.endswith('.json'):
+            with open(os.path.join(results_dir, name), 'r') as f:
+                result = json.load(f)
+            if context is None or result.get('context') == context:
+                results[result['key']] = result
+    return results
+
+
+def leaderboard(results):
+    """
+    Return the results ordered from the lowest validation loss.
+    """
+    return sorted(results, key=lambda r: r.get('val_loss', float('inf')))
+
+
+def format_leaderboard(results):
+    lines = ['{:>4}  {:>10}  {:>8}  {:>10}  {}'.format('rank', 'val_loss', 'minutes', 'samples/s', 'params')]
+    for i, r in enumerate(leaderboard(results)):
+        lines.append('{:>4}  {:>10.5f}  {:>8.1f}  {:>10.0f}  {}'.format(
+            i + 1, r.get('val_loss', float('inf')), r.get('train_s', 0) / 60.0,
+            r.get('samples_per_s', 0), json.dumps(r['params'], sort_keys=True)))
+    return '\n'.join(lines)
+
+
+def init_worker(slots, threads):
+    """
+    Pin the pool worker to a free set of cpus and limit the threads
+    tensorflow uses, before tensorflow is imported.
+    """
+    cpus = slots.get()
+    if cpus:
+        util.proc.set_cpu_affinity(cpus)
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except AttributeError:
+        from tensorflow.python.keras import backend as K
+        K.set_session(tf.Session(config=tf.ConfigProto(intra_op_parallelism_threads=threads,
+                                                       inter_op_parallelism_threads=1)))
+
+
+def run_trial(trial):
+    """
+    Train one model of the sweep and save its result. Runs in a pool worker.
+    """
+    from tensorflow.python.keras import backend as K
+    from donkeycar.parts import keras
+
+    params, prefix, out_dir, settings, context = trial
+    key = trial_key(params, context)
+    images, labels, is_train = load_dataset(prefix)
+    binners = util.binning.make_binners(settings['BINS'])
+    one_hot = [binners['user/dumping'].one_hot, binners['user/angle'].one_hot, None]
+
+    batch_size = params.get('batch_size', settings['BATCH_SIZE'])
+    name = params.get('model', 'default')
+    model_fn = keras.CATEGORICAL_ARCHITECTURES.get(name) or getattr(keras, name)
+    model = model_fn(input_shape=images.shape[1:],
+                     dumping_bins=binners['user/dumping'].n_bins,
+                     angle_bins=binners['user/angle'].n_bins)
+    if 'loss_weights' in params or 'lr' in params:
+        optimizer = model.optimizer.__class__(lr=params.get('lr', 0.001))
+        model.compile(optimizer=optimizer, loss=model.loss,
+                      loss_weights=params.get('loss_weights', model.loss_weights))
+    kl = keras.KerasCategorical(model=model, binners=binners)
+
+    train_rows = np.flatnonzero(is_train)
+    val_rows = np.flatnonzero(~is_train)
+    steps = max(1, len(train_rows) // batch_size)
+    train_frac = len(train_rows) / float(len(is_train))
+
+    trial_dir = os.path.join(out_dir, 'trials', key)
+    if not os.path.exists(trial_dir):
+        os.makedirs(trial_dir)
+    model_path = os.path.join(trial_dir, 'model.h5')
+
+    start = time.time()
+    hist = kl.train(batch_gen(images, labels, train_rows, batch_size, one_hot, seed=0),
+                    batch_gen(images, labels, val_rows, batch_size, one_hot, seed=1),
+                    saved_model_path=model_path,
+                    epochs=params.get('epochs', settings.get('EPOCHS', 100)),
+                    steps=steps,
+                    train_split=train_frac,
+                    verbose=0,
+                    batch_size=batch_size)
+    val_loss = hist.history.get('val_loss', [float('inf')])
+
+    with open(model_path + '.train_log.json', 'r') as f:
+        epochs = json.load(f)['epochs']
+
+    result = {'key': key,
+              'context': context,
+              'params': params,
+              'val_loss': float(min(val_loss)),
+              'epochs': len(val_loss),
+              'train_s': time.time() - start,
+              'samples_per_s': float(np.mean([e['samples_per_s'] for e in epochs])),
+              'model_path': model_path}
+
+    with open(os.path.join(out_dir, 'results', key + '.json'), 'w') as f:
+        json.dump(result, f, indent=2)
+
+    # free the graph before the worker takes the next trial
+    K.clear_session()
+    return result
+
+
+def run_sweep(tubgroup, grid, out_dir, settings, workers=1, cpus_per_trial=None):
+    """
+    Train a model for every combination of the grid parameters that
+    doesn't have a result yet and return all the results ranked.
+
+    Parameters
+    ----------
+    tubgroup : TubGroup
+        Data of all the trials.
+    grid : dict
+        Parameter name to list of values, see util.data.param_gen. Known
+        parameters are batch_size, epochs, lr, loss_weights and model, a key
+        of CATEGORICAL_ARCHITECTURES or the name of a model function of
+        donkeycar.parts.keras.
+    out_dir : str
+        Folder of the dataset, the trained models and the results.
+    settings : dict
+        The config values used by the sweep.
+    workers : int
+        Number of trials trained at the same time.
+    cpus_per_trial : int
+        Cpus each worker is pinned to. Defaults to the cpus split evenly
+        between the workers.
+    """
+    out_dir = os.path.expanduser(out_dir)
+    results_dir = os.path.join(out_dir, 'results')
+    if not os.path.exists(results_dir):
+        os.makedirs(results_dir)
+
+    # results of other tubs or settings in the same folder are ignored
+    context = sweep_context(tubgroup, settings)
+    results = load_results(out_dir, context)
+    trials = [p for p in util.data.param_gen(grid) if trial_key(p, context) not in results]
+    print('{} trials, {} already done'.format(len(trials) + len(results), len(results)))
+
+    if trials:
+        prefix = build_dataset(tubgroup, out_dir, settings)
+
+        n_cpus = multiprocessing.cpu_count()
+        cpus_per_trial = cpus_per_trial or max(1, n_cpus // workers)
+        # spawn so every worker starts its own tensorflow
+        ctx = multiprocessing.get_context('spawn')
+        slots = ctx.Queue()
+        for w in range(workers):
+            first = (w * cpus_per_trial) % n_cpus
+            slots.put(list(range(first, min(first + cpus_per_trial, n_cpus))))
+
+        with ctx.Pool(workers, initializer=init_worker, initargs=(slots, cpus_per_trial)) as pool:
+            for result in pool.imap_unordered(run_trial, [(p, prefix, out_dir, settings, context) for p in trials]):
+                results[result['key']] = result
+                print('trial {} val_loss {:.5f} {}'.format(result['key'], result['val_loss'],
+                                                          json.dumps(result['params'], sort_keys=True)))
+
+    ranked = leaderboard(results.values())
+    with open(os.path.join(out_dir, 'leaderboard.json'), 'w') as f:
+        json.dump(ranked, f, indent=2)
+    return ranked
@@ -5,14 +5,84 @@ Created on Sun Jun 25 11:07:48 2017
 
 @author: wroscoe
 """
+import re
+
+import numpy as np
+
+
+HISTORY_KEY = re.compile(r'^(.+)\[-(\d+):\]$')
+
+
+def parse_history_key(key):
+    """
+    Split a history key like 'cam/image_array[-3:]' into the channel
+    name and the number of entries. Returns None for other keys.
+    """
+    m = HISTORY_KEY.match(key)
+    if m is None:
+        return None
+    return m.group(1), int(m.group(2))
+
+
+class HistoryBuffer:
+    """
+    Preallocated ring buffer of the last values of a channel.
+
+    Every value is written twice, at its slot and `length` slots later,
+    so the last n values are always a contiguous (n, ...) view that can be
+    returned without copying.
+    """
+    def __init__(self, length, shape=None, dtype=None):
+        self.length = length
+        self.data = None
+        self.pos = 0
+        self.count = 0
+        self.views = {}
+        if shape is not None:
+            self.allocate(shape, dtype or np.uint8)
+
+    def allocate(self, shape, dtype):
+        self.data = np.zeros((2 * self.length,) + tuple(shape), dtype=dtype)
+        self.views = {}
+
+    def append(self, value):
+        if self.data is None:
+            value = np.asarray(value)
+            self.allocate(value.shape, value.dtype)
+        i = self.pos
+        self.data[i] = value
+        self.data[i + self.length] = value
+        self.pos = (i + 1) % self.length
+        self.count += 1
+
+    def last(self, n):
+        """
+        View of the last n values, oldest first. Slots that were never
+        written are zeros.
+        """
+        if self.data is None:
+            return None
+        if n > self.length:
+            raise IndexError('history of {} only keeps {} values'.format(n, self.length))
+        views = self.views.get(n)
+        if views is None:
+            # one view per write position, so reading doesn't allocate
+            L = self.length
+            views = self.views[n] = [self.data[p + L - n:p + L] for p in range(L)]
+        return views[self.pos]
 
 
 class Memory:
     """
     A convenience class to save key/value pairs.
+
+    Channels can also keep a history of their last values. Getting
+    'cam/image_array[-3:]' returns the last 3 images stacked in an array.
     """
     def __init__(self, *args, **kw):
         self.d = {}
+        self.histories = {}
+        self.history_keys = {}
 
     def __setitem__(self, key, value):
         if type(key) is not tuple:
@@ -21,6 +91,8 @@ class Memory:
 
         for i, k in enumerate(key):
             self.d[k] = value[i]
+            if self.histories:
+                self.append_history(k, value[i])
 
     def __getitem__(self, key):
         if type(key) is tuple:
@@ -30,6 +102,9 @@ class Memory:
 
     def update(self, new_d):
         self.d.update(new_d)
+        if self.histories:
+            for k, v in new_d.items():
+                self.append_history(k, v)
 
     def put(self, keys, inputs):
         if len(keys) > 1:
@@ -39,12 +114,65 @@ class Memory:
                 except IndexError as e:
                     error = str(e) + ' issue with keys: ' + str(key)
                     raise IndexError(error)
+                if self.histories:
+                    self.append_history(key, inputs[i])
         else:
             self.d[keys[0]] = inputs
+            if self.histories:
+                self.append_history(keys[0], inputs)
+
+    def get(self, keys, out=None):
+        """
+        Return the values of the keys. If a list is given as `out`
+        the values are written to it instead of a new list.
+        """
+        if out is None:
+            out = [None] * len(keys)
+        for i in range(len(keys)):
+            k = keys[i]
+            v = self.d.get(k)
+            if v is None and self.histories and self.add_history_key(k):
+                v = self.get_history(k)
+            out[i] = v
+        return out
+
+    def add_history(self, key, length, shape=None, dtype=None):
+        """
+        Keep the last `length` values of a channel in a ring buffer.
+        The buffer is allocated on the first value if no shape is given.
+        """
+        history = self.histories.get(key)
+        if history is None or history.length < length:
+            self.histories[key] = HistoryBuffer(length, shape, dtype)
+        return self.histories[key]
+
+    def append_history(self, key, value):
+        history = self.histories.get(key)
+        if history is not None and value is not None:
+            history.append(value)
+
+    def add_history_key(self, history_key):
+        """
+        Start keeping the history needed by a key like 'cam/image_array[-3:]'.
+        Returns False if the key doesn't ask for a history.
+        """
+        if history_key in self.history_keys:
+            return self.history_keys[history_key] is not None
+        parsed = self.history_keys[history_key] = parse_history_key(history_key)
+        if parsed is None:
+            return False
+        self.add_history(*parsed)
+        return True
 
-    def get(self, keys):
-        result = [self.d.get(k) for k in keys]
-        return result
+    def get_history(self, history_key):
+        """
+        Return a view of the last values of a channel given a key like
+        'cam/image_array[-3:]'.
+        """
+        if not self.add_history_key(history_key):
+            raise KeyError(history_key)
+        key, n = self.history_keys[history_key]
+        return self.histories[key].last(n)
 
     def keys(self):
         return self.d.keys()
@@ -46,7 +46,11 @@ class PWMSteering:
         self.left_pulse = left_pulse
         self.right_pulse = right_pulse
 
-    def run(self, angle):
+    def run(self, angle, frame_time=None):
+        """
+        Set the pulse for the angle. If the capture time of the frame the
+        angle was computed from is given, return its age in seconds.
+        """
         # map absolute angle to angle that vehicle can implement.
         pulse = dk.util.data.map_range(
             angle,
@@ -56,6 +60,9 @@ class PWMSteering:
 
         self.controller.set_pulse(pulse)
 
+        if frame_time is not None:
+            return time.time() - frame_time
+
     def shutdown(self):
         self.run(0)  # set steering straight
 
@@ -83,7 +90,7 @@ class PWMThrottle:
         self.controller.set_pulse(self.zero_pulse)
         time.sleep(1)
 
-    def run(self, throttle):
+    def run(self, throttle, frame_time=None):
         if throttle > 0:
             pulse = dk.util.data.map_range(throttle,
                                            0, self.MAX_THROTTLE,
@@ -95,6 +102,9 @@ class PWMThrottle:
 
         self.controller.set_pulse(pulse)
 
+        if frame_time is not None:
+            return time.time() - frame_time
+
     def shutdown(self):
         self.run(0)  # stop vehicle
 
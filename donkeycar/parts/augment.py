@@ -0,0 +1,158 @@
+"""
+augment.py
+
+Image augmentation and label encoding applied to whole training batches
+with numpy, instead of one record at a time.
+"""
+
+import numpy as np
+
+from donkeycar import util
+from donkeycar.util.times import Timings
+
+
+class BatchAugmentation:
+    """
+    Batch transform for Tub.get_train_gen.
+
+    Accepts a dict of key to batch array and returns it transformed. Each
+    stage works on the whole batch and its time is kept in `timings`.
+    """
+
+    def __init__(self, image_key='cam/image_array',
+                 brightness=0.0, contrast=0.0,
+                 flip=False, flip_keys=('user/angle',),
+                 shift=0,
+                 bin_keys=(),
+                 binners=None,
+                 soft_targets=None,
+                 soft_weight=1.0,
+                 seed=None):
+        """
+        Parameters
+        ----------
+        image_key : str
+            Key of the images to augment.
+        brightness : float
+            Max brightness change as a fraction of 255.
+        contrast : float
+            Max contrast change, the contrast is scaled by 1 +/- contrast.
+        flip : bool
+            Mirror half of the images horizontally.
+        flip_keys : list of str
+            Labels negated when their image is mirrored, ie the angle.
+        shift : int
+            Max shift of the images in pixels, edges are repeated.
+        bin_keys : list of str
+            Labels converted to 15 bin categorical arrays after augmentation.
+        binners : dict
+            Label key to the LinearBinner used to convert it, for labels
+            with another number of bins or range.
+        soft_targets : dict
+            Label key to the key of a teacher output, ie a softmax
+            distribution over the bins, used as target for distillation.
+        soft_weight : float
+            Weight of the teacher output in the target, the rest is the
+            label. As cross entropy is linear in the target this is the
+            same as weighting the two losses.
+        seed : int
+            Seed of the random generator.
+        """
+        self.image_key = image_key
+        self.brightness = brightness
+        self.contrast = contrast
+        self.flip = flip
+        self.flip_keys = list(flip_keys)
+        self.shift = shift
+        self.binners = dict(binners or {})
+        for key in bin_keys:
+            self.binners.setdefault(key, util.binning.DEFAULT_BINNER)
+        self.soft_targets = dict(soft_targets or {})
+        self.soft_weight = soft_weight
+        self.random = np.random.RandomState(seed)
+        self.timings = Timings()
+
+    def brightness_contrast(self, imgs):
+        n = len(imgs)
+        shape = (n,) + (1,) * (imgs.ndim - 1)
+        imgs = imgs.astype(np.float32)
+        if self.contrast:
+            c = self.random.uniform(1 - self.contrast, 1 + self.contrast, n).astype(np.float32)
+            mean = imgs.mean(axis=tuple(range(1, imgs.ndim)), keepdims=True)
+            imgs -= mean
+            imgs *= c.reshape(shape)
+            imgs += mean
+        if self.brightness:
+            b = self.random.uniform(-self.brightness, self.brightness, n).astype(np.float32) * 255
+            imgs += b.reshape(shape)
+        np.clip(imgs, 0, 255, out=imgs)
+        return imgs.astype(np.uint8)
+
+    def flip_batch(self, imgs, batch):
+        mask = self.random.rand(len(imgs)) < 0.5
+        imgs = imgs.copy()
+        imgs[mask] = imgs[mask, :, ::-1]
+        for key in self.flip_keys:
+            if key in batch:
+                labels = np.array(batch[key], dtype=np.float64)
+                if labels.ndim == 1:
+                    labels[mask] *= -1
+                else:
+                    # distributions over symmetric bins are mirrored
+                    labels[mask] = labels[mask, ::-1]
+                batch[key] = labels
+        return imgs
+
+    def shift_batch(self, imgs):
+        n, h, w = imgs.shape[:3]
+        dy = self.random.randint(-self.shift, self.shift + 1, n)
+        dx = self.random.randint(-self.shift, self.shift + 1, n)
+        rows = np.clip(np.arange(h)[None, :] - dy[:, None], 0, h - 1)
+        cols = np.clip(np.arange(w)[None, :] - dx[:, None], 0, w - 1)
+        # one gather for the whole batch
+        return imgs[np.arange(n)[:, None, None], rows[:, :, None], cols[:, None, :]]
+
+    def bin_labels(self, batch):
+        for key, binner in self.binners.items():
+            # use the indices cached by Tub.set_binners unless the label was flipped
+            ixs = batch.pop(util.binning.bin_key(key), None)
+            if key not in batch:
+                continue
+            if ixs is None or (self.flip and key in self.flip_keys):
+                ixs = binner.indices(batch[key])
+            batch[key] = binner.one_hot(ixs)
+
+    def mix_soft_targets(self, batch):
+        w = self.soft_weight
+        for key, soft_key in self.soft_targets.items():
+            soft = batch.pop(soft_key, None)
+            if soft is None or key not in batch:
+                continue
+            soft = np.asarray(soft, dtype=np.float64).reshape(np.shape(batch[key]))
+            batch[key] = soft if w == 1.0 else w * soft + (1 - w) * batch[key]
+
+    def __call__(self, batch):
+        imgs = batch.get(self.image_key)
+
+        if imgs is not None:
+            imgs = np.asarray(imgs)
+            if self.brightness or self.contrast:
+                with self.timings.time('brightness_contrast'):
+                    imgs = self.brightness_contrast(imgs)
+            if self.flip:
+                with self.timings.time('flip'):
+                    imgs = self.flip_batch(imgs, batch)
+            if self.shift:
+                with self.timings.time('shift'):
+                    imgs = self.shift_batch(imgs)
+            batch[self.image_key] = imgs
+
+        if self.binners:
+            with self.timings.time('bin'):
+                self.bin_labels(batch)
+
+        if self.soft_targets:
+            with self.timings.time('soft_targets'):
+                self.mix_soft_targets(batch)
+
+        return batch
@@ -4,15 +4,32 @@ import numpy as np
 from PIL import Image
 import glob
 
+from donkeycar.tracer import get_tracer
+
 
 class BaseCamera:
+    """
+    Cameras keep the latest frame and the time it was captured. When
+    `stamp_frames` is set the capture time is returned with the frame so
+    the glass to wheel latency can be measured downstream.
+    """
+    stamp_frames = False
+    frame_time = None
+    stamped = None
 
     def run_threaded(self):
+        if self.stamp_frames:
+            # reuse the output list instead of building a tuple every loop
+            if self.stamped is None:
+                self.stamped = [None, None]
+            self.stamped[0] = self.frame
+            self.stamped[1] = self.frame_time
+            return self.stamped
         return self.frame
 
 
 class PiCamera(BaseCamera):
-    def __init__(self, resolution=(120, 160), framerate=20):
+    def __init__(self, resolution=(120, 160), framerate=20, stamp_frames=False):
         from picamera.array import PiRGBArray
         from picamera import PiCamera
         resolution = (resolution[1], resolution[0])
@@ -28,6 +45,8 @@ class PiCamera(BaseCamera):
         # initialize the frame and the variable used to indicate
         # if the thread should be stopped
         self.frame = None
+        self.frame_time = None
+        self.stamp_frames = stamp_frames
         self.on = True
 
         print('PiCamera loaded.. .warming camera')
@@ -36,16 +55,27 @@ class PiCamera(BaseCamera):
     def run(self):
         f = next(self.stream)
         frame = f.array
+        frame_time = time.time()
         self.rawCapture.truncate(0)
+        if self.stamp_frames:
+            return frame, frame_time
         return frame
 
     def update(self):
+        tracer = get_tracer()
+        capture_start = time.perf_counter()
+
         # keep looping infinitely until the thread is stopped
         for f in self.stream:
+            tracer.complete('PiCamera.capture', capture_start, time.perf_counter(), cat='camera')
+
             # grab the frame from the stream and clear the stream in
             # preparation for the next frame
-            self.frame = f.array
-            self.rawCapture.truncate(0)
+            with tracer.span('PiCamera.frame', cat='camera'):
+                self.frame = f.array
+                self.frame_time = time.time()
+                self.rawCapture.truncate(0)
+            capture_start = time.perf_counter()
 
             # if the thread indicator variable is set, stop the thread
             if not self.on:
@@ -6,6 +6,7 @@ import struct
 
 
 from donkeycar.parts.web_controller.web import LocalWebController
+from donkeycar.tracer import get_tracer
 
 class Joystick():
     """
@@ -276,8 +277,10 @@ class JoystickController(object):
         while self.running and not self.init_js():
             time.sleep(5)
 
+        tracer = get_tracer()
         while self.running:
-            button, button_state, axis, axis_val = self.js.poll()
+            with tracer.span('JoystickController.poll', cat='controller'):
+                button, button_state, axis, axis_val = self.js.poll()
 
             if axis == self.dumping_axis:
                 self.dumping = self.dumping_scale * axis_val
@@ -12,6 +12,7 @@ import json
 import datetime
 import random
 import tarfile
+import zlib
 
 import numpy as np
 import pandas as pd
@@ -23,6 +24,47 @@ from ..log import get_logger
 logger = get_logger(__name__)
 
 
+def sequence_view(arr, offsets):
+    """
+    Return a function that gathers windows of `arr` at the given offsets.
+
+    Called with an array of positions p it returns the values at
+    p + offsets as a (len(p), len(offsets), ...) array. When the offsets
+    are evenly spaced the windows come from a strided view of `arr`, so
+    only the selected windows are copied.
+    """
+    offsets = np.asarray(offsets)
+    steps = np.diff(offsets)
+
+    if len(offsets) > 1 and np.all(steps == steps[0]) and steps[0] > 0:
+        step = int(steps[0])
+        n = len(arr) - (len(offsets) - 1) * step
+        windows = np.lib.stride_tricks.as_strided(
+            arr,
+            shape=(max(n, 0), len(offsets)) + arr.shape[1:],
+            strides=(arr.strides[0], arr.strides[0] * step) + arr.strides[1:],
+            writeable=False)
+        first = int(offsets[0])
+        return lambda p: windows[p + first]
+
+    return lambda p: arr[p[:, None] + offsets]
+
+
+def split_hash(name, ixs):
+    """
+    Stable pseudo random numbers in [0, 1) for the record ixs of the tub
+    `name`. They don't depend on the other tubs or on the run, so the
+    train/validation split of a record never changes.
+    """
+    # offset the ixs by the tub name and mix them with splitmix64
+    seed = (zlib.crc32(name.encode('utf-8')) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    x = np.asarray(ixs, dtype=np.int64).astype(np.uint64) + np.uint64(seed)
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    x = x ^ (x >> np.uint64(31))
+    return (x >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
 class Tub(object):
     """
     A datastore to store sensor data in a key, value format.
@@ -38,6 +80,12 @@ class Tub(object):
     >>> t=Tub(path=path, inputs=inputs, types=types)
 
     """
+    # size (height, width) and crop ((top, bottom), (left, right)) of the
+    # images read from the tub, see set_image_options
+    image_target_size = None
+    image_roi = None
+    # label key to LinearBinner, see set_binners
+    binners = None
 
     def __init__(self, path, inputs=None, types=None):
 
@@ -70,6 +118,10 @@ class Tub(object):
 
             raise AttributeError(msg)
 
+        self.input_types = dict(zip(self.inputs, self.types))
+        # reused by put_record for every record written
+        self.json_data = {}
+        self.sequence_cache = {}
         self.start_time = time.time()
 
     def get_last_ix(self):
@@ -79,7 +131,9 @@ class Tub(object):
         return -1
 
     def update_df(self):
-        df = pd.DataFrame([self.get_json_record(i) for i in self.get_index(shuffled=False)])
+        index = self.get_index(shuffled=False)
+        df = pd.DataFrame([self.get_json_record(i) for i in index], index=index)
+        self.add_bin_columns(df)
         self.df = df
 
     def get_df(self):
@@ -117,8 +171,7 @@ class Tub(object):
         return list(self.meta['types'])
 
     def get_input_type(self, key):
-        input_types = dict(zip(self.inputs, self.types))
-        return input_types.get(key)
+        return self.input_types.get(key)
 
     def write_json_record(self, json_data):
         path = self.get_json_record_path(self.current_ix)
@@ -182,7 +235,8 @@ class Tub(object):
         return a record with references to the saved values that can
         be saved in a csv.
         """
-        json_data = {}
+        json_data = self.json_data
+        json_data.clear()
 
         for key, val in data.items():
             typ = self.get_input_type(key)
@@ -190,7 +244,7 @@ class Tub(object):
             if typ in ['str', 'float', 'int', 'boolean']:
                 json_data[key] = val
 
-            elif typ is 'image':
+            elif typ == 'image':
                 name = self.make_file_name(key, ext='.jpg')
                 val.save(os.path.join(self.path, name))
                 json_data[key] = name
@@ -236,6 +290,146 @@ class Tub(object):
         data = self.read_record(json_data)
         return data
 
+    def set_image_options(self, target_size=None, roi=None):
+        """
+        Read images at a reduced size and/or cropped.
+
+        Parameters
+        ----------
+        target_size : tuple
+            (height, width) of the images after cropping.
+        roi : tuple
+            ((top, bottom), (left, right)) pixels to trim off the full images.
+
+        See Also
+        --------
+        donkeycar.util.img.load_scaled_image
+        """
+        self.image_target_size = tuple(target_size) if target_size else None
+        self.image_roi = roi
+        self.sequence_cache = {}
+
+    def set_binners(self, binners):
+        """
+        Cache the bin indices of categorical labels as columns of the
+        DataFrame so training batches don't need to bin them again.
+
+        Parameters
+        ----------
+        binners : dict
+            Label key to donkeycar.util.binning.LinearBinner. The indices
+            are stored in the column named by util.binning.bin_key(key).
+        """
+        self.binners = dict(binners) if binners else None
+        if self.df is not None:
+            self.add_bin_columns(self.df)
+
+    def add_bin_columns(self, df):
+        """
+        Add the bin index column of every binned label. A few bad records
+        shouldn't stop the training, so missing labels take the value of
+        the previous record and labels out of the binner range are clipped
+        to it, with a warning.
+        """
+        for key, binner in (self.binners or {}).items():
+            if key not in df.columns:
+                continue
+            values = pd.to_numeric(df[key], errors='coerce')
+            missing = int(values.isnull().sum())
+            if missing:
+                values = values.ffill().bfill().fillna((binner.low + binner.high) / 2)
+            outside = int(((values < binner.low) | (values > binner.high)).sum())
+            if missing or outside:
+                logger.warning('Binning {}: {} records without a value, {} out of [{}, {}] clipped'.format(
+                    key, missing, outside, binner.low, binner.high))
+            values = values.clip(binner.low, binner.high)
+            df[util.binning.bin_key(key)] = binner.indices(values.values)
+
+    def get_feature_array(self, name, compute, key='cam/image_array', batch_size=64, save_every=50):
+        """
+        Return the features of the images of every record, ie the output of
+        a frozen model backbone, in the order of the rows of get_df().
+
+        The features are computed once and cached in features/ in the tub,
+        as a .npy array and the record ixs of its rows. Later calls only
+        compute the features of new records, and an interrupted pass
+        resumes from the last saved batch.
+
+        Parameters
+        ----------
+        name : str
+            Cache name, must change when the features would, ie a hash of
+            the backbone weights. The image options are added to it.
+        compute : function
+            Maps a batch of images to a batch of feature arrays.
+        key : str
+            Image key the features are computed from.
+        batch_size : int
+            Number of images passed to compute at once.
+        save_every : int
+            Save the progress every this many batches.
+        """
+        options = zlib.crc32(repr((self.image_target_size, self.image_roi)).encode('utf-8'))
+        cache_dir = os.path.join(self.path, 'features')
+        base = os.path.join(cache_dir, '{}_{:08x}'.format(name, options))
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        df = self.get_df()
+        ixs = df.index.values.astype(np.int64)
+        done = np.zeros(len(ixs), dtype=bool)
+        features = None
+        if os.path.exists(base + '.npy') and os.path.exists(base + '.ixs.npy'):
+            cached_ixs = np.load(base + '.ixs.npy')
+            cached = np.load(base + '.npy', mmap_mode='r')
+            if np.array_equal(cached_ixs, ixs) and len(cached) == len(ixs):
+                return cached
+            if len(cached) == len(cached_ixs):
+                done = np.isin(ixs, cached_ixs)
+                features = np.empty((len(ixs),) + cached.shape[1:], dtype=cached.dtype)
+                features[done] = cached[np.searchsorted(cached_ixs, ixs[done])]
+
+        missing = np.flatnonzero(~done)
+        logger.info('computing {} features of {} records in {}'.format(name, len(missing), self.path))
+        paths = df[key].values
+        for n, start in enumerate(range(0, len(missing), batch_size)):
+            rows = missing[start:start + batch_size]
+            imgs = np.stack([self.load_image(paths[i]) for i in rows])
+            out = np.asarray(compute(imgs))
+            if features is None:
+                features = np.empty((len(ixs),) + out.shape[1:], dtype=out.dtype)
+            features[rows] = out
+            done[rows] = True
+            if save_every and (n + 1) % save_every == 0:
+                self.save_feature_array(base, ixs[done], features[done])
+
+        if features is None:
+            return np.zeros((0,))
+        self.save_feature_array(base, ixs, features)
+        return features
+
+    def add_array_column(self, key, arr):
+        """
+        Add a column to the DataFrame with one row of arr per record, ie the
+        outputs of a teacher model from get_feature_array. Batches stack the
+        rows of the column into an array.
+        """
+        df = self.get_df()
+        if len(arr) != len(df):
+            raise ValueError('{} has {} rows, the tub {} records'.format(key, len(arr), len(df)))
+        df[key] = list(arr)
+
+    @staticmethod
+    def save_feature_array(base, ixs, features):
+        # the ixs are written last, a cache with mismatched lengths is ignored
+        np.save(base + '.tmp.npy', features)
+        os.replace(base + '.tmp.npy', base + '.npy')
+        np.save(base + '.ixs.tmp.npy', ixs)
+        os.replace(base + '.ixs.tmp.npy', base + '.ixs.npy')
+
+    def load_image(self, path):
+        return util.img.load_scaled_image(path, self.image_target_size, self.image_roi)
+
     def read_record(self, record_dict):
         data = {}
         for key, val in record_dict.items():
@@ -243,8 +437,7 @@ class Tub(object):
 
             # load objects that were saved as separate files
             if typ == 'image_array':
-                img = Image.open((val))
-                val = np.array(img)
+                val = self.load_image(val)
 
             data[key] = val
         return data
@@ -264,7 +457,7 @@ class Tub(object):
         """ Required by the Part interface """
         pass
 
-    def get_record_gen(self, record_transform=None, shuffle=True, df=None):
+    def get_record_gen(self, record_transform=None, shuffle=True, df=None, timings=None):
         """
         Returns records.
 
@@ -277,6 +470,8 @@ class Tub(object):
         df : numpy Dataframe
             If df is specified, the generator will use the records specified in that DataFrame. If None,
             the internal DataFrame will be used by calling get_df()
+        timings : donkeycar.util.times.Timings
+            Accumulates the time spent sampling, decoding and transforming records.
 
         Returns
         -------
@@ -288,20 +483,26 @@ class Tub(object):
         """
         if df is None:
             df = self.get_df()
+        if timings is None:
+            timings = util.times.Timings()
 
         while True:
             for _ in self.df.iterrows():
                 if shuffle:
-                    record_dict = df.sample(n=1).to_dict(orient='record')[0]
+                    with timings.time('sample'):
+                        record_dict = df.sample(n=1).to_dict(orient='records')[0]
 
-                record_dict = self.read_record(record_dict)
+                with timings.time('decode'):
+                    record_dict = self.read_record(record_dict)
 
                 if record_transform:
-                    record_dict = record_transform(record_dict)
+                    with timings.time('transform'):
+                        record_dict = record_transform(record_dict)
 
                 yield record_dict
 
-    def get_batch_gen(self, keys=None, batch_size=128, record_transform=None, shuffle=True, df=None):
+    def get_batch_gen(self, keys=None, batch_size=128, record_transform=None, shuffle=True, df=None,
+                      batch_transform=None, timings=None):
         """
         Returns batches of records.
 
@@ -313,6 +514,10 @@ class Tub(object):
             List of keys to filter out. If None, all inputs are included.
         batch_size : int
             The number of records in one batch.
+        batch_transform : function
+            Applied to the dict of batch arrays, see donkeycar.parts.augment.
+        timings : donkeycar.util.times.Timings
+            Accumulates the time spent in each stage of the pipeline.
 
         Returns
         -------
@@ -322,7 +527,10 @@ class Tub(object):
         --------
         get_record_gen
         """
-        record_gen = self.get_record_gen(record_transform=record_transform, shuffle=shuffle, df=df)
+        if timings is None:
+            timings = util.times.Timings()
+        record_gen = self.get_record_gen(record_transform=record_transform, shuffle=shuffle, df=df,
+                                         timings=timings)
 
         if df is None:
             df = self.get_df()
@@ -333,16 +541,24 @@ class Tub(object):
         while True:
             record_list = [ next(record_gen) for _ in range(batch_size) ]
 
-            batch_arrays = {}
-            for i, k in enumerate(keys):
-                arr = np.array([r[k] for r in record_list])
-                batch_arrays[k] = arr
+            with timings.time('assembly'):
+                batch_arrays = {}
+                for i, k in enumerate(keys):
+                    arr = np.array([r[k] for r in record_list])
+                    batch_arrays[k] = arr
+
+            if batch_transform:
+                with timings.time('batch_transform'):
+                    batch_arrays = batch_transform(batch_arrays)
             yield batch_arrays
 
     def get_train_gen(self, X_keys, Y_keys,
                       batch_size=128,
                       record_transform=None,
-                      df=None):
+                      df=None,
+                      batch_transform=None,
+                      timings=None,
+                      extra_keys=None):
         """
         Returns a training/validation set.
 
@@ -354,6 +570,13 @@ class Tub(object):
             List of the feature(s) to use. Must be included in Tub.inputs.
         Y_keys : list of strings
             List of the label(s) to use. Must be included in Tub.inputs.
+        batch_transform : function
+            Applied to the dict of batch arrays, see get_batch_gen.
+        timings : donkeycar.util.times.Timings
+            Accumulates the time spent in each stage of the pipeline.
+        extra_keys : list of strings
+            Other columns added to the batches for the batch transform, ie
+            the outputs of a teacher model.
 
         Returns
         -------
@@ -363,10 +586,17 @@ class Tub(object):
         --------
         get_batch_gen
         """
-        batch_gen = self.get_batch_gen(X_keys + Y_keys,
+        columns = (df if df is not None else self.get_df()).columns
+        # the cached bin indices are passed along for the batch transform
+        bin_keys = [util.binning.bin_key(k) for k in Y_keys
+                    if util.binning.bin_key(k) in columns]
+
+        batch_gen = self.get_batch_gen(X_keys + Y_keys + bin_keys + list(extra_keys or []),
                                        batch_size=batch_size,
                                        record_transform=record_transform,
-                                       df=df)
+                                       df=df,
+                                       batch_transform=batch_transform,
+                                       timings=timings)
 
         while True:
             batch = next(batch_gen)
@@ -374,8 +604,211 @@ class Tub(object):
             Y = [batch[k] for k in Y_keys]
             yield X, Y
 
+    def get_sequence_array(self, key):
+        """
+        Return the values of a key in a dense array with one row per record
+        ix from the first to the last record, and a mask of the rows that
+        have a record. Images are decoded once and kept.
+        """
+        cached = self.sequence_cache.get(key)
+        if cached is not None:
+            return cached
+
+        df = self.get_df()
+        ixs = df.index.values.astype(np.int64)
+        first = ixs.min() if len(ixs) else 0
+        n = ixs.max() - first + 1 if len(ixs) else 0
+        rows = ixs - first
+
+        present = np.zeros(n, dtype=bool)
+        present[rows] = True
+
+        if self.get_input_type(key) in ('image', 'image_array'):
+            arr = None
+            for row, path in zip(rows, df[key].values):
+                img = self.load_image(path)
+                if arr is None:
+                    arr = np.zeros((n,) + img.shape, dtype=img.dtype)
+                arr[row] = img
+        else:
+            values = df[key].values
+            arr = np.zeros(n, dtype=values.dtype)
+            arr[rows] = values
+
+        self.sequence_cache[key] = (arr, present)
+        return arr, present
+
+    def get_sequence_arrays(self, keys):
+        """
+        Dense arrays for the keys and the mask of rows that hold a record.
+        """
+        arrays = {}
+        present = None
+        for k in keys:
+            arrays[k], present = self.get_sequence_array(k)
+        return arrays, present
+
+    def get_sequence_anchors(self, present, offsets, stride=1):
+        """
+        Return the rows at which a window of the given offsets only covers
+        existing records, keeping one anchor every `stride` rows.
+        """
+        offsets = np.asarray(offsets)
+        n = len(present)
+        rows = np.arange(max(0, -offsets.min()), max(0, n - max(offsets.max(), 0)))
+        valid = np.ones(len(rows), dtype=bool)
+        for o in offsets:
+            valid &= present[rows + o]
+        anchors = rows[valid]
+        return anchors[::stride]
+
+    def get_sequence_gen(self, X_keys, Y_keys, offsets=(0, 1, 2), batch_size=128,
+                         stride=1, shuffle=True):
+        """
+        Returns batches of windows of consecutive records.
+
+        Windows never cross a gap in the record index or the boundary
+        between two tubs.
+
+        Parameters
+        ----------
+        X_keys : list of strings
+            List of the feature(s) to use.
+        Y_keys : list of strings
+            List of the label(s) to use.
+        offsets : list of int
+            Record offsets of each window from its anchor record. ie
+            (-2, -1, 0) for the current and two previous records.
+        stride : int
+            Keep one window every `stride` records.
+
+        Returns
+        -------
+        A tuple (X, Y) of lists with an array of shape
+        (batch_size, len(offsets), ...) per key.
+        """
+        arrays, present = self.get_sequence_arrays(X_keys + Y_keys)
+        anchors = self.get_sequence_anchors(present, offsets, stride)
+        if len(anchors) == 0:
+            raise ValueError('No window of offsets {} fits in the records.'.format(list(offsets)))
+
+        views = {k: sequence_view(arr, offsets) for k, arr in arrays.items()}
+        start = 0
+
+        while True:
+            if shuffle:
+                sel = anchors[np.random.randint(0, len(anchors), batch_size)]
+            else:
+                sel = anchors[np.arange(start, start + batch_size) % len(anchors)]
+                start = (start + batch_size) % len(anchors)
+
+            X = [views[k](sel) for k in X_keys]
+            Y = [views[k](sel) for k in Y_keys]
+            yield X, Y
+
+    def get_name(self):
+        return os.path.basename(os.path.normpath(self.path))
+
+    def get_watermark(self):
+        """
+        Return a dict of tub name to the last record ix, the data a model
+        trained on this tub has seen.
+        """
+        ixs = self.get_df().index
+        return {self.get_name(): int(ixs.max())} if len(ixs) else {}
+
+    def get_new_records(self, watermark):
+        """
+        Return a boolean array, True for the rows of get_df() recorded after
+        the watermark.
+        """
+        ixs = self.get_df().index.values
+        return ixs > watermark.get(self.get_name(), -1)
+
+    def get_incremental(self, watermark, replay=0.0, seed=None):
+        """
+        Select the records to fine tune a model on.
+
+        Parameters
+        ----------
+        watermark : dict
+            Tub name to last record ix the model was trained on, see
+            get_watermark.
+        replay : float
+            Number of old records added per new record, to avoid forgetting
+            what was learned from them.
+        seed : int
+            Seed of the replay sampling.
+
+        Returns
+        -------
+        A boolean array, True for the rows of get_df() to train on.
+        """
+        records = self.get_new_records(watermark)
+        old = np.flatnonzero(~records)
+        n_replay = min(len(old), int(round(replay * records.sum())))
+        if n_replay:
+            sample = np.random.RandomState(seed).choice(old, n_replay, replace=False)
+            records[sample] = True
+        return records
+
+    def get_split(self, train_frac=.8, by='record'):
+        """
+        Assign the records to the training or validation set.
+
+        The assignment is a stable hash of the tub name and the record ix, so
+        records added later don't move the existing ones. It is saved as
+        arrays of train and val ixs in split.npz in the tub and reused as
+        long as train_frac and `by` don't change.
+
+        Parameters
+        ----------
+        train_frac : float
+            Fraction of the records in the training set.
+        by : str
+            'record' to split the records of every tub, 'session' to put
+            whole tubs in one set.
+
+        Returns
+        -------
+        A boolean array, True for the rows of get_df() in the training set.
+        """
+        if by not in ('record', 'session'):
+            raise ValueError('split by must be record or session, not {}'.format(by))
+
+        ixs = self.get_df().index.values.astype(np.int64)
+        path = os.path.join(self.path, 'split.npz')
+        train = val = np.zeros(0, dtype=np.int64)
+
+        if os.path.exists(path):
+            with np.load(path) as f:
+                if float(f['train_frac']) == train_frac and str(f['by']) == by:
+                    train, val = f['train'], f['val']
+                else:
+                    logger.info('split settings of {} changed, reassigning the records'.format(self.path))
+
+        new = ixs[~(np.isin(ixs, train) | np.isin(ixs, val))]
+        if len(new):
+            name = self.get_name()
+            if by == 'session':
+                r = np.repeat(split_hash(name, [0]), len(new))
+            else:
+                r = split_hash(name, new)
+            train = np.union1d(train, new[r < train_frac])
+            val = np.union1d(val, new[r >= train_frac])
+            try:
+                np.savez(path, train=train.astype(np.int32), val=val.astype(np.int32),
+                         train_frac=train_frac, by=by)
+            except OSError as e:
+                logger.warning('could not save the split of {}: {}'.format(self.path, e))
+
+        return np.isin(ixs, train)
+
     def get_train_val_gen(self, X_keys, Y_keys, batch_size=128, train_frac=.8,
-                          train_record_transform=None, val_record_transform=None):
+                          train_record_transform=None, val_record_transform=None,
+                          train_batch_transform=None, val_batch_transform=None,
+                          split_by='record', records=None,
+                          train_timings=None, val_timings=None, extra_keys=None):
         """
         Create generators for training and validation set.
 
@@ -383,10 +816,24 @@ class Tub(object):
         ----------
         train_frac : float
             Training/validation set split.
+        split_by : str
+            How the records are assigned to the sets, see get_split.
+        records : array of bool
+            Rows of the DataFrame to use, ie from get_incremental. All rows if None.
+        train_timings : donkeycar.util.times.Timings
+            Accumulates the time spent in each stage of the training pipeline.
+        val_timings : donkeycar.util.times.Timings
+            Same for the validation pipeline.
+        extra_keys : list of strings
+            Other columns added to the batches, see get_train_gen.
         train_record_transform : function
             Transform function for the training set. Used internally by Tub.get_record_gen().
         val_record_transform : function
             Transform  function for the validation set. Used internally by Tub.get_record_gen().
+        train_batch_transform : function
+            Transform of whole training batches, ie a BatchAugmentation.
+        val_batch_transform : function
+            Transform of whole validation batches.
 
         Returns
         -------
@@ -398,17 +845,23 @@ class Tub(object):
         get_train_gen
         get_record_gen
         """
-        if self.df is None:
-            self.update_df()
-
-        train_df = self.df.sample(frac=train_frac, random_state=200)
-        val_df = self.df.drop(train_df.index)
+        is_train = self.get_split(train_frac, by=split_by)
+        if records is None:
+            records = np.ones(len(is_train), dtype=bool)
+        train_df = self.df[is_train & records]
+        val_df = self.df[~is_train & records]
 
         train_gen = self.get_train_gen(X_keys=X_keys, Y_keys=Y_keys, batch_size=batch_size,
-                                       record_transform=train_record_transform, df=train_df)
+                                       record_transform=train_record_transform, df=train_df,
+                                       batch_transform=train_batch_transform,
+                                       timings=train_timings,
+                                       extra_keys=extra_keys)
 
         val_gen = self.get_train_gen(X_keys=X_keys, Y_keys=Y_keys, batch_size=batch_size,
-                                     record_transform=val_record_transform, df=val_df)
+                                     record_transform=val_record_transform, df=val_df,
+                                     batch_transform=val_batch_transform,
+                                     timings=val_timings,
+                                     extra_keys=extra_keys)
 
         return train_gen, val_gen
 
@@ -517,34 +970,85 @@ class TubImageStacker(Tub):
     A Tub for training a NN with images that are the last three records stacked
     togther as 3 channels of a single image. The idea is to give a simple feedforward
     NN some chance of building a model based on motion.
-    If you drive with the ImageFIFO part, then you don't need this.
-    Just make sure your inference pass uses the ImageFIFO that the NN will now expect.
+    When driving, get the last frames from the memory history with an input
+    like 'cam/image_array[-3:]' and stack them the same way before inference.
+
+    The grayscale of each frame is computed once and cached, so a batch of
+    stacked images is a single gather over the cache.
     """
 
+    def __init__(self, *args, **kwargs):
+        super(TubImageStacker, self).__init__(*args, **kwargs)
+        self.luma_cache = {}
+
     def rgb2gray(self, rgb):
         """
-        take a numpy rgb image return a new single channel image converted to greyscale
+        take a numpy rgb image return a new single channel uint8 greyscale image
         """
-        return np.dot(rgb[...,:3], [0.299, 0.587, 0.114])
+        return util.img.rgb_to_luma(rgb)
 
     def stack3Images(self, img_a, img_b, img_c):
         """
         convert 3 rgb images into grayscale and put them into the 3 channels of
         a single output image
         """
-        width, height, _ = img_a.shape
-
-        gray_a = self.rgb2gray(img_a)
-        gray_b = self.rgb2gray(img_b)
-        gray_c = self.rgb2gray(img_c)
-
-        img_arr = np.zeros([width, height, 3], dtype=np.dtype('B'))
+        return np.stack([self.rgb2gray(img_a),
+                         self.rgb2gray(img_b),
+                         self.rgb2gray(img_c)], axis=-1)
 
-        img_arr[...,0] = np.reshape(gray_a, (width, height))
-        img_arr[...,1] = np.reshape(gray_b, (width, height))
-        img_arr[...,2] = np.reshape(gray_c, (width, height))
-
-        return img_arr
+    def get_luma_cache(self, key):
+        """
+        Return the (records, height, width) luma array of an image key, the
+        sorted record index and a mask of the rows computed so far. The
+        cache follows the records of get_df(), the rows of records still
+        there are kept when they change.
+        """
+        index = np.sort(self.get_df().index.values)
+        cache = self.luma_cache.get(key)
+        if cache is not None and np.array_equal(cache['index'], index):
+            return cache
+
+        new = {'index': index,
+               'luma': None,
+               'filled': np.zeros(len(index), dtype=bool)}
+        if cache is not None and cache['luma'] is not None:
+            old_rows = np.flatnonzero(cache['filled'] & np.isin(cache['index'], index))
+            new_rows = np.searchsorted(index, cache['index'][old_rows])
+            new['luma'] = np.empty((len(index),) + cache['luma'].shape[1:], dtype=np.uint8)
+            new['luma'][new_rows] = cache['luma'][old_rows]
+            new['filled'][new_rows] = True
+        self.luma_cache[key] = new
+        return new
+
+    def fill_luma(self, key, rows):
+        """
+        Decode and convert the images of the given cache rows not seen yet.
+        """
+        cache = self.get_luma_cache(key)
+        rows = np.unique(rows)
+        for row in rows[~cache['filled'][rows]]:
+            json_data = self.get_json_record(int(cache['index'][row]))
+            luma = self.rgb2gray(self.load_image(json_data[key]))
+            if cache['luma'] is None:
+                cache['luma'] = np.empty((len(cache['index']),) + luma.shape, dtype=np.uint8)
+            cache['luma'][row] = luma
+            cache['filled'][row] = True
+        return cache
+
+    def stack_batch(self, ixs, key):
+        """
+        Return a (batch, height, width, 3) uint8 array with the grayscale of
+        records ix-2, ix-1 and ix in the channels of each image. Records
+        before the start of the tub or missing from it are replaced by the
+        nearest earlier record.
+        """
+        cache = self.get_luma_cache(key)
+        # row of the record, or of the nearest earlier one when it's missing
+        pos = np.searchsorted(cache['index'], np.asarray(ixs), side='right') - 1
+        rows = np.clip(pos[:, None] + np.array([-2, -1, 0]), 0, len(cache['index']) - 1)
+        cache = self.fill_luma(key, rows.ravel())
+        # gather (batch, 3, h, w) and move the frames to the channels
+        return np.ascontiguousarray(cache['luma'][rows].transpose(0, 2, 3, 1))
 
     def get_record(self, ix):
         """
@@ -553,24 +1057,47 @@ class TubImageStacker(Tub):
         """
         data = super(TubImageStacker, self).get_record(ix)
 
-        if ix > 1:
-            data_ch1 = super(TubImageStacker, self).get_record(ix - 1)
-            data_ch0 = super(TubImageStacker, self).get_record(ix - 2)
+        for key in data.keys():
+            if self.get_input_type(key) in ('image', 'image_array'):
+                data[key] = self.stack_batch([ix], key)[0]
 
-            json_data = self.get_json_record(ix)
-            for key, val in json_data.items():
-                typ = self.get_input_type(key)
+        return data
 
-                #load objects that were saved as separate files
-                if typ == 'image':
-                    val = self.stack3Images(data_ch0[key], data_ch1[key], data[key])
-                    data[key] = val
-                elif typ == 'image_array':
-                    img = self.stack3Images(data_ch0[key], data_ch1[key], data[key])
-                    val = np.array(img)
+    def get_stacked_train_gen(self, X_key, Y_keys, batch_size=128, df=None, shuffle=True):
+        """
+        Returns batches of stacked images and their labels.
 
-        return data
+        Parameters
+        ----------
+        X_key : string
+            The image key to stack.
+        Y_keys : list of strings
+            List of the label(s) to use.
+        df : DataFrame
+            Records to use, indexed by record ix. Defaults to the whole tub.
+
+        Returns
+        -------
+        A tuple ([X], Y) where X is a (batch_size, height, width, 3) array
+        and Y a list with an array per label.
+        """
+        if df is None:
+            df = self.get_df()
+
+        ixs = df.index.values
+        labels = [df[k].values for k in Y_keys]
+        start = 0
+
+        while True:
+            if shuffle:
+                sel = np.random.randint(0, len(ixs), batch_size)
+            else:
+                sel = np.arange(start, start + batch_size) % len(ixs)
+                start = (start + batch_size) % len(ixs)
 
+            X = self.stack_batch(ixs[sel], X_key)
+            Y = [l[sel] for l in labels]
+            yield [X], Y
 
 
 class TubTimeStacker(TubImageStacker):
@@ -603,9 +1130,9 @@ class TubTimeStacker(TubImageStacker):
             try:
                 json_data = self.get_json_record(iRec)
             except FileNotFoundError:
-                pass
-            except:
-                pass
+                # a record without all its offsets can't be trained on
+                raise FileNotFoundError('TubTimeStacker: record {} for offset {} of record {} missing from {}'
+                                        .format(iRec, iOffset, ix, self.path))
 
             for key, val in json_data.items():
                 typ = self.get_input_type(key)
@@ -633,6 +1160,7 @@ class TubGroup(Tub):
         logger.info('TubGroup:tubpaths: {}'.format(tub_paths))
         self.tubs = [Tub(path) for path in tub_paths]
         self.input_types = {}
+        self.sequence_cache = {}
 
         record_count = 0
         for t in self.tubs:
@@ -659,5 +1187,54 @@ class TubGroup(Tub):
     def get_num_tubs(self):
         return len(self.tubs)
 
+    def set_image_options(self, target_size=None, roi=None):
+        super(TubGroup, self).set_image_options(target_size, roi)
+        for t in self.tubs:
+            t.set_image_options(target_size, roi)
+
+    def get_watermark(self):
+        watermark = {}
+        for t in self.tubs:
+            watermark.update(t.get_watermark())
+        return watermark
+
+    def get_new_records(self, watermark):
+        return np.concatenate([t.get_new_records(watermark) for t in self.tubs] +
+                              [np.zeros(0, dtype=bool)])
+
+    def get_feature_array(self, name, compute, key='cam/image_array', batch_size=64, save_every=50):
+        """
+        Join the feature arrays of the tubs, in the order of the rows of df.
+        """
+        return np.concatenate([t.get_feature_array(name, compute, key=key, batch_size=batch_size,
+                                                   save_every=save_every)
+                               for t in self.tubs])
+
+    def get_split(self, train_frac=.8, by='record'):
+        """
+        Join the splits of the tubs, in the order of the rows of df.
+        """
+        return np.concatenate([t.get_split(train_frac, by=by) for t in self.tubs] +
+                              [np.zeros(0, dtype=bool)])
+
+    def get_sequence_array(self, key):
+        """
+        Join the dense arrays of the tubs with an empty row between them so
+        windows can't span two tubs.
+        """
+        cached = self.sequence_cache.get(key)
+        if cached is not None:
+            return cached
+
+        arrays = []
+        masks = []
+        for t in self.tubs:
+            arr, present = t.get_sequence_array(key)
+            arrays += [arr, np.zeros((1,) + arr.shape[1:], dtype=arr.dtype)]
+            masks += [present, np.zeros(1, dtype=bool)]
+
+        cached = self.sequence_cache[key] = (np.concatenate(arrays), np.concatenate(masks))
+        return cached
+
     def get_num_records(self):
         return len(self.df)
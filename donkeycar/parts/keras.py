@@ -5,29 +5,128 @@ keras.py
 functions to run and train autopilots using keras
 
 """
+import time
+import hashlib
+import threading
 
+import numpy as np
 from tensorflow.python.keras.layers import Input
 from tensorflow.python.keras.models import Model, load_model
-from tensorflow.python.keras.layers import Convolution2D
+from tensorflow.python.keras.layers import Convolution2D, SeparableConv2D
 from tensorflow.python.keras.layers import Dropout, Flatten, Dense, Cropping2D, Lambda
-from tensorflow.python.keras.callbacks import ModelCheckpoint, EarlyStopping
+from tensorflow.python.keras.callbacks import ModelCheckpoint, EarlyStopping, Callback
 
 from donkeycar import util
+from donkeycar.log import get_logger
+from donkeycar.parts.pilot import ShadowStats
+from donkeycar.tracer import get_tracer, traced_generator
+from donkeycar.util.times import ThroughputMonitor
+
+logger = get_logger(__name__)
+
+
+def same_io(current, model):
+    """
+    True if a model has the input and output shapes of the current one,
+    or if there is no current model.
+    """
+    if current is None:
+        return True
+    return (current.input_shape == model.input_shape and
+            [tuple(o.shape.as_list()) for o in current.outputs] ==
+            [tuple(o.shape.as_list()) for o in model.outputs])
 
 
 class KerasPilot:
+    batch = None
+    model_path = None
+    # model loaded by load_async, swapped in by the next run
+    next_model = None
+    loader = None
 
     def load(self, model_path):
         self.model = load_model(model_path)
+        self.model_path = model_path
+
+    def load_async(self, model_path):
+        """
+        Load a model on a background thread while this pilot keeps
+        driving with the current one. The new model is warmed up with a
+        blank frame and swapped in at the start of the next run. Models
+        whose inputs or outputs don't match the current model are refused.
+
+        Returns False if a model is already loading.
+        """
+        if self.loader is not None and self.loader.is_alive():
+            logger.warning('Still loading a model, ignoring {}'.format(model_path))
+            return False
+        self.loader = threading.Thread(target=self.load_next, args=(model_path,))
+        self.loader.daemon = True
+        self.loader.start()
+        return True
+
+    def load_next(self, model_path):
+        start = time.time()
+        try:
+            model = load_model(model_path)
+            if not self.compatible(model):
+                logger.error('Model {} has other inputs or outputs than the current one, '
+                             'not swapping'.format(model_path))
+                return
+            run_model = self.prepare_swap(model)
+            # the first predict builds the inference graph, keep it off the drive loop
+            run_model.predict(np.zeros((1,) + tuple(run_model.input_shape[1:]), dtype=np.float32))
+        except Exception as e:
+            logger.error('Could not load model {}: {}'.format(model_path, e))
+            return
+        self.next_model = (run_model, model_path, model)
+        logger.info('Loaded {} in {:.1f}s, swapping on the next run'.format(model_path, time.time() - start))
+
+    def compatible(self, model):
+        return same_io(getattr(self, 'model', None), model)
+
+    def prepare_swap(self, model):
+        """
+        Return the model run once a loaded model is swapped in.
+        """
+        return model
+
+    def swap_model(self):
+        """
+        Swap in the model loaded by load_async, called between runs so a
+        frame is never predicted half by each model.
+        """
+        next_model = self.next_model
+        if next_model is not None:
+            self.next_model = None
+            self.model, self.model_path = next_model[:2]
+            logger.info('Swapped in model {}'.format(self.model_path))
+
+    def as_batch(self, img_arr):
+        """
+        Copy the image into a preallocated batch of one so inference
+        doesn't allocate a new input array every loop.
+        """
+        if self.batch is None or self.batch.shape[1:] != img_arr.shape:
+            self.batch = np.empty((1,) + img_arr.shape, dtype=img_arr.dtype)
+        np.copyto(self.batch[0], img_arr)
+        return self.batch
 
     def shutdown(self):
         pass
 
     def train(self, train_gen, val_gen,
               saved_model_path, epochs=100, steps=100, train_split=0.8,
-              verbose=1, min_delta=.0005, patience=5, use_early_stop=True):
+              verbose=1, min_delta=.0005, patience=5, use_early_stop=True,
+              train_log_path=None, pipeline_timings=None, batch_size=None):
         """
         train_gen: generator that yields an array of images an array of
+        train_log_path: json file with the throughput of every epoch,
+            defaults to saved_model_path + '.train_log.json'
+        pipeline_timings: dict of name to the Timings of the generators,
+            added to the throughput log
+        batch_size: number of records the train_gen yields per step, used
+            for the records per second of the throughput log
 
         """
 
@@ -45,11 +144,18 @@ class KerasPilot:
                                    verbose=verbose,
                                    mode='auto')
 
-        callbacks_list = [save_best]
+        monitor = ThroughputMonitor(train_log_path or saved_model_path + '.train_log.json',
+                                    pipeline_timings)
+        callbacks_list = [save_best, ThroughputCallback(monitor, batch_size)]
 
         if use_early_stop:
             callbacks_list.append(early_stop)
 
+        if get_tracer().enabled:
+            train_gen = traced_generator(train_gen, 'train_gen.next')
+            val_gen = traced_generator(val_gen, 'val_gen.next')
+            callbacks_list.append(TraceCallback())
+
         hist = self.model.fit_generator(
             train_gen,
             steps_per_epoch=steps,
@@ -61,44 +167,411 @@ class KerasPilot:
         return hist
 
 
+    def backbone(self, layer_name='flattened'):
+        """
+        Return a model sharing the layers of this one that outputs the
+        features of `layer_name`, the flattened conv features by default.
+        """
+        return Model(inputs=self.model.inputs, outputs=self.model.get_layer(layer_name).output)
+
+    def backbone_hash(self, layer_name='flattened'):
+        """
+        Hash of the weights of the layers up to `layer_name`, of all of
+        them if None. Used to name feature caches so they are recomputed
+        when the backbone changes.
+        """
+        sha = hashlib.sha1()
+        for layer in self.model.layers:
+            for w in layer.get_weights():
+                sha.update(np.ascontiguousarray(w).tobytes())
+            if layer.name == layer_name:
+                break
+        return sha.hexdigest()[:16]
+
+    def head_model(self, layer_name='flattened'):
+        """
+        Return a model that computes the outputs from the features of
+        `layer_name`. It shares the layers after `layer_name` with this
+        model, so training it trains the heads of this model.
+        """
+        layers = self.model.layers
+        start = [l.name for l in layers].index(layer_name) + 1
+        features = self.model.get_layer(layer_name).output
+        feature_in = Input(shape=tuple(features.shape.as_list()[1:]), name='features_in')
+
+        # rebuild the graph after the backbone on the new input
+        tensors = {features.name: feature_in}
+        for layer in layers[start:]:
+            tensors[layer.output.name] = layer(tensors[layer.input.name])
+
+        head = Model(inputs=[feature_in], outputs=[tensors[o.name] for o in self.model.outputs])
+        optimizer = self.model.optimizer
+        head.compile(optimizer=optimizer.__class__.from_config(optimizer.get_config()),
+                     loss=self.model.loss,
+                     loss_weights=self.model.loss_weights)
+        return head
+
+    def train_heads(self, features, labels, val_features, val_labels,
+                    saved_model_path, epochs=100, batch_size=128,
+                    layer_name='flattened', verbose=1, min_delta=.0005,
+                    patience=5, use_early_stop=True):
+        """
+        Train only the layers after `layer_name` on precomputed backbone
+        features, ie from Tub.get_feature_array. The backbone is frozen
+        and the whole model is saved when the validation loss improves.
+
+        features, val_features: arrays of features, one row per record
+        labels, val_labels: list of label arrays in the order of the model outputs
+        """
+        # the backbone layers aren't part of the head model, so they stay frozen
+        head = self.head_model(layer_name)
+        callbacks_list = [FullModelCheckpoint(self.model, saved_model_path, verbose=verbose)]
+        if use_early_stop:
+            callbacks_list.append(EarlyStopping(monitor='val_loss',
+                                                min_delta=min_delta,
+                                                patience=patience,
+                                                verbose=verbose,
+                                                mode='auto'))
+
+        hist = head.fit(features, labels,
+                        batch_size=batch_size,
+                        epochs=epochs,
+                        verbose=verbose,
+                        validation_data=(val_features, val_labels),
+                        callbacks=callbacks_list)
+        return hist
+
+
+class FullModelCheckpoint(Callback):
+    """
+    Saves a model other than the one being fit, ie the full model while
+    its heads are trained, when the validation loss improves.
+    """
+
+    def __init__(self, full_model, path, monitor='val_loss', verbose=1):
+        super(FullModelCheckpoint, self).__init__()
+        self.full_model = full_model
+        self.path = path
+        self.monitor = monitor
+        self.verbose = verbose
+        self.best = np.inf
+
+    def on_epoch_end(self, epoch, logs=None):
+        current = (logs or {}).get(self.monitor)
+        if current is not None and current < self.best:
+            if self.verbose:
+                print('{} improved from {:.5f} to {:.5f}, saving model to {}'.format(
+                    self.monitor, self.best, current, self.path))
+            self.best = current
+            self.full_model.save(self.path)
+
+
+class ThroughputCallback(Callback):
+    """
+    Feeds the train steps and epochs to a ThroughputMonitor and prints
+    its summary after every epoch. tf.keras 2.x no longer puts the batch
+    size in the logs, so it is given here.
+    """
+
+    def __init__(self, monitor, batch_size=None):
+        super(ThroughputCallback, self).__init__()
+        self.monitor = monitor
+        self.batch_size = batch_size
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.monitor.epoch_begin(epoch)
+
+    def on_batch_begin(self, batch, logs=None):
+        self.monitor.step_begin()
+
+    def on_batch_end(self, batch, logs=None):
+        self.monitor.step_end((logs or {}).get('size', self.batch_size or 0))
+
+    def on_epoch_end(self, epoch, logs=None):
+        entry = self.monitor.epoch_end(epoch, logs)
+        print(ThroughputMonitor.summary(entry))
+
+
+class TraceCallback(Callback):
+    """
+    Adds a span for every train step and epoch to the active tracer.
+    """
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        get_tracer().complete('epoch {}'.format(epoch), self.epoch_start,
+                              time.perf_counter(), cat='train')
+
+    def on_batch_begin(self, batch, logs=None):
+        self.batch_start = time.perf_counter()
+
+    def on_batch_end(self, batch, logs=None):
+        get_tracer().complete('train_step', self.batch_start,
+                              time.perf_counter(), cat='train')
+
+    def on_train_end(self, logs=None):
+        get_tracer().flush()
+
+
 class KerasCategorical(KerasPilot):
-    def __init__(self, model=None, *args, **kwargs):
+    def __init__(self, model=None, input_shape=(120, 160, 3), binners=None,
+                 architecture='default', *args, **kwargs):
+        """
+        binners is a dict with the LinearBinner of 'user/dumping' and
+        'user/angle'. Both default to 15 bins between -1 and 1.
+        architecture is a key of CATEGORICAL_ARCHITECTURES, used when no
+        model is given.
+        """
         super(KerasCategorical, self).__init__(*args, **kwargs)
+        binners = binners or {}
+        self.dumping_binner = binners.get('user/dumping', util.binning.DEFAULT_BINNER)
+        self.angle_binner = binners.get('user/angle', util.binning.DEFAULT_BINNER)
         if model:
             self.model = model
         else:
-            self.model = default_categorical()
+            self.model = CATEGORICAL_ARCHITECTURES[architecture](
+                input_shape,
+                dumping_bins=self.dumping_binner.n_bins,
+                angle_bins=self.angle_binner.n_bins)
 
-    def run(self, img_arr):
-        img_arr = img_arr.reshape((1,) + img_arr.shape)
+    def run(self, img_arr, frame_time=None):
+        """
+        When the capture time of the frame is given it is passed through
+        with the time inference finished so the latency can be measured.
+        """
+        self.swap_model()
+        img_arr = self.as_batch(img_arr)
         dumping_binned, angle_binned, throttle = self.model.predict(img_arr)
-        dumping_unbinned = util.data.linear_unbin(dumping_binned[0])
-        angle_unbinned = util.data.linear_unbin(angle_binned[0])
-        return dumping_binned, angle_unbinned, throttle[0][0]
+        dumping_unbinned = float(self.dumping_binner.decode(dumping_binned[0]))
+        angle_unbinned = float(self.angle_binner.decode(angle_binned[0]))
+        if frame_time is not None:
+            return dumping_unbinned, angle_unbinned, throttle[0][0], frame_time, time.time()
+        return dumping_unbinned, angle_unbinned, throttle[0][0]
+
+    def run_batch(self, imgs):
+        """
+        Return the arrays of the dumping, angle and throttle values of a
+        batch of frames, ie for an InferenceServer.
+        """
+        self.swap_model()
+        dumping_binned, angle_binned, throttle = self.model.predict(imgs, batch_size=len(imgs))
+        return (self.dumping_binner.decode(dumping_binned),
+                self.angle_binner.decode(angle_binned),
+                throttle[:, 0])
+
+
+class KerasEnsemble(KerasCategorical):
+    """
+    Runs shadow models next to the active categorical pilot on the same
+    frames. The models are merged in one keras model, so every frame
+    takes a single predict call and tensorflow runs the models side by
+    side instead of one after the other.
+
+    Outputs the same values as KerasCategorical for the active model,
+    followed by the angle and throttle of every shadow model and the
+    largest angle and throttle difference of the shadows to the active
+    model, so they can be recorded in a tub.
+    """
+
+    def __init__(self, models=None, binners=None, angle_threshold=0.2, *args, **kwargs):
+        """
+        models is the list of categorical models, the first one drives.
+        angle_threshold is the angle difference counted as a disagreement
+        in the divergence stats.
+        """
+        KerasPilot.__init__(self, *args, **kwargs)
+        binners = binners or {}
+        self.dumping_binner = binners.get('user/dumping', util.binning.DEFAULT_BINNER)
+        self.angle_binner = binners.get('user/angle', util.binning.DEFAULT_BINNER)
+        self.angle_threshold = angle_threshold
+        self.models = []
+        self.stats = None
+        if models:
+            self.set_models(models)
+
+    def load(self, model_paths):
+        self.set_models([load_model(path) for path in model_paths])
+        self.model_path = model_paths[0]
+
+    def set_models(self, models):
+        self.models = list(models)
+        self.model = merge_models(self.models)
+        self.stats = ShadowStats(len(self.models) - 1, self.angle_threshold)
+
+    def compatible(self, model):
+        # a loaded model replaces the active one, the shadows stay
+        return same_io(self.models[0] if self.models else None, model)
+
+    def prepare_swap(self, model):
+        return merge_models([model] + self.models[1:])
+
+    def swap_model(self):
+        next_model = self.next_model
+        if next_model is not None:
+            self.next_model = None
+            self.model, self.model_path, self.models[0] = next_model
+            logger.info('Swapped in active model {}'.format(self.model_path))
+
+    def run(self, img_arr, frame_time=None):
+        self.swap_model()
+        img_arr = self.as_batch(img_arr)
+        outputs = self.model.predict(img_arr)
+        inference_time = time.time()
+
+        angles = []
+        throttles = []
+        for i in range(len(self.models)):
+            dumping_binned, angle_binned, throttle = outputs[3 * i:3 * i + 3]
+            angles.append(float(self.angle_binner.decode(angle_binned[0])))
+            throttles.append(float(throttle[0][0]))
+        angle_diff, throttle_diff = self.stats.update(angles, throttles)
+
+        dumping = float(self.dumping_binner.decode(outputs[0][0]))
+        active = (dumping, angles[0], throttles[0])
+        if frame_time is not None:
+            active += (frame_time, inference_time)
+        shadows = tuple(v for pair in zip(angles[1:], throttles[1:]) for v in pair)
+        return active + shadows + (angle_diff, throttle_diff)
+
+    def shutdown(self):
+        if self.stats is not None:
+            self.stats.log()
+
+
+class KerasCascade(KerasCategorical):
+    """
+    Categorical pilot that only computes the dumping output when it may
+    be needed. Steering and throttle come from a model sharing the layers
+    of the full model without the dumping head every run.
+
+    The full model runs for `hold` runs after the trigger input is true,
+    ie a PIR sensor or FrameDifference, and every `every` runs to look for
+    dumping on its own, which also starts a hold when the dumping output
+    is away from rest_dumping. Otherwise the dumping output is rest_dumping.
+    """
+
+    def __init__(self, model=None, binners=None, every=10, hold=20,
+                 rest_dumping=0.0, dumping_threshold=0.1, *args, **kwargs):
+        """
+        every is the interval in runs of the full model without trigger,
+        0 to only run it on triggers. hold is the number of runs the full
+        model keeps running after a trigger. dumping_threshold is the
+        distance of the dumping output to rest_dumping that starts a hold.
+        """
+        super(KerasCascade, self).__init__(model=model, binners=binners, *args, **kwargs)
+        self.every = every
+        self.hold = hold
+        self.rest_dumping = rest_dumping
+        self.dumping_threshold = dumping_threshold
+        self.drive_model = None
+        self.drive_model_of = None
+        self.hold_left = 0
+        self.ticks = 0
+        self.full_runs = 0
+        self.full_time = 0.0
+        self.drive_runs = 0
+        self.drive_time = 0.0
+
+    def build_drive_model(self):
+        """
+        Model of the steering and throttle outputs, keras only computes
+        the layers they depend on.
+        """
+        names = [l.name for l in self.model.layers]
+        if 'angle_out' in names and 'throttle_out' in names:
+            outputs = [self.model.get_layer('angle_out').output,
+                       self.model.get_layer('throttle_out').output]
+        else:
+            outputs = self.model.outputs[1:]
+        self.drive_model = Model(inputs=self.model.inputs, outputs=outputs)
+        self.drive_model_of = self.model
+
+    def run(self, img_arr, frame_time=None, trigger=False):
+        self.swap_model()
+        if self.drive_model_of is not self.model:
+            self.build_drive_model()
+        img_arr = self.as_batch(img_arr)
+
+        self.ticks += 1
+        if trigger:
+            self.hold_left = self.hold
+        full = self.hold_left > 0 or (self.every and self.ticks % self.every == 0)
+
+        start = time.perf_counter()
+        if full:
+            dumping_binned, angle_binned, throttle = self.model.predict(img_arr)
+            dumping = float(self.dumping_binner.decode(dumping_binned[0]))
+            self.full_runs += 1
+            self.full_time += time.perf_counter() - start
+            if abs(dumping - self.rest_dumping) > self.dumping_threshold:
+                self.hold_left = max(self.hold_left, self.hold)
+            self.hold_left = max(0, self.hold_left - 1)
+        else:
+            angle_binned, throttle = self.drive_model.predict(img_arr)
+            dumping = self.rest_dumping
+            self.drive_runs += 1
+            self.drive_time += time.perf_counter() - start
+
+        angle = float(self.angle_binner.decode(angle_binned[0]))
+        if frame_time is not None:
+            return dumping, angle, throttle[0][0], frame_time, time.time()
+        return dumping, angle, throttle[0][0]
+
+    def stats(self):
+        """
+        Mean time in ms of the full and of the steering only runs, and the
+        time saved per run compared to running the full model every time.
+        """
+        full_ms = self.full_time / self.full_runs * 1000 if self.full_runs else None
+        drive_ms = self.drive_time / self.drive_runs * 1000 if self.drive_runs else None
+        saved_ms = 0.0
+        if full_ms is not None and drive_ms is not None:
+            saved_ms = (full_ms - drive_ms) * self.drive_runs / self.ticks
+        return {'runs': self.ticks,
+                'full_runs': self.full_runs,
+                'full_ms': full_ms,
+                'drive_ms': drive_ms,
+                'saved_ms_per_run': saved_ms}
+
+    def shutdown(self):
+        s = self.stats()
+        logger.info('Cascade: full model on {full_runs} of {runs} runs, '
+                    'saved {saved_ms_per_run:.2f}ms per run'.format(**s))
 
 
 class KerasLinear(KerasPilot):
-    def __init__(self, model=None, num_outputs=None, *args, **kwargs):
+    def __init__(self, model=None, num_outputs=None, input_shape=(120, 160, 3), *args, **kwargs):
         super(KerasLinear, self).__init__(*args, **kwargs)
         if model:
             self.model = model
         elif num_outputs is not None:
-            self.model = default_n_linear(num_outputs)
+            self.model = default_n_linear(num_outputs, input_shape)
         else:
-            self.model = default_linear()
+            self.model = default_linear(input_shape)
 
-    def run(self, img_arr):
-        img_arr = img_arr.reshape((1,) + img_arr.shape)
+    def run(self, img_arr, frame_time=None):
+        self.swap_model()
+        img_arr = self.as_batch(img_arr)
         outputs = self.model.predict(img_arr)
         # print(len(outputs), outputs)
+        if len(outputs) == 2:
+            # steering and throttle only, ie KerasLinear(num_outputs=2)
+            steering, throttle = outputs
+            if frame_time is not None:
+                return steering[0][0], throttle[0][0], frame_time, time.time()
+            return steering[0][0], throttle[0][0]
         dumping = outputs[0]
         steering = outputs[1]
         throttle = outputs[2]
+        if frame_time is not None:
+            return dumping[0][0], steering[0][0], throttle[0][0], frame_time, time.time()
         return dumping[0][0], steering[0][0], throttle[0][0]
 
 
-def default_categorical():
-    img_in = Input(shape=(120, 160, 3),
+def default_categorical(input_shape=(120, 160, 3), dumping_bins=15, angle_bins=15):
+    img_in = Input(shape=input_shape,
                    name='img_in')  # First layer, input layer, Shape comes from camera.py resolution, RGB
     x = img_in
     x = Convolution2D(24, (5, 5), strides=(2, 2), activation='relu')(
@@ -120,13 +593,13 @@ def default_categorical():
     x = Dense(50, activation='relu')(x)  # Classify the data into 50 features, make all negatives 0
     x = Dropout(.1)(x)  # Randomly drop out 10% of the neurons (Prevent overfitting)
     # categorical output of the angle
-    angle_out = Dense(15, activation='softmax', name='angle_out')(
-        x)  # Connect every input with every output and output 15 hidden units. Use Softmax to give percentage. 15 categories and find best one based off percentage 0.0-1.0
+    angle_out = Dense(angle_bins, activation='softmax', name='angle_out')(
+        x)  # Connect every input with every output and output angle_bins hidden units. Use Softmax to give percentage. Find the best category based off percentage 0.0-1.0
 
 
     # categorical output of dumping
-    dumping_out = Dense(15, activation='softmax', name='dumping_out')(
-        x)  # Connect every input with every output and output 15 hidden units. Use Softmax to give percentage. 15 categories and find best one based off percentage 0.0-1.0
+    dumping_out = Dense(dumping_bins, activation='softmax', name='dumping_out')(
+        x)  # Connect every input with every output and output dumping_bins hidden units. Use Softmax to give percentage. Find the best category based off percentage 0.0-1.0
 
 
     # continous output of throttle
@@ -199,8 +672,8 @@ def default_catlin():
     return model
 
 
-def default_linear():
-    img_in = Input(shape=(120, 160, 3), name='img_in')
+def default_linear(input_shape=(120, 160, 3)):
+    img_in = Input(shape=input_shape, name='img_in')
     x = img_in
     x = Convolution2D(24, (5, 5), strides=(2, 2), activation='relu')(x)
     x = Convolution2D(32, (5, 5), strides=(2, 2), activation='relu')(x)
@@ -229,8 +702,8 @@ def default_linear():
     return model
 
 
-def default_n_linear(num_outputs):
-    img_in = Input(shape=(120, 160, 3), name='img_in')
+def default_n_linear(num_outputs, input_shape=(120, 160, 3)):
+    img_in = Input(shape=input_shape, name='img_in')
     x = img_in
     x = Cropping2D(cropping=((60, 0), (0, 0)))(x)  # trim 60 pixels off top
     x = Lambda(lambda x: x / 127.5 - 1.)(x)  # normalize and re-center
@@ -257,3 +730,75 @@ def default_n_linear(num_outputs):
                   loss='mse')
 
     return model
+
+
+def compact_categorical(input_shape=(120, 160, 3), dumping_bins=15, angle_bins=15,
+                        filters=(16, 32, 48, 64), dense=64):
+    """
+    Categorical pilot for low inference latency on the Pi. A strided conv
+    followed by depthwise separable convs, which need several times fewer
+    multiply-adds than full convs, and a single small dense layer. Works
+    best with a smaller input, see IMAGE_TARGET_SIZE in config.py.
+    """
+    img_in = Input(shape=input_shape, name='img_in')
+    x = img_in
+    x = Convolution2D(filters[0], (5, 5), strides=(2, 2), activation='relu')(x)
+    for f in filters[1:]:
+        x = SeparableConv2D(f, (3, 3), strides=(2, 2), activation='relu')(x)
+
+    x = Flatten(name='flattened')(x)
+    x = Dense(dense, activation='relu')(x)
+    x = Dropout(.1)(x)
+
+    angle_out = Dense(angle_bins, activation='softmax', name='angle_out')(x)
+    dumping_out = Dense(dumping_bins, activation='softmax', name='dumping_out')(x)
+    throttle_out = Dense(1, activation='relu', name='throttle_out')(x)
+
+    model = Model(inputs=[img_in], outputs=[dumping_out, angle_out, throttle_out])
+    model.compile(optimizer='adam',
+                  loss={'dumping_out': 'categorical_crossentropy',
+                        'angle_out': 'categorical_crossentropy',
+                        'throttle_out': 'mean_absolute_error'},
+                  loss_weights={'dumping_out': 0.1, 'angle_out': 0.8, 'throttle_out': .1})
+
+    return model
+
+
+def tiny_categorical(input_shape=(120, 160, 3), dumping_bins=15, angle_bins=15):
+    """
+    Smallest compact_categorical, for tight latency budgets.
+    """
+    return compact_categorical(input_shape, dumping_bins, angle_bins,
+                               filters=(8, 16, 24, 32), dense=32)
+
+
+def merge_models(models):
+    """
+    Return a model running all the models on the same input, its outputs
+    are the outputs of every model in turn. The models must have the same
+    input shape.
+    """
+    input_shape = models[0].input_shape[1:]
+    for m in models[1:]:
+        if m.input_shape[1:] != input_shape:
+            raise ValueError('All models must have the input shape {}, not {}'.format(
+                input_shape, m.input_shape[1:]))
+
+    img_in = Input(shape=input_shape, name='img_in')
+    outputs = []
+    for i, m in enumerate(models):
+        # models loaded from files are all named 'model', rebuild them under
+        # unique names so they can be nested in the same model
+        config = m.get_config()
+        config['name'] = 'pilot_{}'.format(i)
+        pilot = Model.from_config(config)
+        pilot.set_weights(m.get_weights())
+        out = pilot(img_in)
+        outputs += out if isinstance(out, list) else [out]
+    return Model(inputs=[img_in], outputs=outputs)
+
+
+# categorical architectures by name, all take (input_shape, dumping_bins, angle_bins)
+CATEGORICAL_ARCHITECTURES = {'default': default_categorical,
+                             'compact': compact_categorical,
+                             'tiny': tiny_categorical}
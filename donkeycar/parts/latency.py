@@ -0,0 +1,94 @@
+"""
+latency.py
+
+Parts to measure how old a camera frame is when the actuators finally
+write a pulse computed from it (glass to wheel latency).
+"""
+
+import numpy as np
+
+from ..log import get_logger
+
+logger = get_logger(__name__)
+
+
+class LatencyHistogram:
+    """
+    Fixed bin histogram of latencies in milliseconds.
+    Values above the last bin are counted in the last bin.
+    """
+
+    def __init__(self, name, max_ms=500, bin_ms=5):
+        self.name = name
+        self.bin_ms = bin_ms
+        self.counts = np.zeros(int(max_ms / bin_ms) + 1, dtype=np.int64)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        if ms is None or ms != ms or ms < 0:
+            return
+        i = min(int(ms / self.bin_ms), len(self.counts) - 1)
+        self.counts[i] += 1
+        self.count += 1
+        self.total += ms
+        if ms > self.max:
+            self.max = ms
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, q):
+        """
+        Upper edge of the bin holding the q-th percentile (0-100).
+        """
+        if self.count == 0:
+            return 0.0
+        cum = np.cumsum(self.counts)
+        i = int(np.searchsorted(cum, self.count * q / 100.0))
+        return (i + 1) * self.bin_ms
+
+    def report(self):
+        return '{}: n={} mean={:.1f}ms p50={}ms p90={}ms p99={}ms max={:.1f}ms'.format(
+            self.name, self.count, self.mean(),
+            self.percentile(50), self.percentile(90), self.percentile(99), self.max)
+
+
+class FrameLatency:
+    """
+    Collects capture -> inference -> actuation latencies of every frame.
+
+    Inputs are the capture time of the frame the actuators used, the time
+    the pilot finished inference on it (None when driving in user mode)
+    and the glass to wheel age in seconds returned by the actuator.
+    Outputs the inference and total latency in ms so they can be recorded
+    in a tub. Histograms are logged on shutdown.
+    """
+
+    def __init__(self, max_ms=500, bin_ms=5):
+        self.inference = LatencyHistogram('capture->inference', max_ms, bin_ms)
+        self.actuation = LatencyHistogram('inference->actuation', max_ms, bin_ms)
+        self.total = LatencyHistogram('capture->actuation', max_ms, bin_ms)
+
+    def run(self, frame_time, inference_time, wheel_latency):
+        if frame_time is None or wheel_latency is None:
+            return None, None
+
+        total_ms = wheel_latency * 1000.0
+        self.total.add(total_ms)
+
+        inference_ms = None
+        if inference_time is not None:
+            inference_ms = (inference_time - frame_time) * 1000.0
+            self.inference.add(inference_ms)
+            self.actuation.add(total_ms - inference_ms)
+
+        return inference_ms, total_ms
+
+    def report(self):
+        return [h.report() for h in (self.inference, self.actuation, self.total)]
+
+    def shutdown(self):
+        for line in self.report():
+            logger.info(line)
@@ -0,0 +1,83 @@
+"""
+motion.py
+
+Cheap motion detectors, used to decide when the pilot has to look for
+dumping, see KerasCascade.
+"""
+
+import time
+
+import numpy as np
+
+from ..tracer import get_tracer
+
+
+class PIRSensor:
+    """
+    Reads a PIR motion sensor on a GPIO pin of the Raspberry Pi, like
+    car/sensor_scripts/motion.py. Outputs True while motion is detected.
+    """
+
+    def __init__(self, pin=4, poll_delay=0.05):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.pin = pin
+        self.poll_delay = poll_delay
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        GPIO.setup(pin, GPIO.IN, GPIO.PUD_DOWN)
+        self.motion = False
+        self.on = True
+
+    def poll(self):
+        self.motion = self.GPIO.input(self.pin) == 1
+        return self.motion
+
+    def update(self):
+        tracer = get_tracer()
+        while self.on:
+            with tracer.span('PIRSensor.poll', cat='sensor'):
+                self.poll()
+            time.sleep(self.poll_delay)
+
+    def run_threaded(self):
+        return self.motion
+
+    def run(self):
+        return self.poll()
+
+    def shutdown(self):
+        self.on = False
+        self.GPIO.cleanup(self.pin)
+
+
+class FrameDifference:
+    """
+    Detects motion as a mean absolute difference between downscaled gray
+    frames larger than `threshold`, in 0-255 pixel values. The frames are
+    shrunk by taking every `stride` pixel so a tick costs well below a
+    millisecond. The frames also change while the car drives, so the
+    threshold has to be set above the difference seen when driving.
+    """
+
+    def __init__(self, threshold=8.0, stride=8):
+        self.threshold = threshold
+        self.stride = stride
+        self.previous = None
+        self.difference = 0.0
+
+    def run(self, img_arr):
+        if img_arr is None:
+            return False
+        small = img_arr[::self.stride, ::self.stride]
+        if small.ndim == 3:
+            small = small.mean(axis=2)
+        small = small.astype(np.float32)
+        previous, self.previous = self.previous, small
+        if previous is None or previous.shape != small.shape:
+            return False
+        self.difference = float(np.abs(small - previous).mean())
+        return self.difference > self.threshold
+
+    def shutdown(self):
+        pass
@@ -0,0 +1,358 @@
+"""
+pilot.py
+
+Parts wrapping a pilot to change when and where it runs inference.
+"""
+
+import os
+import time
+import fnmatch
+import threading
+
+import numpy as np
+
+from .latency import LatencyHistogram
+from ..log import get_logger
+from ..tracer import get_tracer
+
+logger = get_logger(__name__)
+
+
+class AsyncPilot:
+    """
+    Runs a pilot on its own thread so the drive loop keeps its rate
+    however long inference takes.
+
+    Add it as a threaded part with the inputs of the wrapped pilot. Every
+    loop it hands the newest frame to the worker, replacing a frame that
+    wasn't started yet, and returns the latest finished prediction right
+    away followed by its age in seconds, the time since the frame it was
+    computed from was captured (or handed over when no capture time is
+    given). Until the first prediction is done every output is None, or
+    nothing is returned if the number of outputs isn't given.
+
+    With extrapolate the angle is moved along its latest rate of change
+    for the age of the prediction, to make up for the inference delay.
+
+    The predictions are dropped when the pilot fails, so the car doesn't
+    keep steering on the last one, and when the part wasn't run for a
+    while, ie the car was driven by the user, so a new session doesn't
+    start from the outputs of the previous one.
+    """
+
+    def __init__(self, pilot, extrapolate=False, angle_index=1,
+                 max_extrapolation=0.2, stale_ms=100, outputs=None, reset_s=0.5):
+        """
+        Parameters
+        ----------
+        pilot : KerasPilot
+            The pilot run on the worker thread, any part with a run method.
+        extrapolate : bool
+            Extrapolate the angle output for the age of the prediction.
+        angle_index : int
+            Position of the angle in the outputs of the pilot.
+        max_extrapolation : float
+            Longest time in seconds the angle is extrapolated for.
+        stale_ms : float
+            Outputs older than this are counted as stale.
+        outputs : int
+            Number of outputs of the pilot, returned as None while there
+            is no prediction so the previous values don't stay in memory.
+        reset_s : float
+            Drop the predictions when the part wasn't run for this long.
+        """
+        self.pilot = pilot
+        self.extrapolate = extrapolate
+        self.angle_index = angle_index
+        self.max_extrapolation = max_extrapolation
+        self.stale_ms = stale_ms
+        self.outputs = outputs
+        self.reset_s = reset_s
+
+        self.cond = threading.Condition()
+        self.pending = None
+        self.result = None
+        self.result_time = None
+        self.previous = None
+        # predictions of frames handed over before a reset are dropped
+        self.session = 0
+        self.last_run = None
+        self.on = True
+
+        self.age = LatencyHistogram('pilot output age')
+        self.inference = LatencyHistogram('pilot inference')
+        self.loops = 0
+        self.stale = 0
+        self.reused = 0
+        self.dropped = 0
+        self.errors = 0
+        self.returned = None
+
+    def update(self):
+        tracer = get_tracer()
+        while self.on:
+            with self.cond:
+                while self.on and self.pending is None:
+                    self.cond.wait(0.1)
+                if not self.on:
+                    break
+                args, submit_time, session = self.pending
+                self.pending = None
+
+            start = time.time()
+            try:
+                with tracer.span('AsyncPilot.inference', cat='pilot'):
+                    outputs = self.pilot.run(*args)
+            except Exception:
+                self.errors += 1
+                logger.exception('AsyncPilot: the pilot failed, dropping its outputs')
+                with self.cond:
+                    self.result = self.previous = None
+                continue
+            self.inference.add((time.time() - start) * 1000.0)
+
+            # age is measured from the capture of the frame when it's known
+            frame_time = args[1] if len(args) > 1 and args[1] is not None else submit_time
+            with self.cond:
+                if session != self.session:
+                    continue
+                self.previous = (self.result, self.result_time)
+                self.result = outputs
+                self.result_time = frame_time
+
+    def run_threaded(self, *args):
+        now = time.time()
+        with self.cond:
+            if self.last_run is not None and now - self.last_run > self.reset_s:
+                self.reset()
+            self.last_run = now
+            if args[0] is not None:
+                if self.pending is not None:
+                    self.dropped += 1
+                self.pending = (args, now, self.session)
+                self.cond.notify()
+            result, result_time = self.result, self.result_time
+            previous, previous_time = self.previous or (None, None)
+
+        if result is None:
+            if self.outputs is None:
+                return None
+            return (None,) * (self.outputs + 1)
+
+        age = now - result_time
+        self.loops += 1
+        self.age.add(age * 1000.0)
+        if age * 1000.0 > self.stale_ms:
+            self.stale += 1
+        if result is self.returned:
+            self.reused += 1
+        self.returned = result
+
+        outputs = list(result)
+        if self.extrapolate and previous is not None and result_time > previous_time:
+            outputs[self.angle_index] = self.extrapolate_angle(
+                result[self.angle_index], result_time,
+                previous[self.angle_index], previous_time, age)
+        return tuple(outputs) + (age,)
+
+    def reset(self):
+        """
+        Drop the predictions and the frame waiting for the worker. Called
+        with the lock held.
+        """
+        self.session += 1
+        self.pending = None
+        self.result = self.result_time = None
+        self.previous = None
+        self.returned = None
+
+    def extrapolate_angle(self, angle, t, prev_angle, prev_t, age):
+        rate = (angle - prev_angle) / (t - prev_t)
+        angle = angle + rate * min(age, self.max_extrapolation)
+        return max(-1.0, min(1.0, angle))
+
+    def stats(self):
+        """
+        Counts of the loops that got a prediction, the stale and reused
+        ones, of the frames replaced before inference started and of the
+        failed pilot runs.
+        """
+        return {'loops': self.loops,
+                'stale': self.stale,
+                'reused': self.reused,
+                'dropped_frames': self.dropped,
+                'errors': self.errors,
+                'age_mean_ms': self.age.mean(),
+                'age_p90_ms': self.age.percentile(90),
+                'inference_mean_ms': self.inference.mean()}
+
+    def shutdown(self):
+        self.on = False
+        with self.cond:
+            self.cond.notify()
+        logger.info(self.age.report())
+        logger.info(self.inference.report())
+        logger.info('{stale} of {loops} pilot outputs older than {ms}ms, {reused} reused, '
+                    '{dropped_frames} frames dropped, {errors} errors'.format(ms=self.stale_ms, **self.stats()))
+        self.pilot.shutdown()
+
+
+def drive_mode(mode,
+               user_dumping, user_angle, user_throttle,
+               pilot_dumping, pilot_angle, pilot_throttle,
+               cam_frame_time=None, pilot_frame_time=None, pilot_inference_time=None):
+    """
+    Choose the values that drive the car for the mode, and the capture
+    time of the frame behind them so the actuators can tell how old it
+    is. The user values are used while the pilot has no outputs yet, ie
+    the first loops of an AsyncPilot.
+
+    returns: dumping, angle, throttle, frame time and inference time
+    """
+    if mode == 'user' or pilot_angle is None or pilot_throttle is None:
+        return user_dumping, user_angle, user_throttle, cam_frame_time, None
+
+    if pilot_dumping is None:
+        pilot_dumping = user_dumping
+
+    if mode == 'local_angle':
+        return pilot_dumping, pilot_angle, user_throttle, pilot_frame_time, pilot_inference_time
+
+    return pilot_dumping, pilot_angle, pilot_throttle, pilot_frame_time, pilot_inference_time
+
+
+class ModelWatcher:
+    """
+    Watches a models folder and calls `loader` with the path of every
+    model file written there while driving, ie KerasPilot.load_async.
+
+    A file is only passed on once its size and modification time didn't
+    change between two polls, so models still being saved by a training
+    run are not loaded half written. Add it as a threaded part.
+    """
+
+    def __init__(self, path, loader, pattern='*.h5', poll=1.0):
+        """
+        Parameters
+        ----------
+        path : str
+            Folder of the models.
+        loader : function
+            Called with the path of a new or changed model.
+        pattern : str
+            Shell pattern of the model file names.
+        poll : float
+            Seconds between two checks of the folder.
+        """
+        self.path = os.path.expanduser(path)
+        self.loader = loader
+        self.pattern = pattern
+        self.poll = poll
+        self.on = True
+        # the models already there when driving starts are not loaded
+        self.seen = self.scan()
+        self.changed = {}
+
+    def scan(self):
+        files = {}
+        if not os.path.isdir(self.path):
+            return files
+        for name in fnmatch.filter(os.listdir(self.path), self.pattern):
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files[path] = (st.st_mtime, st.st_size)
+        return files
+
+    def check(self):
+        """
+        Compare the folder with the previous poll and load the models
+        that are complete. Returns the paths passed to the loader.
+        """
+        loaded = []
+        for path, stamp in self.scan().items():
+            if self.seen.get(path) == stamp:
+                continue
+            if self.changed.get(path) == stamp:
+                # unchanged since the last poll, done writing
+                del self.changed[path]
+                self.seen[path] = stamp
+                logger.info('New model {}'.format(path))
+                self.loader(path)
+                loaded.append(path)
+            else:
+                self.changed[path] = stamp
+        return loaded
+
+    def update(self):
+        tracer = get_tracer()
+        while self.on:
+            with tracer.span('ModelWatcher.check', cat='pilot'):
+                self.check()
+            time.sleep(self.poll)
+
+    def run_threaded(self):
+        return None
+
+    def shutdown(self):
+        self.on = False
+
+
+class ShadowStats:
+    """
+    Running statistics of the differences between the outputs of the
+    active pilot and of shadow pilots seeing the same frames.
+    """
+
+    def __init__(self, n_shadows, angle_threshold=0.2):
+        """
+        Parameters
+        ----------
+        n_shadows : int
+            Number of shadow pilots.
+        angle_threshold : float
+            Angle difference counted as a disagreement.
+        """
+        self.angle_threshold = angle_threshold
+        self.count = 0
+        self.angle_sum = np.zeros(n_shadows)
+        self.angle_max = np.zeros(n_shadows)
+        self.throttle_sum = np.zeros(n_shadows)
+        self.disagree = np.zeros(n_shadows, dtype=np.int64)
+
+    def update(self, angles, throttles):
+        """
+        Add the outputs of a frame, the active pilot first. Returns the
+        largest angle and throttle difference of the shadows to it.
+        """
+        if len(angles) < 2:
+            return 0.0, 0.0
+        angle_diff = np.abs(np.asarray(angles[1:]) - angles[0])
+        throttle_diff = np.abs(np.asarray(throttles[1:]) - throttles[0])
+        self.count += 1
+        self.angle_sum += angle_diff
+        self.throttle_sum += throttle_diff
+        np.maximum(self.angle_max, angle_diff, out=self.angle_max)
+        self.disagree += angle_diff > self.angle_threshold
+        return float(angle_diff.max()), float(throttle_diff.max())
+
+    def report(self):
+        """
+        Mean and max angle difference, mean throttle difference and the
+        fraction of frames the angles disagree, per shadow.
+        """
+        n = max(1, self.count)
+        return [{'frames': self.count,
+                 'angle_mean': float(self.angle_sum[i] / n),
+                 'angle_max': float(self.angle_max[i]),
+                 'throttle_mean': float(self.throttle_sum[i] / n),
+                 'disagree': float(self.disagree[i] / n)}
+                for i in range(len(self.angle_sum))]
+
+    def log(self):
+        for i, r in enumerate(self.report()):
+            logger.info('shadow {}: {frames} frames, angle diff mean {angle_mean:.3f} max {angle_max:.3f}, '
+                        'throttle diff mean {throttle_mean:.3f}, angle off by more than {t} on {p:.1f}% '
+                        'of the frames'.format(i + 1, t=self.angle_threshold, p=r['disagree'] * 100, **r))
@@ -0,0 +1,199 @@
+"""
+recorder.py
+
+An always-on flight recorder that keeps the last few seconds of every
+memory channel in preallocated ring buffers so they can be dumped to disk
+after a crash, on a signal or on demand.
+"""
+
+import os
+import time
+import signal
+import datetime
+
+import numpy as np
+
+from ..log import get_logger
+
+logger = get_logger(__name__)
+
+
+class FlightRecorder:
+    """
+    Binary ring buffer trace of the vehicle memory.
+
+    Every tick the value of each channel is copied into a slot of a
+    preallocated numpy array. Numbers and booleans are kept as float64
+    (None becomes NaN), strings as fixed width unicode and image arrays
+    as strided thumbnails so the recorder never holds full frames.
+
+    Hook it into a vehicle with `Vehicle(recorder=FlightRecorder(...))`.
+    """
+
+    def __init__(self, path, seconds=30, rate_hz=20, thumbnail_stride=4,
+                 str_len=32, max_overhead=0.02):
+        """
+        Parameters
+        ----------
+        path : str
+            Folder the recordings are dumped to.
+        seconds : int
+            How many seconds of history to keep.
+        rate_hz : int
+            Drive loop frequency. Used to size the buffers and to compute
+            the overhead against the loop budget.
+        thumbnail_stride : int
+            Keep every nth pixel of image arrays.
+        str_len : int
+            Maximum length kept for string channels.
+        max_overhead : float
+            Fraction of the loop budget the recorder may use before
+            a warning is logged.
+        """
+        self.path = os.path.expanduser(path)
+        self.capacity = max(1, int(seconds * rate_hz))
+        self.loop_budget = 1.0 / rate_hz
+        self.thumbnail_stride = thumbnail_stride
+        self.str_len = str_len
+        self.max_overhead = max_overhead
+
+        self.times = np.zeros(self.capacity, dtype=np.float64)
+        self.buffers = {}
+        self.ticks = 0
+        self.record_time = 0.0
+
+    def _make_buffer(self, value):
+        """
+        Allocate the ring buffer for a channel based on its first value.
+        Returns None for values that can't be recorded.
+        """
+        if isinstance(value, (bool, int, float, np.number, np.bool_)):
+            return np.full(self.capacity, np.nan, dtype=np.float64)
+
+        if isinstance(value, str):
+            return np.zeros(self.capacity, dtype='U{}'.format(self.str_len))
+
+        if isinstance(value, np.ndarray):
+            if value.ndim >= 2:
+                s = self.thumbnail_stride
+                shape = value[::s, ::s].shape
+                return np.zeros((self.capacity,) + shape, dtype=np.uint8)
+            if value.dtype.kind in 'biuf':
+                return np.full((self.capacity,) + value.shape, np.nan, dtype=np.float64)
+
+        return None
+
+    def record(self, mem):
+        """
+        Copy the current value of every channel into the ring buffers.
+        """
+        start = time.perf_counter()
+        i = self.ticks % self.capacity
+        self.times[i] = time.time()
+
+        for key, value in mem.items():
+            buf = self.buffers.get(key)
+            if buf is None:
+                if key in self.buffers or value is None:
+                    continue
+                # first time we see this channel, allocate its buffer
+                buf = self.buffers[key] = self._make_buffer(value)
+                if buf is None:
+                    logger.debug('FlightRecorder skipping channel {}'.format(key))
+                    continue
+
+            try:
+                if buf.ndim > 1 and buf.dtype == np.uint8:
+                    s = self.thumbnail_stride
+                    thumbnail = value[::s, ::s]
+                    if thumbnail.dtype.kind == 'f':
+                        # normalized images are in [0, 1]
+                        if thumbnail.max() <= 1.0:
+                            thumbnail = thumbnail * 255.0
+                        thumbnail = np.clip(thumbnail, 0, 255)
+                    np.copyto(buf[i], thumbnail, casting='unsafe')
+                elif value is None:
+                    buf[i] = np.nan if buf.dtype.kind == 'f' else ''
+                else:
+                    buf[i] = value
+            except (TypeError, ValueError, IndexError):
+                # the channel changed type or shape, don't let it stop the car
+                buf[i] = np.nan if buf.dtype.kind == 'f' and buf.ndim == 1 else 0
+
+        self.ticks += 1
+        self.record_time += time.perf_counter() - start
+
+    def overhead(self):
+        """
+        Mean fraction of the loop budget spent recording.
+        """
+        if self.ticks == 0:
+            return 0.0
+        return self.record_time / self.ticks / self.loop_budget
+
+    def snapshot(self):
+        """
+        Return the recorded channels ordered from oldest to newest tick.
+        """
+        n = min(self.ticks, self.capacity)
+        start = self.ticks - n
+        order = np.arange(start, self.ticks) % self.capacity
+
+        data = {'_times': self.times[order]}
+        for key, buf in self.buffers.items():
+            if buf is not None:
+                data[key] = buf[order]
+        return data
+
+    def dump(self, reason='demand'):
+        """
+        Save the ring buffers to a compressed numpy archive and return its path.
+        """
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        date = datetime.datetime.now().strftime('%y-%m-%d_%H-%M-%S')
+        name = 'flight_{}_{}.npz'.format(date, reason)
+        dump_path = os.path.join(self.path, name)
+
+        data = self.snapshot()
+        # npz entries are files, so keep the channel names separately
+        keys = [k for k in data.keys() if k != '_times']
+        arrays = {'ch{}'.format(i): data[k] for i, k in enumerate(keys)}
+        np.savez_compressed(dump_path,
+                            _times=data['_times'],
+                            _channels=np.array(keys),
+                            **arrays)
+
+        logger.info('FlightRecorder dumped {} ticks to {}'.format(
+            len(data['_times']), dump_path))
+        return dump_path
+
+    def install_signal_handler(self, signum=signal.SIGUSR1):
+        """
+        Dump the recording whenever the process receives `signum`.
+        Must be called from the main thread.
+        """
+        def handler(sig, frame):
+            self.dump(reason='signal')
+
+        signal.signal(signum, handler)
+
+    def shutdown(self):
+        overhead = self.overhead()
+        logger.info('FlightRecorder overhead: {:.2%} of the loop budget'.format(overhead))
+        if overhead > self.max_overhead:
+            logger.warning('FlightRecorder overhead {:.2%} is above {:.2%}'.format(
+                overhead, self.max_overhead))
+
+
+def load_flight(path):
+    """
+    Load a dump created by FlightRecorder.dump into a dict of channel arrays.
+    """
+    with np.load(path) as f:
+        keys = list(f['_channels'])
+        data = {'_times': f['_times']}
+        for i, k in enumerate(keys):
+            data[str(k)] = f['ch{}'.format(i)]
+    return data
@@ -0,0 +1,358 @@
+"""
+remote.py
+
+Run the pilot on another computer of the local network. The car sends
+its frames over a persistent TCP connection to an InferenceServer, which
+batches the frames of all the connected cars into one predict call.
+
+Messages are a fixed size header followed by the frame:
+
+    request:  payload length, sequence number, encoding, height, width, channels
+    response: sequence number, dumping, angle, throttle
+"""
+
+import io
+import time
+import socket
+import struct
+import select
+import threading
+
+import numpy as np
+
+from .latency import LatencyHistogram
+from ..log import get_logger
+
+logger = get_logger(__name__)
+
+REQUEST = struct.Struct('!IQBHHB')
+RESPONSE = struct.Struct('!Qfff')
+
+RAW = 0
+JPEG = 1
+
+
+def encode_frame(img_arr, jpeg_quality=None):
+    """
+    Return the encoding and the bytes of a frame, JPEG compressed when a
+    quality is given.
+    """
+    if jpeg_quality:
+        from PIL import Image
+        f = io.BytesIO()
+        Image.fromarray(np.uint8(img_arr)).save(f, format='jpeg', quality=jpeg_quality)
+        return JPEG, f.getvalue()
+    return RAW, np.ascontiguousarray(img_arr, dtype=np.uint8).tobytes()
+
+
+def decode_frame(encoding, shape, payload):
+    if encoding == JPEG:
+        from PIL import Image
+        arr = np.array(Image.open(io.BytesIO(payload)))
+        return arr.reshape(shape)
+    return np.frombuffer(payload, dtype=np.uint8).reshape(shape)
+
+
+def pack_request(seq, img_arr, jpeg_quality=None):
+    encoding, payload = encode_frame(img_arr, jpeg_quality)
+    shape = tuple(img_arr.shape) + (1,) * (3 - img_arr.ndim)
+    return REQUEST.pack(len(payload), seq, encoding, *shape) + payload
+
+
+def recv_exact(sock, n):
+    """
+    Read n bytes from a blocking socket, None if it was closed.
+    """
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            return None
+        buf += chunk
+    return bytes(buf)
+
+
+class RemotePilot:
+    """
+    Pilot part that gets its outputs from an InferenceServer.
+
+    Every run sends the frame and waits for its outputs until the
+    deadline. When they are late, or the server can't be reached, the
+    outputs of the fallback pilot are used, ie a small local model, or
+    the last outputs if there is no fallback. Late outputs of earlier
+    frames are dropped when they arrive.
+    """
+
+    def __init__(self, host='localhost', port=9091, deadline_ms=40, fallback=None,
+                 jpeg_quality=None, reconnect_s=1.0):
+        """
+        Parameters
+        ----------
+        host, port :
+            Address of the inference server.
+        deadline_ms : float
+            Longest wait for the outputs of a frame.
+        fallback : KerasPilot
+            Pilot run locally when the server misses the deadline.
+        jpeg_quality : int
+            JPEG compress the frames with this quality, None sends them raw.
+        reconnect_s : float
+            Seconds between two connection attempts when the server is gone.
+        """
+        self.address = (host, port)
+        self.deadline = deadline_ms / 1000.0
+        self.fallback = fallback
+        self.jpeg_quality = jpeg_quality
+        self.reconnect_s = reconnect_s
+
+        self.sock = None
+        self.buffer = bytearray()
+        self.last_connect = 0.0
+        self.seq = 0
+        self.last = (0.0, 0.0, 0.0)
+
+        self.latency = LatencyHistogram('remote pilot round trip')
+        self.remote = 0
+        self.late = 0
+        self.offline = 0
+
+    def connect(self):
+        now = time.time()
+        if now - self.last_connect < self.reconnect_s:
+            return False
+        self.last_connect = now
+        try:
+            sock = socket.create_connection(self.address, timeout=self.deadline)
+        except OSError:
+            return False
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock = sock
+        self.buffer = bytearray()
+        logger.info('Connected to inference server {}:{}'.format(*self.address))
+        return True
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            logger.warning('Lost inference server {}:{}'.format(*self.address))
+
+    def request(self, img_arr):
+        """
+        Send a frame and return its outputs, None if they don't arrive
+        before the deadline.
+        """
+        start = time.time()
+        end = start + self.deadline
+        self.seq += 1
+        try:
+            data = pack_request(self.seq, img_arr, self.jpeg_quality)
+            # encoding, sending and waiting share the deadline of the frame
+            left = end - time.time()
+            if left <= 0:
+                return None
+            self.sock.settimeout(left)
+            self.sock.sendall(data)
+            while True:
+                while len(self.buffer) >= RESPONSE.size:
+                    seq, dumping, angle, throttle = RESPONSE.unpack_from(self.buffer)
+                    del self.buffer[:RESPONSE.size]
+                    if seq == self.seq:
+                        self.latency.add((time.time() - start) * 1000.0)
+                        return dumping, angle, throttle
+                left = end - time.time()
+                if left <= 0 or not select.select([self.sock], [], [], left)[0]:
+                    return None
+                chunk = self.sock.recv(4096)
+                if not chunk:
+                    self.close()
+                    return None
+                self.buffer += chunk
+        except OSError:
+            self.close()
+            return None
+
+    def run(self, img_arr, frame_time=None):
+        if img_arr is None:
+            return None
+        outputs = None
+        if self.sock is not None or self.connect():
+            outputs = self.request(img_arr)
+            if outputs is None:
+                self.late += 1
+        else:
+            self.offline += 1
+
+        if outputs is not None:
+            self.remote += 1
+            self.last = outputs
+        elif self.fallback is not None:
+            outputs = tuple(self.fallback.run(img_arr))[:3]
+        else:
+            outputs = self.last
+
+        if frame_time is not None:
+            return tuple(outputs) + (frame_time, time.time())
+        return tuple(outputs)
+
+    def shutdown(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        logger.info(self.latency.report())
+        logger.info('Remote pilot: {} frames from the server, {} late, {} while offline'.format(
+            self.remote, self.late, self.offline))
+        if self.fallback is not None:
+            self.fallback.shutdown()
+
+
+class InferenceServer:
+    """
+    Serves RemotePilot clients. Frames of all the connections are batched
+    into one call of `predict`: the batch is sent once `max_batch` frames
+    wait or `max_wait_ms` after the first one. Only the newest frame of
+    every connection is kept, older ones are answered by the newer outputs
+    anyway.
+    """
+
+    def __init__(self, predict, host='0.0.0.0', port=9091, max_batch=8, max_wait_ms=5):
+        """
+        Parameters
+        ----------
+        predict : function
+            Takes a batch of frames and returns the arrays of the dumping,
+            angle and throttle values, ie KerasCategorical.run_batch.
+        host, port :
+            Address to listen on, port 0 picks a free port.
+        max_batch : int
+            Largest number of frames predicted together.
+        max_wait_ms : float
+            Longest wait for more frames once one arrived.
+        """
+        self.predict = predict
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((host, port))
+        self.listener.listen(8)
+        # wake up regularly to notice shutdown
+        self.listener.settimeout(0.5)
+        self.port = self.listener.getsockname()[1]
+
+        self.cond = threading.Condition()
+        # connection -> (sequence number, frame, arrival time)
+        self.pending = {}
+        self.locks = {}
+        self.on = True
+
+        self.batches = 0
+        self.frames = 0
+        self.dropped = 0
+        self.errors = 0
+        self.latency = LatencyHistogram('server queue + inference')
+
+    def serve_forever(self):
+        threading.Thread(target=self.batch_loop, daemon=True).start()
+        logger.info('Inference server listening on port {}'.format(self.port))
+        while self.on:
+            try:
+                conn, address = self.listener.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            conn.settimeout(None)
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            logger.info('Car connected from {}:{}'.format(*address))
+            threading.Thread(target=self.read_loop, args=(conn,), daemon=True).start()
+
+    def read_loop(self, conn):
+        self.locks[conn] = threading.Lock()
+        try:
+            while self.on:
+                header = recv_exact(conn, REQUEST.size)
+                if header is None:
+                    break
+                length, seq, encoding, h, w, c = REQUEST.unpack(header)
+                payload = recv_exact(conn, length)
+                if payload is None:
+                    break
+                shape = (h, w, c) if c > 1 else (h, w)
+                img = decode_frame(encoding, shape, payload)
+                with self.cond:
+                    if conn in self.pending:
+                        self.dropped += 1
+                    self.pending[conn] = (seq, img, time.time())
+                    self.cond.notify()
+        except OSError:
+            pass
+        finally:
+            with self.cond:
+                self.pending.pop(conn, None)
+            self.locks.pop(conn, None)
+            conn.close()
+
+    def next_batch(self):
+        with self.cond:
+            while self.on and not self.pending:
+                self.cond.wait(0.1)
+            end = time.time() + self.max_wait
+            while self.on and len(self.pending) < self.max_batch:
+                left = end - time.time()
+                if left <= 0:
+                    break
+                self.cond.wait(left)
+            items = list(self.pending.items())[:self.max_batch]
+            for conn, _ in items:
+                del self.pending[conn]
+        return items
+
+    def batch_loop(self):
+        while self.on:
+            items = self.next_batch()
+            # frames of another size are predicted in their own batch
+            by_shape = {}
+            for conn, (seq, img, arrived) in items:
+                by_shape.setdefault(img.shape, []).append((conn, seq, arrived, img))
+            for group in by_shape.values():
+                try:
+                    self.answer(group)
+                except Exception:
+                    # the cars fall back for these frames, keep serving the next ones
+                    self.errors += 1
+                    logger.exception('Could not predict a batch of {} frames'.format(len(group)))
+
+    def answer(self, group):
+        imgs = np.stack([g[3] for g in group])
+        dumping, angle, throttle = self.predict(imgs)
+        self.batches += 1
+        self.frames += len(group)
+        now = time.time()
+        for i, (conn, seq, arrived, _) in enumerate(group):
+            self.latency.add((now - arrived) * 1000.0)
+            lock = self.locks.get(conn)
+            if lock is None:
+                continue
+            try:
+                with lock:
+                    conn.sendall(RESPONSE.pack(seq, dumping[i], angle[i], throttle[i]))
+            except OSError:
+                pass
+
+    def stats(self):
+        return {'batches': self.batches,
+                'frames': self.frames,
+                'mean_batch': self.frames / self.batches if self.batches else 0.0,
+                'dropped_frames': self.dropped,
+                'errors': self.errors}
+
+    def shutdown(self):
+        self.on = False
+        self.listener.close()
+        with self.cond:
+            self.cond.notify_all()
+        logger.info(self.latency.report())
+        logger.info('Inference server: {frames} frames in {batches} batches, '
+                    '{dropped_frames} replaced by newer ones'.format(**self.stats()))
@@ -4,9 +4,17 @@
 Parts to try donkeycar without a physical car.
 """
 
+import time
+import base64
 import random
 import numpy as np
 
+from donkeycar import util
+from .latency import LatencyHistogram
+from ..log import get_logger
+
+logger = get_logger(__name__)
+
 
 class MovingSquareTelemetry:
     """
@@ -54,12 +62,20 @@ class SquareBoxCamera:
     Fake camera that returns an image with a square box.
 
     This can be used to test if a learning algorithm can learn.
+
+    The frames are uint8 and drawn in two buffers used in turns, so the
+    drive loop doesn't allocate a frame per tick. A returned frame is only
+    drawn over two calls later, so the parts of the loop and a threaded
+    part reading the previous frame, ie the web controller, see whole
+    frames. Copy it to keep it longer.
     """
 
     def __init__(self, resolution=(120, 160), box_size=4, color=(255, 0, 0)):
         self.resolution = resolution
         self.box_size = box_size
         self.color = color
+        self.frames = [np.zeros(shape=self.resolution + (3,), dtype=np.uint8) for _ in range(2)]
+        self.count = 0
 
     def run(self, x, y, box_size=None, color=None):
         """
@@ -67,7 +83,166 @@ class SquareBoxCamera:
         """
         radius = int((box_size or self.box_size)/2)
         color = color or self.color
-        frame = np.zeros(shape=self.resolution + (3,))
-        frame[y - radius: y + radius,
-              x - radius: x + radius, :] = color
+        frame = self.frames[self.count % 2]
+        self.count += 1
+        frame.fill(0)
+        frame[max(y - radius, 0): y + radius,
+              max(x - radius, 0): x + radius, :] = color
         return frame
+
+
+class SteeringServer:
+    """
+    Drives donkey simulators connected to a socketio server with a pilot.
+
+    Telemetry messages only queue the frame, the newest one of every
+    simulator. A background task waits `batch_window_ms` for the frames
+    of the other simulators, then decodes them and runs the pilot on all
+    of them at once away from the event loop, so several simulators can
+    be driven together for evaluation.
+
+    The time from a frame's arrival to its steering message and the time
+    the simulator takes to send the next frame are kept per simulator.
+    """
+
+    def __init__(self, sio, kpart, top_speed=4.0, image_part=None,
+                 steering_scale=1.0, batch_window_ms=5, max_batch=16):
+        """
+        Parameters
+        ----------
+        sio : socketio.Server
+            Server the simulators are connected to.
+        kpart : KerasPilot
+            Pilot driving the simulators, frames are predicted together
+            when it has a run_batch method.
+        top_speed : float
+            The throttle is cut above this speed.
+        image_part : part
+            Optional filter run on every frame before the pilot.
+        steering_scale : float
+            Factor of the steering angle sent to the simulator.
+        batch_window_ms : float
+            Wait for frames of other simulators after the first one.
+        max_batch : int
+            Largest number of frames predicted together.
+        """
+        self.sio = sio
+        self.kpart = kpart
+        self.top_speed = top_speed
+        self.image_part = image_part
+        self.steering_scale = steering_scale
+        self.batch_window = batch_window_ms / 1000.0
+        self.max_batch = max_batch
+
+        # sid -> (base64 image, speed, arrival time)
+        self.pending = {}
+        self.scheduled = False
+        self.sent = {}
+        self.server_latency = {}
+        self.cycle_latency = {}
+        self.batches = 0
+        self.frames = 0
+
+    def connect(self, sid, environ):
+        logger.info('Simulator {} connected'.format(sid))
+        self.server_latency[sid] = LatencyHistogram('{} frame->steer'.format(sid))
+        self.cycle_latency[sid] = LatencyHistogram('{} steer->frame'.format(sid))
+        self.send_control(sid, 0, 0)
+
+    def disconnect(self, sid):
+        logger.info('Simulator {} disconnected'.format(sid))
+        self.pending.pop(sid, None)
+        self.sent.pop(sid, None)
+
+    def telemetry(self, sid, data):
+        if not data:
+            # the simulator is driven manually
+            self.sio.emit('manual', data={}, room=sid)
+            return
+
+        now = time.time()
+        if sid in self.sent and sid in self.cycle_latency:
+            self.cycle_latency[sid].add((now - self.sent.pop(sid)) * 1000.0)
+        self.pending[sid] = (data['image'], float(data.get('speed', 0)), now)
+        if not self.scheduled:
+            self.scheduled = True
+            self.sio.start_background_task(self.process_batch)
+
+    def process_batch(self):
+        self.sio.sleep(self.batch_window)
+        sids = list(self.pending)[:self.max_batch]
+        try:
+            items = [(sid,) + self.pending.pop(sid) for sid in sids]
+            self.answer(items)
+        except Exception:
+            # a bad frame must not stop the other simulators
+            logger.exception('Could not predict a batch of {} frames'.format(len(sids)))
+        finally:
+            # one batch at a time, the frames that came in meanwhile are next
+            if self.pending:
+                self.sio.start_background_task(self.process_batch)
+            else:
+                self.scheduled = False
+
+    def answer(self, items):
+        angles, throttles = self.offload(self.predict, [item[1] for item in items])
+        self.batches += 1
+        self.frames += len(items)
+
+        now = time.time()
+        for (sid, _, speed, arrived), angle, throttle in zip(items, angles, throttles):
+            if speed > self.top_speed:
+                throttle = 0.0
+            self.send_control(sid, angle * self.steering_scale, throttle)
+            self.sent[sid] = time.time()
+            if sid in self.server_latency:
+                self.server_latency[sid].add((now - arrived) * 1000.0)
+
+    def offload(self, fn, *args):
+        """
+        Run fn in a native thread when the server runs on eventlet, so
+        decoding and inference don't block the event loop.
+        """
+        if getattr(self.sio, 'async_mode', None) == 'eventlet':
+            from eventlet import tpool
+            return tpool.execute(fn, *args)
+        return fn(*args)
+
+    def decode(self, image):
+        img = util.img.img_to_arr(util.img.binary_to_img(base64.b64decode(image)))
+        if self.image_part is not None:
+            img = self.image_part.run(img)
+        return img
+
+    def predict(self, images):
+        """
+        Decode a list of base64 frames and return their angles and throttles.
+        """
+        imgs = [self.decode(image) for image in images]
+        if hasattr(self.kpart, 'run_batch'):
+            dumping, angles, throttles = self.kpart.run_batch(np.stack(imgs))
+        else:
+            # pilots output (dumping, angle, throttle) or (angle, throttle)
+            outputs = [self.kpart.run(img)[-2:] for img in imgs]
+            angles = [o[0] for o in outputs]
+            throttles = [o[1] for o in outputs]
+        return [float(a) for a in angles], [float(t) for t in throttles]
+
+    def send_control(self, sid, steering_angle, throttle):
+        self.sio.emit('steer', data={'steering_angle': str(steering_angle),
+                                     'throttle': str(throttle)}, room=sid)
+
+    def report(self):
+        lines = ['{} frames in {} batches'.format(self.frames, self.batches)]
+        for sid in self.server_latency:
+            lines.append(self.server_latency[sid].report())
+            lines.append(self.cycle_latency[sid].report())
+        return lines
+
+    def go(self, address):
+        import socketio
+        import eventlet
+        import eventlet.wsgi
+        app_class = getattr(socketio, 'WSGIApp', None) or socketio.Middleware
+        app = app_class(self.sio)
+        eventlet.wsgi.server(eventlet.listen(address), app)
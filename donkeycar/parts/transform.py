@@ -2,6 +2,8 @@
 
 import time
 
+from donkeycar import util
+
 
 class Lambda:
     """
@@ -20,6 +22,24 @@ class Lambda:
         return
 
 
+class ImgPreprocess:
+    """
+    Crop and resize camera frames like a tub does with set_image_options
+    so the pilot gets the images it was trained on.
+    """
+    def __init__(self, target_size=None, roi=None):
+        self.target_size = target_size
+        self.roi = roi
+
+    def run(self, img_arr):
+        if img_arr is None:
+            return None
+        return util.img.preprocess_arr(img_arr, self.target_size, self.roi)
+
+    def shutdown(self):
+        return
+
+
 class PIDController:
     """ Performs a PID computation and returns a control value.
         This is based on the elapsed time (dt) and the current value
@@ -22,15 +22,19 @@ import tornado.web
 import tornado.gen
 
 from donkeycar import util
+from donkeycar.tracer import get_tracer
 
 
 class LocalWebController(tornado.web.Application):
     port = 8887
 
-    def __init__(self, use_chaos=False):
+    def __init__(self, use_chaos=False, model_loader=None):
         """
         Create and publish variables needed on many of
         the web handlers.
+
+        model_loader is called with the name of a model posted to /model,
+        ie to swap the pilot's model while driving.
         """
         print('Starting Donkey Server...')
 
@@ -43,9 +47,13 @@ class LocalWebController(tornado.web.Application):
         self.throttle = 0.0
         self.mode = 'user'
         self.recording = False
+        # reused every loop instead of returning a new tuple
+        self.outputs = [None] * 5
         self.ip_address = util.web.get_ip_address()
         self.access_url = 'http://{}:{}'.format(self.ip_address, self.port)
 
+        self.model_loader = model_loader
+
         self.chaos_on = False
         self.chaos_counter = 0
         self.chaos_frequency = 1000  # frames
@@ -60,6 +68,7 @@ class LocalWebController(tornado.web.Application):
             (r"/", tornado.web.RedirectHandler, dict(url="/drive")),
             (r"/drive", DriveAPI),
             (r"/video", VideoAPI),
+            (r"/model", ModelAPI),
             (r"/static/(.*)", tornado.web.StaticFileHandler, {"path": self.static_file_path}),
         ]
 
@@ -100,7 +109,13 @@ class LocalWebController(tornado.web.Application):
     def _run_threaded(self, img_arr=None):
         self.img_arr = img_arr
         #return self.angle, self.throttle, self.mode, self.recording
-        return self.dumping, self.angle, self.throttle, self.mode, self.recording
+        outputs = self.outputs
+        outputs[0] = self.dumping
+        outputs[1] = self.angle
+        outputs[2] = self.throttle
+        outputs[3] = self.mode
+        outputs[4] = self.recording
+        return outputs
 
     def run(self, img_arr=None):
         return self.run_threaded(img_arr)
@@ -116,13 +131,26 @@ class DriveAPI(tornado.web.RequestHandler):
         Receive post requests as user changes the angle
         and throttle of the vehicle on a the index webpage
         """
+        with get_tracer().span('LocalWebController.drive', cat='web'):
+            data = tornado.escape.json_decode(self.request.body)
+            #adding dumping
+            self.application.dumping = data['dumping']
+            self.application.angle = data['angle']
+            self.application.throttle = data['throttle']
+            self.application.mode = data['drive_mode']
+            self.application.recording = data['recording']
+
+
+class ModelAPI(tornado.web.RequestHandler):
+    def post(self):
+        """
+        Ask for another pilot model, posted as {"model": <name>}.
+        """
+        if self.application.model_loader is None:
+            raise tornado.web.HTTPError(404)
         data = tornado.escape.json_decode(self.request.body)
-        #adding dumping
-        self.application.dumping = data['dumping']
-        self.application.angle = data['angle']
-        self.application.throttle = data['throttle']
-        self.application.mode = data['drive_mode']
-        self.application.recording = data['recording']
+        accepted = self.application.model_loader(data['model'])
+        self.write({'model': data['model'], 'loading': bool(accepted)})
 
 
 class VideoAPI(tornado.web.RequestHandler):
@@ -144,12 +172,13 @@ class VideoAPI(tornado.web.RequestHandler):
             interval = .1
             if self.served_image_timestamp + interval < time.time():
 
-                img = util.img.arr_to_binary(self.application.img_arr)
+                with get_tracer().span('LocalWebController.video_frame', cat='web'):
+                    img = util.img.arr_to_binary(self.application.img_arr)
 
-                self.write(my_boundary)
-                self.write("Content-type: image/jpeg\r\n")
-                self.write("Content-length: %s\r\n\r\n" % len(img))
-                self.write(img)
+                    self.write(my_boundary)
+                    self.write("Content-type: image/jpeg\r\n")
+                    self.write("Content-length: %s\r\n\r\n" % len(img))
+                    self.write(img)
                 self.served_image_timestamp = time.time()
                 yield tornado.gen.Task(self.flush)
             else:
@@ -165,7 +165,8 @@ def train(cfg, tub_names, new_model_path, base_model_path=None):
              val_gen,
              saved_model_path=new_model_path,
              steps=steps_per_epoch,
-             train_split=cfg.TRAIN_TEST_SPLIT)
+             train_split=cfg.TRAIN_TEST_SPLIT,
+             batch_size=cfg.BATCH_SIZE)
 
 
 if __name__ == '__main__':
@@ -165,7 +165,8 @@ def train(cfg, tub_names, model_name):
              val_gen,
              saved_model_path=model_path,
              steps=steps_per_epoch,
-             train_split=cfg.TRAIN_TEST_SPLIT)
+             train_split=cfg.TRAIN_TEST_SPLIT,
+             batch_size=cfg.BATCH_SIZE)
 
 
 
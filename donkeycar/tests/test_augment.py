@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from donkeycar.parts.augment import BatchAugmentation
+from donkeycar.util.data import linear_bin
+from donkeycar.util.times import Timings
+
+
+def make_batch(n=8, h=12, w=16):
+    rs = np.random.RandomState(0)
+    return {'cam/image_array': rs.randint(0, 255, (n, h, w, 3)).astype(np.uint8),
+            'user/angle': np.linspace(-1, 1, n),
+            'user/throttle': np.full(n, 0.5)}
+
+
+def test_bin_matches_linear_bin():
+    batch = make_batch()
+    angles = batch['user/angle'].copy()
+    out = BatchAugmentation(bin_keys=['user/angle'])(batch)
+    expected = np.array([linear_bin(a) for a in angles])
+    assert np.array_equal(out['user/angle'], expected)
+
+
+def test_bin_out_of_range():
+    aug = BatchAugmentation(bin_keys=['user/angle'])
+    with pytest.raises(IndexError):
+        aug({'user/angle': np.array([0.0, 2.0])})
+
+
+def test_flip_negates_angle():
+    batch = make_batch()
+    imgs = batch['cam/image_array'].copy()
+    angles = batch['user/angle'].copy()
+    out = BatchAugmentation(flip=True, seed=1)(batch)
+    flipped = out['user/angle'] != angles
+    for i in range(len(imgs)):
+        if flipped[i]:
+            assert np.array_equal(out['cam/image_array'][i], imgs[i, :, ::-1])
+            assert out['user/angle'][i] == -angles[i]
+        elif angles[i] != 0:
+            assert np.array_equal(out['cam/image_array'][i], imgs[i])
+    assert np.array_equal(out['user/throttle'], np.full(8, 0.5))
+
+
+def test_shift_and_jitter_keep_shape_and_dtype():
+    batch = make_batch()
+    aug = BatchAugmentation(brightness=0.2, contrast=0.2, shift=3, seed=2)
+    out = aug(batch)
+    assert out['cam/image_array'].shape == (8, 12, 16, 3)
+    assert out['cam/image_array'].dtype == np.uint8
+    assert set(aug.timings.report().keys()) == {'brightness_contrast', 'shift'}
+
+
+def test_shift_repeats_edges():
+    imgs = np.zeros((4, 6, 6, 1), dtype=np.uint8)
+    imgs[:, :, :] = np.arange(6, dtype=np.uint8).reshape(1, 1, 6, 1)
+    out = BatchAugmentation(shift=2, seed=3)({'cam/image_array': imgs})['cam/image_array']
+    # shifting columns of a horizontal ramp keeps every row identical and in range
+    assert (out == out[:, :1]).all()
+    assert out.min() >= 0 and out.max() <= 5
+
+
+def test_timings():
+    timings = Timings()
+    with timings.time('a'):
+        pass
+    timings.add('a', 0.5)
+    r = timings.report()
+    assert r['a']['count'] == 2
+    assert r['a']['total_s'] >= 0.5
+    assert 'a:' in str(timings)
+
+
+def test_throughput_monitor(tmpdir):
+    import json
+    from donkeycar.util.times import ThroughputMonitor
+
+    path = str(tmpdir.join('log.json'))
+    pipeline = {'train': Timings()}
+    monitor = ThroughputMonitor(path, pipeline)
+    monitor.epoch_begin(0)
+    for _ in range(3):
+        pipeline['train'].add('decode', 0.01)
+        monitor.step_begin()
+        monitor.step_end(size=4)
+    entry = monitor.epoch_end(0, {'loss': np.float32(0.5)})
+
+    assert entry['samples'] == 12
+    assert entry['steps'] == 3
+    assert 0 <= entry['input_wait_frac'] <= 1
+    assert entry['pipeline']['train']['decode']['count'] == 3
+    with open(path) as f:
+        log = json.load(f)
+    assert log['epochs'][0]['metrics'] == {'loss': 0.5}
+    assert 'samples/s' in ThroughputMonitor.summary(entry)
+
+
+def test_soft_targets_mix_and_flip():
+    n = 6
+    soft = np.tile(np.linspace(0, 1, 15), (n, 1))
+    soft /= soft.sum(axis=1, keepdims=True)
+    batch = {'user/angle': np.zeros(n), 'teacher/angle': soft.copy()}
+    aug = BatchAugmentation(bin_keys=['user/angle'], soft_targets={'user/angle': 'teacher/angle'},
+                            soft_weight=0.5)
+    out = aug(batch)
+    hard = linear_bin(0)
+    assert 'teacher/angle' not in out
+    assert np.allclose(out['user/angle'], 0.5 * soft + 0.5 * hard)
+
+    # a flipped distribution is mirrored like its angle
+    batch = {'cam/image_array': np.zeros((n, 4, 4, 3), dtype=np.uint8),
+             'user/angle': np.full(n, 0.5), 'teacher/angle': soft.copy()}
+    aug = BatchAugmentation(flip=True, flip_keys=['user/angle', 'teacher/angle'], seed=0)
+    out = aug(batch)
+    flipped = out['user/angle'] < 0
+    assert flipped.any() and not flipped.all()
+    assert np.allclose(out['teacher/angle'][flipped], soft[flipped, ::-1])
+    assert np.allclose(out['teacher/angle'][~flipped], soft[~flipped])
+
+
+def test_soften():
+    from donkeycar.util.binning import soften
+    p = np.array([[0.7, 0.2, 0.1]])
+    flat = soften(p, 2.0)
+    assert np.allclose(flat.sum(), 1)
+    assert flat[0, 0] < 0.7 and flat[0, 2] > 0.1
+    assert np.array_equal(soften(p, 1.0), p)
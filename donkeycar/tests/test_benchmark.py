@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import json
+import time
+
+from donkeycar.management import benchmark
+
+
+def test_measure_latency():
+    calls = []
+
+    def predict(batch):
+        calls.append(batch.shape)
+        time.sleep(0.001)
+
+    result = benchmark.measure_latency(predict, (12, 16, 3), runs=5, warmup=2)
+    assert calls == [(1, 12, 16, 3)] * 7
+    assert result['p50_ms'] >= 1.0
+    assert result['max_ms'] >= result['p90_ms'] >= result['p50_ms']
+
+
+def test_select_model():
+    results = [{'name': 'big', 'p90_ms': 50.0, 'val_loss': 0.1},
+               {'name': 'compact', 'p90_ms': 20.0, 'val_loss': 0.2},
+               {'name': 'tiny', 'p90_ms': 10.0, 'val_loss': 0.3},
+               {'name': 'untrained', 'p90_ms': 5.0, 'val_loss': None}]
+    assert benchmark.select_model(results, 60)['name'] == 'big'
+    assert benchmark.select_model(results, 25)['name'] == 'compact'
+    assert benchmark.select_model(results, 6)['name'] == 'untrained'
+    assert benchmark.select_model(results, 1) is None
+
+
+def test_train_log_val_loss(tmpdir):
+    model_path = str(tmpdir.join('model.h5'))
+    assert benchmark.train_log_val_loss(model_path) is None
+    with open(model_path + '.train_log.json', 'w') as f:
+        json.dump({'epochs': [{'metrics': {'val_loss': 0.4}},
+                              {'metrics': {'val_loss': 0.3}}]}, f)
+    assert benchmark.train_log_val_loss(model_path) == 0.3
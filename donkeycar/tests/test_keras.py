@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import pytest
-from donkeycar.parts.keras import KerasPilot, KerasLinear
+import numpy as np
+from donkeycar.parts.keras import KerasPilot, KerasLinear, KerasCategorical
 from donkeycar.parts.keras import default_linear
 
 
@@ -13,3 +14,131 @@ def test_linear_with_model():
     kc = KerasLinear(default_linear())
     assert kc.model is not None
 
+
+
+def test_categorical_heads_match_full_model():
+    kc = KerasCategorical(input_shape=(60, 80, 3))
+    imgs = np.random.randint(0, 255, (2, 60, 80, 3)).astype(np.float32)
+    features = kc.backbone().predict(imgs)
+    head_out = kc.head_model().predict(features)
+    full_out = kc.model.predict(imgs)
+    for h, f in zip(head_out, full_out):
+        assert np.allclose(h, f, atol=1e-5)
+    assert kc.backbone_hash() == kc.backbone_hash()
+
+
+def test_compact_architectures_are_smaller():
+    from donkeycar.parts.keras import CATEGORICAL_ARCHITECTURES
+    params = {name: fn((60, 80, 3)).count_params() for name, fn in CATEGORICAL_ARCHITECTURES.items()}
+    assert params['tiny'] < params['compact'] < params['default']
+
+
+def test_categorical_load_async_swaps_on_run(tmpdir):
+    kc = KerasCategorical(input_shape=(60, 80, 3))
+    other = KerasCategorical(input_shape=(60, 80, 3))
+    path = str(tmpdir.join('other.h5'))
+    other.model.save(path)
+
+    img = np.random.randint(0, 255, (60, 80, 3)).astype(np.uint8)
+    kc.run(img)
+    assert kc.load_async(path)
+    kc.loader.join()
+    assert kc.model is not other.model
+    kc.run(img)
+    assert kc.model_path == path
+    assert kc.next_model is None
+
+
+def test_categorical_load_async_refuses_other_shapes(tmpdir):
+    kc = KerasCategorical(input_shape=(60, 80, 3))
+    path = str(tmpdir.join('other.h5'))
+    KerasCategorical(input_shape=(120, 160, 3)).model.save(path)
+    kc.load_async(path)
+    kc.loader.join()
+    assert kc.next_model is None
+
+
+def test_ensemble_matches_single_models():
+    from donkeycar.parts.keras import KerasEnsemble, compact_categorical
+    active = KerasCategorical(input_shape=(60, 80, 3))
+    shadow = KerasCategorical(model=compact_categorical((60, 80, 3)))
+    ensemble = KerasEnsemble([active.model, shadow.model])
+
+    img = np.random.randint(0, 255, (60, 80, 3)).astype(np.uint8)
+    outputs = ensemble.run(img)
+    assert len(outputs) == 3 + 2 + 2
+    assert outputs[1] == active.run(img)[1]
+    assert outputs[3] == shadow.run(img)[1]
+    assert outputs[5] == abs(outputs[3] - outputs[1])
+    assert ensemble.stats.count == 1
+
+
+def test_cascade_gates_dumping():
+    from donkeycar.parts.keras import KerasCascade
+    kc = KerasCascade(input_shape=(60, 80, 3), every=0, hold=2, rest_dumping=0.0)
+    full = KerasCategorical(model=kc.model)
+    img = np.random.randint(0, 255, (60, 80, 3)).astype(np.uint8)
+
+    dumping, angle, throttle = kc.run(img)
+    assert dumping == 0.0
+    assert angle == full.run(img)[1]
+    assert kc.full_runs == 0
+
+    dumping, angle, throttle = kc.run(img, None, True)
+    assert dumping == full.run(img)[0]
+    kc.run(img)
+    assert kc.full_runs == 2
+    assert kc.stats()['runs'] == 3
+
+
+def test_ensemble_of_saved_models(tmpdir):
+    from donkeycar.parts.keras import KerasEnsemble
+    paths = []
+    models = []
+    for i in range(2):
+        kc = KerasCategorical(input_shape=(60, 80, 3))
+        path = str(tmpdir.join('pilot_{}.h5'.format(i)))
+        kc.model.save(path)
+        paths.append(path)
+        models.append(kc)
+
+    ensemble = KerasEnsemble()
+    ensemble.load(paths)
+    img = np.random.randint(0, 255, (60, 80, 3)).astype(np.uint8)
+    outputs = ensemble.run(img)
+    assert outputs[1] == models[0].run(img)[1]
+    assert outputs[3] == models[1].run(img)[1]
+
+
+def test_ensemble_swaps_active_model(tmpdir):
+    from donkeycar.parts.keras import KerasEnsemble
+    active = KerasCategorical(input_shape=(60, 80, 3))
+    shadow = KerasCategorical(input_shape=(60, 80, 3))
+    ensemble = KerasEnsemble([active.model, shadow.model])
+
+    new = KerasCategorical(input_shape=(60, 80, 3))
+    path = str(tmpdir.join('new.h5'))
+    new.model.save(path)
+    assert ensemble.load_async(path)
+    ensemble.loader.join()
+    assert ensemble.next_model is not None
+
+    img = np.random.randint(0, 255, (60, 80, 3)).astype(np.uint8)
+    outputs = ensemble.run(img)
+    assert ensemble.model_path == path
+    assert outputs[1] == new.run(img)[1]
+    assert outputs[3] == shadow.run(img)[1]
+
+
+def test_throughput_callback_counts_batch_size(tmpdir):
+    from donkeycar.parts.keras import ThroughputCallback
+    from donkeycar.util.times import ThroughputMonitor
+
+    monitor = ThroughputMonitor(str(tmpdir.join('log.json')))
+    callback = ThroughputCallback(monitor, batch_size=8)
+    callback.on_epoch_begin(0)
+    for batch in range(3):
+        callback.on_batch_begin(batch)
+        callback.on_batch_end(batch, {'loss': 0.5})
+    entry = monitor.epoch_end(0, {'loss': 0.5})
+    assert entry['samples'] == 24
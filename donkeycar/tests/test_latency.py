@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import time
+import pytest
+
+from donkeycar.parts.latency import LatencyHistogram, FrameLatency
+from donkeycar.parts.actuator import PWMSteering
+
+
+class FakeController:
+    def set_pulse(self, pulse):
+        self.pulse = pulse
+
+
+def test_histogram_percentiles():
+    h = LatencyHistogram('test', max_ms=100, bin_ms=10)
+    for ms in range(100):
+        h.add(ms)
+    assert h.count == 100
+    assert h.percentile(50) == 50
+    assert h.percentile(99) == 100
+    assert h.mean() == pytest.approx(49.5)
+
+
+def test_histogram_ignores_missing_values():
+    h = LatencyHistogram('test')
+    h.add(None)
+    h.add(float('nan'))
+    assert h.count == 0
+
+
+def test_frame_latency_splits_stages():
+    fl = FrameLatency()
+    inference_ms, total_ms = fl.run(100.0, 100.03, 0.05)
+    assert inference_ms == pytest.approx(30)
+    assert total_ms == pytest.approx(50)
+    assert fl.actuation.count == 1
+
+
+def test_frame_latency_user_mode():
+    fl = FrameLatency()
+    assert fl.run(100.0, None, 0.02)[0] is None
+    assert fl.total.count == 1
+    assert fl.run(None, None, None) == (None, None)
+
+
+def test_steering_returns_frame_age():
+    steering = PWMSteering(controller=FakeController())
+    assert steering.run(0) is None
+    age = steering.run(0, frame_time=time.time() - 0.1)
+    assert age >= 0.1
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import unittest
 import pytest
+import numpy as np
 from donkeycar.memory import Memory
 
 class TestMemory(unittest.TestCase):
@@ -67,3 +68,40 @@ class TestMemory(unittest.TestCase):
         
         assert dict(mem.items()) == {'myitem': 888}
 
+
+    def test_history_key(self):
+        mem = Memory()
+        assert mem.add_history_key('cam/image_array[-3:]')
+        assert not mem.add_history_key('cam/image_array')
+
+    def test_history_last_values(self):
+        mem = Memory()
+        mem.add_history('x', 3)
+        for i in range(5):
+            mem.put(['x'], np.full((2, 2), i))
+        hist = mem.get(['x[-3:]'])[0]
+        assert hist.shape == (3, 2, 2)
+        assert list(hist[:, 0, 0]) == [2, 3, 4]
+        assert list(mem.get(['x[-2:]'])[0][:, 0, 0]) == [3, 4]
+
+    def test_history_is_a_view(self):
+        mem = Memory()
+        mem.add_history_key('x[-2:]')
+        for i in range(7):
+            mem['x'] = np.array([i])
+            hist = mem.get(['x[-2:]'])[0]
+            assert hist.base is not None
+        assert list(hist[:, 0]) == [5, 6]
+
+    def test_history_before_full(self):
+        mem = Memory()
+        mem.add_history_key('x[-3:]')
+        mem.put(['x', 'y'], [np.array([1]), 2])
+        assert list(mem.get(['x[-3:]'])[0][:, 0]) == [0, 0, 1]
+
+    def test_history_too_long(self):
+        mem = Memory()
+        mem.add_history('x', 2)
+        mem['x'] = np.array([1])
+        with pytest.raises(IndexError):
+            mem.histories['x'].last(3)
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from donkeycar.parts.motion import FrameDifference
+
+
+def test_frame_difference():
+    detector = FrameDifference(threshold=8.0)
+    still = np.full((120, 160, 3), 100, dtype=np.uint8)
+    assert not detector.run(still)
+    assert not detector.run(still.copy())
+    assert detector.difference == 0
+
+    moved = still.copy()
+    moved[:, :80] = 200
+    assert detector.run(moved)
+    assert detector.difference > 8
+
+
+def test_frame_difference_missing_frame():
+    detector = FrameDifference()
+    assert not detector.run(None)
+    assert not detector.run(np.zeros((120, 160), dtype=np.uint8))
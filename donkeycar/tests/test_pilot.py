@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+import pytest
+
+from donkeycar.parts.pilot import AsyncPilot, ModelWatcher, ShadowStats, drive_mode
+
+
+class SlowPilot:
+    """
+    Returns the frame value as angle after `delay` seconds.
+    """
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.frames = []
+
+    def run(self, img, frame_time=None):
+        time.sleep(self.delay)
+        self.frames.append(img)
+        if frame_time is not None:
+            return 0.0, img, 0.5, frame_time, time.time()
+        return 0.0, img, 0.5
+
+    def shutdown(self):
+        pass
+
+
+def start(pilot):
+    t = threading.Thread(target=pilot.update)
+    t.daemon = True
+    t.start()
+    return t
+
+
+def wait_result(pilot, timeout=1.0):
+    end = time.time() + timeout
+    while pilot.result is None and time.time() < end:
+        time.sleep(0.005)
+
+
+def test_async_pilot_returns_immediately():
+    pilot = AsyncPilot(SlowPilot(delay=0.1))
+    t = start(pilot)
+    start_time = time.time()
+    assert pilot.run_threaded(0.1) is None
+    assert time.time() - start_time < 0.05
+
+    wait_result(pilot)
+    start_time = time.time()
+    dumping, angle, throttle, age = pilot.run_threaded(0.2)
+    assert time.time() - start_time < 0.05
+    assert angle == 0.1
+    assert age >= 0.1
+    pilot.shutdown()
+    t.join(1)
+    assert not t.is_alive()
+
+
+def test_async_pilot_skips_old_frames():
+    inner = SlowPilot(delay=0.05)
+    pilot = AsyncPilot(inner)
+    t = start(pilot)
+    for i in range(10):
+        pilot.run_threaded(float(i))
+        time.sleep(0.01)
+    time.sleep(0.15)
+    pilot.shutdown()
+    t.join(1)
+    # frames replaced while the pilot was busy are never run
+    assert len(inner.frames) < 10
+    assert inner.frames[-1] == 9.0
+    assert pilot.stats()['dropped_frames'] > 0
+
+
+def test_async_pilot_age_from_frame_time():
+    pilot = AsyncPilot(SlowPilot(delay=0.0))
+    t = start(pilot)
+    frame_time = time.time() - 0.5
+    pilot.run_threaded(0.3, frame_time)
+    wait_result(pilot)
+    outputs = pilot.run_threaded(0.3, time.time())
+    pilot.shutdown()
+    t.join(1)
+    assert len(outputs) == 6
+    assert outputs[3] == frame_time
+    assert outputs[-1] >= 0.5
+    assert pilot.stats()['stale'] == 1
+
+
+def test_async_pilot_ignores_missing_frames():
+    inner = SlowPilot(delay=0.0)
+    pilot = AsyncPilot(inner)
+    t = start(pilot)
+    pilot.run_threaded(None)
+    time.sleep(0.05)
+    pilot.shutdown()
+    t.join(1)
+    assert inner.frames == []
+
+
+class FailingPilot(SlowPilot):
+    def run(self, img, frame_time=None):
+        if img < 0:
+            raise ValueError('bad frame')
+        return super(FailingPilot, self).run(img, frame_time)
+
+
+def test_async_pilot_drops_outputs_when_the_pilot_fails():
+    pilot = AsyncPilot(FailingPilot(delay=0.0), outputs=3)
+    t = start(pilot)
+    pilot.run_threaded(0.1)
+    wait_result(pilot)
+    assert pilot.run_threaded(-1.0)[1] == 0.1
+    end = time.time() + 1.0
+    while pilot.errors == 0 and time.time() < end:
+        time.sleep(0.005)
+    assert pilot.run_threaded(None) == (None,) * 4
+    # the worker is still running
+    pilot.run_threaded(0.2)
+    wait_result(pilot)
+    assert pilot.run_threaded(None)[1] == 0.2
+    pilot.shutdown()
+    t.join(1)
+    assert pilot.stats()['errors'] == 1
+
+
+def test_async_pilot_resets_after_a_pause():
+    pilot = AsyncPilot(SlowPilot(delay=0.0), outputs=3, reset_s=0.1)
+    t = start(pilot)
+    pilot.run_threaded(0.1)
+    wait_result(pilot)
+    assert pilot.run_threaded(None)[1] == 0.1
+    # not run while the user drives
+    time.sleep(0.15)
+    assert pilot.run_threaded(None) == (None,) * 4
+    assert pilot.previous is None
+    pilot.shutdown()
+    t.join(1)
+
+
+class PulseController:
+    def __init__(self):
+        self.pulses = []
+
+    def set_pulse(self, pulse):
+        self.pulses.append(pulse)
+
+
+def test_async_pilot_first_loop_drives_with_user_values():
+    from donkeycar.vehicle import Vehicle
+    from donkeycar.parts.transform import Lambda
+    from donkeycar.parts.actuator import PWMSteering, PWMThrottle
+
+    V = Vehicle()
+    V.mem.put(['user/mode', 'user/dumping', 'user/angle', 'user/throttle', 'run_pilot', 'cam/image_array'],
+              ['local', 0.0, 0.0, 0.0, True, 0.5])
+    # the worker thread isn't started, as on the first loops before a prediction
+    pilot = AsyncPilot(SlowPilot(), outputs=3)
+    V.add(pilot, inputs=['cam/image_array'],
+          outputs=['pilot/dumping', 'pilot/angle', 'pilot/throttle', 'pilot/age'],
+          run_condition='run_pilot', threaded=True)
+    V.add(Lambda(drive_mode),
+          inputs=['user/mode', 'user/dumping', 'user/angle', 'user/throttle',
+                  'pilot/dumping', 'pilot/angle', 'pilot/throttle',
+                  'cam/frame_time', 'pilot/frame_time', 'pilot/inference_time'],
+          outputs=['dumping', 'angle', 'throttle', 'frame_time', 'inference_time'])
+    steering, throttle = PulseController(), PulseController()
+    V.add(PWMSteering(controller=steering), inputs=['angle', 'frame_time'])
+    throttle_part = PWMThrottle(controller=throttle)
+    V.add(throttle_part, inputs=['throttle'])
+
+    V.update_parts()
+    assert V.mem['pilot/angle'] is None
+    assert steering.pulses == [390]
+    assert throttle.pulses[-1] == throttle_part.zero_pulse
+
+
+def test_drive_mode():
+    user = ('local', 0.1, 0.2, 0.3)
+    assert drive_mode(*user, 0.4, 0.5, 0.6)[:3] == (0.4, 0.5, 0.6)
+    assert drive_mode('local_angle', 0.1, 0.2, 0.3, 0.4, 0.5, 0.6)[:3] == (0.4, 0.5, 0.3)
+    assert drive_mode('user', 0.1, 0.2, 0.3, 0.4, 0.5, 0.6)[:3] == (0.1, 0.2, 0.3)
+    assert drive_mode(*user, None, None, None)[:3] == (0.1, 0.2, 0.3)
+
+
+def test_extrapolate_angle():
+    pilot = AsyncPilot(SlowPilot(), extrapolate=True, max_extrapolation=0.2)
+    # angle moving at 1 per second
+    assert pilot.extrapolate_angle(0.5, 1.0, 0.4, 0.9, 0.1) == pytest.approx(0.6)
+    # limited to max_extrapolation and to the angle range
+    assert pilot.extrapolate_angle(0.5, 1.0, 0.4, 0.9, 1.0) == pytest.approx(0.7)
+    assert pilot.extrapolate_angle(0.9, 1.0, 0.0, 0.9, 0.2) == 1.0
+
+
+def test_async_pilot_extrapolates():
+    pilot = AsyncPilot(SlowPilot(delay=0.0), extrapolate=True)
+    pilot.previous = ((0.0, 0.2, 0.5, 9.9, 9.9), 9.9)
+    pilot.result = (0.0, 0.3, 0.5, 10.0, 10.0)
+    pilot.result_time = 10.0
+    dumping, angle, throttle, frame_time, inference_time, age = pilot.run_threaded(None, 10.1)
+    assert angle > 0.3
+
+
+def test_model_watcher(tmpdir):
+    tmpdir.join('old.h5').write('old')
+    loaded = []
+    watcher = ModelWatcher(str(tmpdir), loaded.append)
+    assert watcher.check() == []
+
+    new = tmpdir.join('new.h5')
+    new.write('half')
+    tmpdir.join('notes.txt').write('not a model')
+    # loaded once it didn't change for a poll
+    assert watcher.check() == []
+    assert watcher.check() == [str(new)]
+    assert watcher.check() == []
+    assert loaded == [str(new)]
+
+
+def test_shadow_stats():
+    stats = ShadowStats(2, angle_threshold=0.2)
+    assert stats.update([0.0, 0.1, -0.3], [0.5, 0.5, 0.2]) == (pytest.approx(0.3), pytest.approx(0.3))
+    stats.update([0.5, 0.5, 0.5], [0.5, 0.4, 0.5])
+    first, second = stats.report()
+    assert first['frames'] == 2
+    assert first['angle_mean'] == pytest.approx(0.05)
+    assert first['throttle_mean'] == pytest.approx(0.05)
+    assert first['disagree'] == 0
+    assert second['angle_max'] == pytest.approx(0.3)
+    assert second['disagree'] == 0.5
+
+
+def test_shadow_stats_without_shadows():
+    stats = ShadowStats(0)
+    assert stats.update([0.1], [0.5]) == (0.0, 0.0)
+    assert stats.report() == []
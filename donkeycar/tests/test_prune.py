@@ -0,0 +1,82 @@
+import numpy as np
+
+from donkeycar.management import prune
+
+
+def layer(class_name, name, inbound=None, **config):
+    config['name'] = name
+    nodes = [[[inbound, 0, 0, {}]]] if inbound else []
+    return {'class_name': class_name, 'name': name, 'config': config, 'inbound_nodes': nodes}
+
+
+def model_config():
+    layers = [layer('InputLayer', 'img_in'),
+              layer('Conv2D', 'conv1', 'img_in', filters=4),
+              layer('Conv2D', 'conv2', 'conv1', filters=4),
+              layer('Flatten', 'flattened', 'conv2'),
+              layer('Dense', 'dense1', 'flattened', units=6),
+              layer('Dropout', 'dropout', 'dense1'),
+              layer('Dense', 'out', 'dropout', units=2)]
+    return {'layers': layers, 'input_layers': [['img_in', 0, 0]], 'output_layers': [['out', 0, 0]]}
+
+
+def model_weights():
+    random = np.random.RandomState(0)
+    return {'img_in': [],
+            'conv1': [random.randn(3, 3, 3, 4), random.randn(4)],
+            'conv2': [random.randn(3, 3, 4, 4), random.randn(4)],
+            'flattened': [],
+            'dense1': [random.randn(2 * 2 * 4, 6), random.randn(6)],
+            'dropout': [],
+            'out': [random.randn(6, 2), random.randn(2)]}
+
+
+def test_keep_indices():
+    scores = np.array([0.5, 3.0, 0.1, 2.0])
+    assert list(prune.keep_indices(scores, 0.5)) == [1, 3]
+    assert list(prune.keep_indices(scores, 1.0)) == [1]
+    assert list(prune.keep_indices(scores, 0.0)) == [0, 1, 2, 3]
+
+
+def test_prune_config():
+    config, weights = model_config(), model_weights()
+    new_config, new_weights, report = prune.prune_config(config, weights, 0.5)
+
+    assert report == {'conv1': (4, 2), 'conv2': (4, 2), 'dense1': (6, 3)}
+    layers = {l['name']: l['config'] for l in new_config['layers']}
+    assert layers['conv1']['filters'] == 2
+    assert layers['dense1']['units'] == 3
+    # the original config is unchanged
+    assert config['layers'][1]['config']['filters'] == 4
+
+    keep1 = prune.keep_indices(prune.importance('Conv2D', weights['conv1']), 0.5)
+    keep2 = prune.keep_indices(prune.importance('Conv2D', weights['conv2']), 0.5)
+    assert new_weights['conv1'][0].shape == (3, 3, 3, 2)
+    np.testing.assert_array_equal(new_weights['conv1'][1], weights['conv1'][1][keep1])
+    assert new_weights['conv2'][0].shape == (3, 3, 2, 2)
+    np.testing.assert_array_equal(new_weights['conv2'][0], weights['conv2'][0][:, :, keep1][..., keep2])
+
+    # the flattened rows of the removed conv2 filters are dropped
+    rows = [r for r in range(16) if r % 4 in keep2]
+    assert new_weights['dense1'][0].shape == (8, 3)
+    keep3 = prune.keep_indices(prune.importance('Dense', weights['dense1']), 0.5)
+    np.testing.assert_array_equal(new_weights['dense1'][0], weights['dense1'][0][rows][:, keep3])
+    np.testing.assert_array_equal(new_weights['out'][0], weights['out'][0][keep3])
+    assert prune.count_params(new_weights) < prune.count_params(weights)
+
+
+def test_prune_config_skip():
+    config, weights = model_config(), model_weights()
+    _, new_weights, report = prune.prune_config(config, weights, 0.5, skip=('conv2',))
+    assert 'conv2' not in report
+    assert new_weights['conv2'][0].shape == (3, 3, 2, 4)
+    assert new_weights['dense1'][0].shape == (16, 3)
+
+
+def test_cluster_weights():
+    w = np.random.RandomState(0).randn(20, 10).astype(np.float32)
+    clustered = prune.cluster_weights(w, 4)
+    assert clustered.shape == w.shape
+    assert clustered.dtype == w.dtype
+    assert len(np.unique(clustered)) <= 4
+    assert np.abs(clustered - w).mean() < np.abs(w).mean()
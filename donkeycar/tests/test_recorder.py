@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+import pytest
+
+import donkeycar as dk
+from donkeycar.memory import Memory
+from donkeycar.parts.recorder import FlightRecorder, load_flight
+from donkeycar.parts.transform import Lambda
+
+
+@pytest.fixture
+def recorder(tmpdir):
+    return FlightRecorder(path=str(tmpdir), seconds=1, rate_hz=10, thumbnail_stride=4)
+
+
+def test_record_keeps_last_ticks(recorder):
+    mem = Memory()
+    for i in range(25):
+        mem.put(['angle', 'mode', 'cam/image_array'],
+                [i / 100, 'user', np.full((120, 160, 3), i, dtype=np.uint8)])
+        recorder.record(mem)
+
+    data = recorder.snapshot()
+    assert len(data['_times']) == 10
+    assert data['angle'][0] == pytest.approx(0.15)
+    assert data['angle'][-1] == pytest.approx(0.24)
+    assert data['mode'][-1] == 'user'
+    assert data['cam/image_array'].shape == (10, 30, 40, 3)
+    assert data['cam/image_array'][-1, 0, 0, 0] == 24
+
+
+def test_record_none_and_late_channels(recorder):
+    mem = Memory()
+    mem.put(['pilot/angle'], None)
+    recorder.record(mem)
+    mem.put(['pilot/angle'], 0.5)
+    recorder.record(mem)
+    mem.put(['pilot/angle'], None)
+    recorder.record(mem)
+
+    data = recorder.snapshot()
+    assert len(data['pilot/angle']) == 3
+    assert data['pilot/angle'][1] == 0.5
+    assert np.isnan(data['pilot/angle'][2])
+
+
+def test_dump_and_load(recorder):
+    mem = Memory()
+    mem.put(['user/angle', 'user/mode'], [0.1, 'local'])
+    recorder.record(mem)
+
+    path = recorder.dump()
+    assert os.path.exists(path)
+    data = load_flight(path)
+    assert data['user/angle'][0] == pytest.approx(0.1)
+    assert data['user/mode'][0] == 'local'
+
+
+def test_vehicle_records_every_tick(recorder):
+    v = dk.Vehicle(recorder=recorder)
+    v.add(Lambda(lambda: 1), outputs=['test_out'])
+    for _ in range(3):
+        v.update_parts()
+    assert recorder.ticks == 3
+    assert recorder.overhead() >= 0
+
+
+def test_record_float_images(recorder):
+    mem = Memory()
+    mem.put(['normalized', 'float'],
+            [np.full((120, 160, 3), 0.5), np.full((120, 160, 3), 200.0)])
+    recorder.record(mem)
+    data = recorder.snapshot()
+    assert data['normalized'][-1, 0, 0, 0] == 127
+    assert data['float'][-1, 0, 0, 0] == 200
+
+
+def test_failed_crash_dump_keeps_the_crash(recorder):
+    def crash():
+        raise ValueError('part crashed')
+
+    def dump(reason=None):
+        raise OSError('disk full')
+
+    recorder.dump = dump
+    v = dk.Vehicle(recorder=recorder)
+    v.add(Lambda(crash), outputs=['test_out'])
+    with pytest.raises(ValueError):
+        v.start(rate_hz=100, max_loop_count=1)
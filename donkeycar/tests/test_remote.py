@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import time
+import threading
+import numpy as np
+import pytest
+
+from donkeycar.parts.remote import RemotePilot, InferenceServer, pack_request, decode_frame, REQUEST
+
+
+def mean_predict(delay=0.0):
+    """
+    Predicts the mean pixel value / 255 as angle.
+    """
+    def predict(imgs):
+        time.sleep(delay)
+        n = len(imgs)
+        angle = imgs.reshape(n, -1).mean(axis=1) / 255.0
+        return np.zeros(n), angle, np.full(n, 0.5)
+    return predict
+
+
+class FixedPilot:
+    def run(self, img_arr):
+        return -1.0, -1.0, -1.0
+
+    def shutdown(self):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = InferenceServer(mean_predict(), host='127.0.0.1', port=0)
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    yield server
+    server.shutdown()
+
+
+def test_pack_request_roundtrip():
+    img = np.random.randint(0, 255, (12, 16, 3)).astype(np.uint8)
+    data = pack_request(7, img)
+    length, seq, encoding, h, w, c = REQUEST.unpack_from(data)
+    assert seq == 7
+    assert length == len(data) - REQUEST.size
+    np.testing.assert_array_equal(decode_frame(encoding, (h, w, c), data[REQUEST.size:]), img)
+
+
+def test_pack_request_jpeg():
+    img = np.full((120, 160, 3), 128, dtype=np.uint8)
+    data = pack_request(1, img, jpeg_quality=90)
+    length, seq, encoding, h, w, c = REQUEST.unpack_from(data)
+    assert length < img.nbytes
+    decoded = decode_frame(encoding, (h, w, c), data[REQUEST.size:])
+    assert np.abs(decoded.astype(int) - 128).max() < 3
+
+
+def test_remote_pilot(server):
+    pilot = RemotePilot('127.0.0.1', server.port, deadline_ms=500)
+    img = np.full((12, 16, 3), 51, dtype=np.uint8)
+    dumping, angle, throttle = pilot.run(img)
+    assert angle == pytest.approx(0.2)
+    assert throttle == 0.5
+
+    outputs = pilot.run(img, 10.0)
+    assert len(outputs) == 5
+    assert outputs[3] == 10.0
+    assert pilot.remote == 2
+    pilot.shutdown()
+
+
+def test_remote_pilot_batches_cars(server):
+    pilots = [RemotePilot('127.0.0.1', server.port, deadline_ms=1000) for _ in range(3)]
+    results = [None] * 3
+
+    def drive(i):
+        results[i] = pilots[i].run(np.full((12, 16, 3), 51 * i, dtype=np.uint8))
+
+    threads = [threading.Thread(target=drive, args=(i,)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert [r[1] for r in results] == [pytest.approx(0.0), pytest.approx(0.2), pytest.approx(0.4)]
+    assert server.stats()['frames'] == 3
+
+
+def test_remote_pilot_deadline_fallback():
+    server = InferenceServer(mean_predict(delay=0.2), host='127.0.0.1', port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    pilot = RemotePilot('127.0.0.1', server.port, deadline_ms=20, fallback=FixedPilot())
+    img = np.zeros((12, 16, 3), dtype=np.uint8)
+    start = time.time()
+    assert pilot.run(img) == (-1.0, -1.0, -1.0)
+    assert time.time() - start < 0.15
+    assert pilot.late == 1
+    server.shutdown()
+    pilot.shutdown()
+
+
+def test_remote_pilot_without_server():
+    server = InferenceServer(mean_predict(), host='127.0.0.1', port=0)
+    port = server.port
+    server.shutdown()
+    pilot = RemotePilot('127.0.0.1', port, deadline_ms=20)
+    pilot.last = (0.0, 0.3, 0.4)
+    assert pilot.run(np.zeros((12, 16, 3), dtype=np.uint8)) == (0.0, 0.3, 0.4)
+    assert pilot.offline == 1
+
+
+def test_server_survives_predict_errors():
+    calls = []
+
+    def predict(imgs):
+        calls.append(len(imgs))
+        if len(calls) == 1:
+            raise ValueError('bad batch')
+        return mean_predict()(imgs)
+
+    server = InferenceServer(predict, host='127.0.0.1', port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    pilot = RemotePilot('127.0.0.1', server.port, deadline_ms=200)
+    img = np.full((12, 16, 3), 51, dtype=np.uint8)
+    assert pilot.run(img) == (0.0, 0.0, 0.0)
+    assert pilot.run(img)[1] == pytest.approx(0.2)
+    assert server.stats()['errors'] == 1
+    server.shutdown()
+    pilot.shutdown()
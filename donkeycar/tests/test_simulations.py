@@ -21,3 +21,124 @@ class TestSquareBoxCamera(unittest.TestCase):
     def test_run_types(self):
         arr = self.cam.run(50, 50)
         assert type(arr) == np.ndarray
+
+    def test_previous_frame_is_kept(self):
+        first = self.cam.run(50, 50)
+        copy = first.copy()
+        second = self.cam.run(10, 10)
+        assert second is not first
+        assert first.dtype == np.uint8
+        assert np.array_equal(first, copy)
+
+
+class FakeSocketIO:
+    """
+    Runs the background tasks right away and keeps the emitted messages.
+    """
+    def __init__(self):
+        self.emitted = []
+        self.tasks = []
+
+    def emit(self, event, data=None, room=None):
+        self.emitted.append((event, data, room))
+
+    def start_background_task(self, fn):
+        self.tasks.append(fn)
+
+    def sleep(self, seconds):
+        pass
+
+    def run_tasks(self):
+        while self.tasks:
+            self.tasks.pop(0)()
+
+
+class MeanPilot:
+    def __init__(self):
+        self.batches = []
+
+    def run_batch(self, imgs):
+        self.batches.append(len(imgs))
+        n = len(imgs)
+        return np.zeros(n), imgs.reshape(n, -1).mean(axis=1) / 255.0, np.full(n, 0.5)
+
+
+def encode(value):
+    import base64
+    from donkeycar import util
+    img = np.full((12, 16, 3), value, dtype=np.uint8)
+    return base64.b64encode(util.img.arr_to_binary(img)).decode()
+
+
+class TestSteeringServer(unittest.TestCase):
+    def setUp(self):
+        from donkeycar.parts.simulation import SteeringServer
+        self.sio = FakeSocketIO()
+        self.pilot = MeanPilot()
+        self.server = SteeringServer(self.sio, self.pilot, top_speed=4.0)
+        for sid in ('a', 'b'):
+            self.server.connect(sid, {})
+        self.sio.emitted = []
+
+    def test_batches_simulators(self):
+        self.server.telemetry('a', {'image': encode(0), 'speed': '1.0'})
+        self.server.telemetry('b', {'image': encode(255), 'speed': '1.0'})
+        # a newer frame replaces the queued one
+        self.server.telemetry('a', {'image': encode(51), 'speed': '1.0'})
+        assert len(self.sio.tasks) == 1
+        self.sio.run_tasks()
+
+        assert self.pilot.batches == [2]
+        steer = {room: data for event, data, room in self.sio.emitted}
+        assert abs(float(steer['a']['steering_angle']) - 0.2) < 0.02
+        assert abs(float(steer['b']['steering_angle']) - 1.0) < 0.02
+        assert float(steer['a']['throttle']) == 0.5
+        assert self.server.server_latency['a'].count == 1
+        assert not self.server.scheduled
+
+    def test_top_speed(self):
+        self.server.telemetry('a', {'image': encode(0), 'speed': '5.0'})
+        self.sio.run_tasks()
+        assert float(self.sio.emitted[0][1]['throttle']) == 0.0
+
+    def test_manual(self):
+        self.server.telemetry('a', {})
+        assert self.sio.emitted == [('manual', {}, 'a')]
+
+    def test_cycle_latency(self):
+        self.server.telemetry('a', {'image': encode(0), 'speed': '1.0'})
+        self.sio.run_tasks()
+        self.server.telemetry('a', {'image': encode(0), 'speed': '1.0'})
+        assert self.server.cycle_latency['a'].count == 1
+
+
+class TwoOutputPilot:
+    def run(self, img):
+        return 0.3, 0.4
+
+
+class BrokenPilot:
+    def run_batch(self, imgs):
+        raise ValueError('bad frame')
+
+
+class TestSteeringServerErrors(unittest.TestCase):
+    def test_two_output_pilot(self):
+        from donkeycar.parts.simulation import SteeringServer
+        sio = FakeSocketIO()
+        server = SteeringServer(sio, TwoOutputPilot())
+        server.telemetry('a', {'image': encode(0), 'speed': '1.0'})
+        sio.run_tasks()
+        assert sio.emitted == [('steer', {'steering_angle': '0.3', 'throttle': '0.4'}, 'a')]
+
+    def test_failed_batch_keeps_serving(self):
+        from donkeycar.parts.simulation import SteeringServer
+        sio = FakeSocketIO()
+        server = SteeringServer(sio, BrokenPilot())
+        server.telemetry('a', {'image': encode(0), 'speed': '1.0'})
+        sio.run_tasks()
+        assert not server.scheduled
+        server.kpart = MeanPilot()
+        server.telemetry('a', {'image': encode(0), 'speed': '1.0'})
+        sio.run_tasks()
+        assert sio.emitted[-1][0] == 'steer'
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import numpy as np
+
+from donkeycar.parts.datastore import TubGroup
+from donkeycar.management import sweep
+from .setup import tubs
+
+
+SETTINGS = {'IMAGE_TARGET_SIZE': (60, 80), 'IMAGE_ROI': None,
+            'BINS': {'angle': (15, -1000, 1000)}, 'BATCH_SIZE': 4,
+            'TRAIN_TEST_SPLIT': 0.8, 'SPLIT_BY': 'record'}
+
+
+def test_trial_key():
+    assert sweep.trial_key({'a': 1, 'b': [1, 2]}) == sweep.trial_key({'b': [1, 2], 'a': 1})
+    assert sweep.trial_key({'a': 1}) != sweep.trial_key({'a': 2})
+
+
+def test_build_dataset(tubs, tmpdir):
+    tg = TubGroup(','.join(tubs[1]))
+    prefix = sweep.build_dataset(tg, str(tmpdir), SETTINGS, y_keys=('angle', 'throttle'))
+    images, labels, is_train = sweep.load_dataset(prefix)
+    assert images.shape == (25, 60, 80, 3)
+    assert labels[0].dtype == np.int16
+    assert len(is_train) == 25
+
+    # reused when nothing changed
+    mtime = os.path.getmtime(prefix + '.images.npy')
+    assert sweep.build_dataset(tg, str(tmpdir), SETTINGS, y_keys=('angle', 'throttle')) == prefix
+    assert os.path.getmtime(prefix + '.images.npy') == mtime
+
+    one_hot = [tg.binners['angle'].one_hot, None]
+    X, Y = next(sweep.batch_gen(images, labels, np.flatnonzero(is_train), 4, one_hot, seed=0))
+    assert X[0].shape == (4, 60, 80, 3)
+    assert Y[0].shape == (4, 15)
+    assert Y[1].shape == (4,)
+
+
+def test_leaderboard(tmpdir):
+    results_dir = tmpdir.mkdir('results')
+    for i, loss in enumerate([0.3, 0.1, 0.2]):
+        params = {'batch_size': i}
+        result = {'key': sweep.trial_key(params), 'params': params, 'val_loss': loss}
+        with open(str(results_dir.join(result['key'] + '.json')), 'w') as f:
+            json.dump(result, f)
+
+    results = sweep.load_results(str(tmpdir))
+    ranked = sweep.leaderboard(results.values())
+    assert [r['val_loss'] for r in ranked] == [0.1, 0.2, 0.3]
+    assert len(sweep.format_leaderboard(ranked).splitlines()) == 4
+
+
+def test_results_of_other_contexts_are_ignored(tmpdir, tubs):
+    tubgroup = TubGroup(','.join(tubs[1]))
+    settings = dict(SETTINGS, EPOCHS=2)
+    context = sweep.sweep_context(tubgroup, settings)
+    assert context != sweep.sweep_context(tubgroup, dict(settings, EPOCHS=3))
+    assert context != sweep.sweep_context(tubgroup, dict(settings, IMAGE_ROI=((0, 10), (0, 0))))
+
+    params = {'lr': 0.01}
+    assert sweep.trial_key(params, context) != sweep.trial_key(params, 'other')
+
+    results_dir = tmpdir.mkdir('results')
+    for c in (context, 'other'):
+        result = {'key': sweep.trial_key(params, c), 'context': c, 'params': params, 'val_loss': 0.1}
+        with open(str(results_dir.join(result['key'] + '.json')), 'w') as f:
+            json.dump(result, f)
+    assert list(sweep.load_results(str(tmpdir), context)) == [sweep.trial_key(params, context)]
+    assert len(sweep.load_results(str(tmpdir))) == 2
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import json
+import pytest
+
+import donkeycar as dk
+from donkeycar.parts.transform import Lambda
+from donkeycar.tracer import Tracer, NullTracer, get_tracer, set_tracer, traced_generator
+
+
+@pytest.fixture
+def tracer(tmpdir):
+    t = set_tracer(Tracer(str(tmpdir.join('trace.json')), max_events=10))
+    yield t
+    set_tracer(None)
+
+
+def test_tracing_disabled_by_default():
+    assert isinstance(get_tracer(), NullTracer)
+    with get_tracer().span('noop'):
+        pass
+
+
+def test_span_records_complete_event(tracer):
+    with tracer.span('work', cat='test'):
+        pass
+    event = tracer.events[0]
+    assert event['name'] == 'work'
+    assert event['ph'] == 'X'
+    assert event['dur'] >= 0
+
+
+def test_buffer_is_bounded(tracer):
+    for i in range(25):
+        tracer.instant('tick {}'.format(i))
+    assert len(tracer.events) == 10
+    assert tracer.events[-1]['name'] == 'tick 24'
+
+
+def test_flush_writes_trace_events(tracer):
+    with tracer.span('work'):
+        pass
+    path = tracer.flush()
+    with open(path) as f:
+        trace = json.load(f)
+    names = [e['name'] for e in trace['traceEvents']]
+    assert 'work' in names
+    assert 'thread_name' in names
+
+
+def test_vehicle_traces_parts(tracer):
+    v = dk.Vehicle()
+    v.add(Lambda(lambda: 1), outputs=['test_out'])
+    v.update_parts()
+    assert [e['name'] for e in tracer.events] == ['Lambda']
+
+
+def test_traced_generator(tracer):
+    gen = traced_generator(iter([1, 2]), 'batch')
+    assert list(gen) == [1, 2]
+    assert len([e for e in tracer.events if e['name'] == 'batch']) == 3
+
+
+def test_flush_while_threads_trace(tmpdir):
+    import threading
+    tracer = Tracer(str(tmpdir.join('trace.json')), max_events=200)
+    on = True
+
+    def work():
+        while on:
+            with tracer.span('work'):
+                pass
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    try:
+        for _ in range(10):
+            tracer.flush()
+    finally:
+        on = False
+        for t in threads:
+            t.join(1)
+    with open(tracer.path) as f:
+        assert json.load(f)['traceEvents']
+
+
+def test_threaded_parts_are_traced(tracer):
+    import time
+    import threading
+    from donkeycar.parts.pilot import AsyncPilot
+
+    class Pilot:
+        def run(self, img):
+            return 0.0, img, 0.5
+
+    pilot = AsyncPilot(Pilot())
+    t = threading.Thread(target=pilot.update, name='pilot worker')
+    t.start()
+    pilot.run_threaded(0.1)
+    end = time.time() + 1.0
+    while pilot.result is None and time.time() < end:
+        time.sleep(0.005)
+    pilot.on = False
+    t.join(1)
+    names = dict(tracer.thread_names)
+    spans = [e for e in tracer.events if e['name'] == 'AsyncPilot.inference']
+    assert spans and names[spans[0]['tid']] == 'pilot worker'
@@ -16,3 +16,27 @@ def test_lambda_two_args():
     l = Lambda(f2)
     b = l.run(1, 1)
     assert b == 3
+
+
+def test_img_preprocess_matches_tub_loading(tmpdir):
+    import numpy as np
+    from PIL import Image
+    from donkeycar.parts.transform import ImgPreprocess
+    from donkeycar.util.img import load_scaled_image
+
+    y, x = np.mgrid[0:120, 0:160]
+    arr = np.dstack([x * 1.5, y * 2, x + y]).astype(np.uint8)
+    arr[60:, :80] = 255
+    path = str(tmpdir.join('img.jpg'))
+    Image.fromarray(arr).save(path)
+
+    frame = np.asarray(Image.open(path))
+    for size, roi in [((30, 40), ((60, 0), (0, 0))),
+                      ((25, 70), ((10, 20), (5, 5))),
+                      ((60, 80), None),
+                      ((120, 160), None)]:
+        pre = ImgPreprocess(size, roi).run(frame)
+        loaded = load_scaled_image(path, size, roi)
+        assert pre.shape == loaded.shape == size + (3,)
+        # the tub image is scaled in the jpeg decoder, the frame by Image.reduce
+        assert np.abs(pre.astype(int) - loaded.astype(int)).mean() < 1
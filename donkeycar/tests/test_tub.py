@@ -181,4 +181,98 @@ def test_recreating_tub(tub):
     t = Tub(path, inputs=inputs, types=types)
     assert t.get_num_records() == 10
     assert t.current_ix == 10
-    assert t.get_last_ix() == 9
\ No newline at end of file
+    assert t.get_last_ix() == 9
+
+def test_tub_image_options(tub):
+    """ Images can be read scaled and cropped """
+    tub.set_image_options(target_size=(30, 40), roi=((40, 0), (0, 0)))
+    img = tub.get_record(0)['cam/image_array']
+    assert img.shape == (30, 40, 3)
+
+
+def test_tub_binners(tub):
+    from donkeycar.parts.augment import BatchAugmentation
+    from donkeycar.util.binning import LinearBinner, bin_key
+
+    df = tub.get_df()
+    binner = LinearBinner(15, df['angle'].min(), df['angle'].max())
+    tub.set_binners({'angle': binner})
+    assert list(df[bin_key('angle')]) == list(binner.indices(df['angle'].values))
+
+    aug = BatchAugmentation(binners={'angle': binner})
+    gen = tub.get_train_gen(['cam/image_array'], ['angle'], batch_size=4, batch_transform=aug)
+    X, Y = next(gen)
+    assert Y[0].shape == (4, 15)
+    assert (Y[0].sum(axis=1) == 1).all()
+
+
+def test_tub_binners_tolerate_bad_labels(tub):
+    import numpy as np
+    from donkeycar.util.binning import LinearBinner, bin_key
+
+    df = tub.get_df()
+    df['angle'] = np.linspace(-0.5, 0.5, len(df))
+    df.loc[df.index[2], 'angle'] = 3.0
+    df.loc[df.index[5], 'angle'] = None
+    binner = LinearBinner(11, -1, 1)
+    tub.set_binners({'angle': binner})
+    bins = df[bin_key('angle')]
+    assert bins[df.index[2]] == 10
+    assert bins[df.index[5]] == bins[df.index[4]]
+    assert bins[df.index[0]] == binner.indices(-0.5)
+
+
+def test_tub_feature_array(tub):
+    import numpy as np
+    calls = []
+
+    def compute(imgs):
+        calls.append(len(imgs))
+        return imgs.reshape(len(imgs), -1)[:, :4].astype(np.float32)
+
+    features = tub.get_feature_array('test', compute, batch_size=4)
+    assert features.shape == (10, 4)
+    assert calls == [4, 4, 2]
+
+    # cached, then only the new record is computed
+    assert np.array_equal(tub.get_feature_array('test', compute), features)
+    assert calls == [4, 4, 2]
+    tub.put_record(create_sample_record())
+    tub.update_df()
+    features2 = tub.get_feature_array('test', compute)
+    assert calls == [4, 4, 2, 1]
+    assert np.array_equal(features2[:10], features)
+
+
+def test_tub_feature_array_resumes(tub):
+    import numpy as np
+    calls = []
+
+    def failing(imgs):
+        calls.append(len(imgs))
+        if len(calls) == 3:
+            raise KeyboardInterrupt
+        return np.full((len(imgs), 2), len(calls), dtype=np.float32)
+
+    with pytest.raises(KeyboardInterrupt):
+        tub.get_feature_array('resume', failing, batch_size=2, save_every=1)
+
+    calls[:] = []
+    features = tub.get_feature_array('resume', lambda imgs: np.zeros((len(imgs), 2), np.float32),
+                                     batch_size=2)
+    # the first two batches were saved before the interruption
+    assert features.shape == (10, 2)
+    assert (features[:2] == 1).all() and (features[2:4] == 2).all()
+    assert (features[4:] == 0).all()
+
+
+def test_tub_array_column(tub):
+    import numpy as np
+    tub.add_array_column('teacher/angle', np.eye(10)[:, :4])
+    gen = tub.get_train_gen(['cam/image_array'], ['angle'], batch_size=3,
+                            extra_keys=['teacher/angle'],
+                            batch_transform=lambda b: {**b, 'angle': b.pop('teacher/angle')})
+    X, Y = next(gen)
+    assert Y[0].shape == (3, 4)
+    with pytest.raises(ValueError):
+        tub.add_array_column('bad', np.zeros(3))
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from donkeycar.parts.datastore import Tub, TubGroup, sequence_view
+from .setup import tub, tub_path, tubs
+
+
+def test_sequence_view_strided():
+    arr = np.arange(10)
+    view = sequence_view(arr, [-2, -1, 0])
+    assert view(np.array([2, 5])).tolist() == [[0, 1, 2], [3, 4, 5]]
+
+
+def test_sequence_view_uneven_offsets():
+    arr = np.arange(10)
+    view = sequence_view(arr, [0, 1, 4])
+    assert view(np.array([1])).tolist() == [[1, 2, 5]]
+
+
+def test_sequence_gen_shapes(tub):
+    gen = tub.get_sequence_gen(['cam/image_array'], ['angle'], offsets=(0, 1, 2), batch_size=4)
+    X, Y = next(gen)
+    assert X[0].shape == (4, 3, 120, 160, 3)
+    assert Y[0].shape == (4, 3)
+
+
+def test_sequence_windows_are_consecutive(tub):
+    gen = tub.get_sequence_gen([], ['angle'], offsets=(0, 1), batch_size=8, shuffle=False)
+    X, Y = next(gen)
+    df = tub.get_df()
+    assert Y[0][0].tolist() == [df['angle'][0], df['angle'][1]]
+
+
+def test_sequence_skips_gaps(tub):
+    tub.remove_record(5)
+    t = Tub(tub.path)
+    anchors = t.get_sequence_anchors(t.get_sequence_array('angle')[1], (0, 1))
+    assert anchors.tolist() == [0, 1, 2, 3, 6, 7, 8]
+
+
+def test_sequence_stride(tub):
+    present = tub.get_sequence_array('angle')[1]
+    assert tub.get_sequence_anchors(present, (0, 1), stride=3).tolist() == [0, 3, 6]
+
+
+def test_tubgroup_sequence_respects_tub_boundaries(tubs):
+    tg = TubGroup(','.join(tubs[1]))
+    present = tg.get_sequence_array('angle')[1]
+    # 5 tubs of 5 records, windows of 3 fit 3 times per tub
+    assert len(tg.get_sequence_anchors(present, (0, 1, 2))) == 15
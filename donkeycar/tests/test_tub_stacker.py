@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from donkeycar.parts.datastore import TubImageStacker, TubTimeStacker
+from donkeycar.util.img import rgb_to_luma
+from .setup import tub, tub_path
+
+
+@pytest.fixture
+def stacker(tub):
+    return TubImageStacker(tub.path)
+
+
+def test_rgb_to_luma_matches_float_conversion():
+    rgb = np.random.randint(0, 256, (10, 12, 3)).astype(np.uint8)
+    expected = np.dot(rgb, [0.299, 0.587, 0.114])
+    assert np.abs(rgb_to_luma(rgb).astype(float) - expected).max() < 1
+
+
+def test_stacked_record(stacker):
+    record = stacker.get_record(5)
+    img = record['cam/image_array']
+    assert img.shape == (120, 160, 3)
+    assert img.dtype == np.uint8
+
+
+def test_stack_batch_channels_are_previous_frames(stacker):
+    batch = stacker.stack_batch([3, 4, 5], 'cam/image_array')
+    assert batch.shape == (3, 120, 160, 3)
+    # the newest frame of ix 4 is the middle frame of ix 5
+    assert np.array_equal(batch[1][..., 2], batch[2][..., 1])
+    single = stacker.get_record(5)['cam/image_array']
+    assert np.array_equal(single, batch[2])
+
+
+def test_stack_batch_at_tub_start(stacker):
+    batch = stacker.stack_batch([0], 'cam/image_array')
+    assert np.array_equal(batch[0][..., 0], batch[0][..., 2])
+
+
+def test_stacked_train_gen(stacker):
+    gen = stacker.get_stacked_train_gen('cam/image_array', ['angle', 'throttle'], batch_size=4)
+    X, Y = next(gen)
+    assert X[0].shape == (4, 120, 160, 3)
+    assert len(Y) == 2
+    assert len(Y[0]) == 4
+
+
+def test_time_stacked_record(tub):
+    record = TubTimeStacker([0, 2], tub.path).get_record(5)
+    assert record['angle_2'] == tub.get_json_record(7)['angle']
+    assert 'throttle_0' in record
+
+
+def test_time_stacked_record_missing_offset(tub):
+    with pytest.raises(FileNotFoundError):
+        TubTimeStacker([0, 2], tub.path).get_record(8)
+
+
+def test_stack_batch_missing_records(stacker):
+    import os
+    os.remove(stacker.get_json_record_path(5))
+    stacker.update_df()
+    # a missing record is replaced by the earlier one, not the next one
+    assert np.array_equal(stacker.stack_batch([5], 'cam/image_array'),
+                          stacker.stack_batch([4], 'cam/image_array'))
+    last = stacker.get_df().index.max()
+    assert np.array_equal(stacker.stack_batch([last + 5], 'cam/image_array'),
+                          stacker.stack_batch([last], 'cam/image_array'))
+
+
+def test_stack_batch_after_tub_grows(tub, stacker):
+    from .setup import create_sample_record
+    first = stacker.stack_batch([9], 'cam/image_array')
+    tub.put_record(create_sample_record())
+    stacker.update_df()
+    batch = stacker.stack_batch([9, 10], 'cam/image_array')
+    assert np.array_equal(batch[0], first[0])
+    assert np.array_equal(batch[1][..., 1], first[0][..., 2])
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
+import os
+import numpy as np
 from donkeycar.parts.datastore import TubGroup
-from .setup import tubs
+from .setup import tubs, create_sample_tub
 
 
 def test_tubgroup_load(tubs):
@@ -41,3 +43,57 @@ def test_tubgroup_get_num_records(tubs):
     str_of_tubs = ','.join(list_of_tubs)
     t = TubGroup(str_of_tubs)
     assert t.get_num_records() == 25
+
+
+def test_tubgroup_split(tubs):
+    """ Split is stable, saved in the tubs and keeps records of all tubs """
+    list_of_tubs = tubs[1]
+    t = TubGroup(','.join(list_of_tubs))
+    is_train = t.get_split(0.6)
+    assert len(is_train) == 25
+    assert all(os.path.exists(os.path.join(p, 'split.npz')) for p in list_of_tubs)
+
+    # adding a tub doesn't move the records of the others
+    create_sample_tub(list_of_tubs[0] + '_new', records=5)
+    t2 = TubGroup(','.join(list_of_tubs + [list_of_tubs[0] + '_new']))
+    assert list(t2.get_split(0.6)[:25]) == list(is_train)
+
+    train_gen, val_gen = t.get_train_val_gen(['angle'], ['throttle'], batch_size=2, train_frac=0.6)
+    X, Y = next(train_gen)
+    assert len(Y[0]) == 2
+
+
+def test_tub_split_by_session(tubs):
+    """ Whole tubs go to train or val """
+    for tub in tubs[2]:
+        is_train = tub.get_split(0.5, by='session')
+        assert is_train.all() or not is_train.any()
+
+
+def test_split_hash():
+    from donkeycar.parts.datastore import split_hash
+    r = split_hash('tub_1', np.arange(10000))
+    assert np.array_equal(r, split_hash('tub_1', np.arange(10000)))
+    assert 0.45 < (r < 0.5).mean() < 0.55
+    assert not np.array_equal(r, split_hash('tub_2', np.arange(10000)))
+
+
+def test_tubgroup_incremental(tubs):
+    """ Only records after the watermark are selected, plus replayed ones """
+    list_of_tubs = tubs[1]
+    t = TubGroup(','.join(list_of_tubs[:3]))
+    watermark = t.get_watermark()
+    assert watermark == {os.path.basename(p): 4 for p in list_of_tubs[:3]}
+
+    t = TubGroup(','.join(list_of_tubs))
+    new = t.get_new_records(watermark)
+    assert new.sum() == 10
+    assert not new[:15].any()
+
+    records = t.get_incremental(watermark, replay=0.5, seed=0)
+    assert records.sum() == 15
+    assert records[15:].all()
+
+    train_gen, val_gen = t.get_train_val_gen(['angle'], ['throttle'], batch_size=2, records=records)
+    X, Y = next(val_gen)
+    assert len(X[0]) == 2
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+from donkeycar.util.binning import LinearBinner, make_binners
+from donkeycar.util.data import linear_bin, linear_unbin
+
+
+def test_default_matches_linear_bin():
+    binner = LinearBinner()
+    values = np.linspace(-1, 1, 41)
+    expected = np.array([linear_bin(v) for v in values])
+    assert np.array_equal(binner.encode(values), expected)
+    decoded = binner.decode(expected)
+    assert np.allclose(decoded, [linear_unbin(e) for e in expected])
+
+
+def test_custom_range():
+    binner = LinearBinner(5, 0, 1)
+    assert list(binner.indices([0, 0.24, 0.26, 1])) == [0, 1, 1, 4]
+    assert binner.encode([0.5]).shape == (1, 5)
+    assert binner.decode([0, 0, 0, 1, 0]) == 0.75
+
+
+def test_out_of_range():
+    binner = LinearBinner(5, 0, 1)
+    with pytest.raises(IndexError):
+        binner.indices([-0.5])
+    with pytest.raises(ValueError):
+        binner.decode(np.zeros(15))
+    with pytest.raises(ValueError):
+        LinearBinner(1)
+
+
+def test_make_binners():
+    binners = make_binners({'user/angle': (21, -1, 1)})
+    assert binners['user/angle'] == LinearBinner(21, -1, 1)
@@ -27,3 +27,104 @@ def test_add_part():
 def test_vehicle_run(vehicle):
     vehicle.start(rate_hz=20, max_loop_count=2)
     assert vehicle is not None
+
+
+def test_vehicle_run_with_gc_freeze(vehicle):
+    import gc
+    vehicle.start(rate_hz=20, max_loop_count=2, gc_freeze=True)
+    assert gc.isenabled()
+
+
+def test_steady_state_loop_does_not_grow_memory():
+    """ After warm up the drive loop should not retain new allocations """
+    import tracemalloc
+    from donkeycar.parts.simulation import MovingSquareTelemetry, SquareBoxCamera
+
+    v = dk.Vehicle()
+    v.add(MovingSquareTelemetry(), outputs=['x', 'y'])
+    v.add(SquareBoxCamera(), inputs=['x', 'y'], outputs=['cam/image_array'])
+    v.add(Lambda(lambda img, x: x > 50), inputs=['cam/image_array', 'x'],
+          outputs=['flag'])
+
+    for _ in range(100):
+        v.update_parts()
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for _ in range(1000):
+            v.update_parts()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    growth = sum(s.size_diff for s in after.compare_to(before, 'filename'))
+    # allow for a few interpreter caches, but nothing per tick
+    assert growth < 1000 * 8
+
+
+def test_vehicle_reports_loop_jitter(vehicle):
+    vehicle.start(rate_hz=50, max_loop_count=5)
+    stats = vehicle.loop_stats(50)
+    assert stats['loops'] == 5
+    assert stats['jitter_max_ms'] >= 0
+
+
+def test_threaded_part_with_scheduling():
+    import os
+    from donkeycar.parts.simulation import MovingSquareTelemetry
+
+    has_affinity = hasattr(os, 'sched_getaffinity')
+    allowed = os.sched_getaffinity(0) if has_affinity else {0}
+    cpus = sorted(allowed)[:1]
+    v = dk.Vehicle()
+    tel = MovingSquareTelemetry()
+    # realtime usually isn't permitted, the part must run anyway
+    v.add(tel, outputs=['x', 'y'], threaded=True, cpus=cpus, nice=1, realtime=10)
+    try:
+        v.start(rate_hz=20, max_loop_count=2, cpus=cpus)
+    finally:
+        if has_affinity:
+            os.sched_setaffinity(0, allowed)
+    assert v.mem['x'] is not None
+
+
+def test_start_restores_drive_loop_scheduling():
+    from donkeycar.util.proc import get_scheduling
+
+    before = get_scheduling()
+    cpus = sorted(before['cpus'])[:1] if before['cpus'] else None
+    v = dk.Vehicle()
+    v.add(Lambda(lambda: 1), outputs=['test_out'])
+    v.start(rate_hz=100, max_loop_count=1, cpus=cpus, realtime=10)
+    after = get_scheduling()
+    assert after['cpus'] == before['cpus']
+    assert after['policy'] == before['policy']
+
+
+def test_part_gets_history_input():
+    import numpy as np
+    v = dk.Vehicle()
+    counter = iter(range(100))
+    v.add(Lambda(lambda: np.array([next(counter)])), outputs=['n'])
+    v.add(Lambda(lambda hist: hist.copy()), inputs=['n[-3:]'], outputs=['stack'])
+    for _ in range(4):
+        v.update_parts()
+    assert list(v.mem['stack'][:, 0]) == [1, 2, 3]
+
+
+def test_gc_freeze_skips_collection_over_budget(monkeypatch):
+    import gc
+    import time
+    v = dk.Vehicle()
+    v.add(Lambda(lambda: time.sleep(0.06)), outputs=['test_out'])
+    collected = []
+    real_collect = gc.collect
+
+    def collect(*args):
+        collected.append(args)
+        return real_collect(*args)
+
+    monkeypatch.setattr(gc, 'collect', collect)
+    v.start(rate_hz=20, max_loop_count=2, gc_freeze=True)
+    assert (0,) not in collected
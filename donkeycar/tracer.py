@@ -0,0 +1,199 @@
+"""
+tracer.py
+
+Optional timeline tracer that records spans in the Chrome trace event
+format. Open the flushed json in chrome://tracing or ui.perfetto.dev to see
+which part ran when and where the drive loop or training stalled.
+
+Tracing is off by default. Enable it with:
+
+>>> from donkeycar.tracer import Tracer, set_tracer
+>>> set_tracer(Tracer('~/mycar/logs/drive_trace.json'))
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+
+from .log import get_logger
+
+logger = get_logger(__name__)
+
+
+class Span:
+    """
+    Context manager that adds a complete event to a tracer when it exits.
+    """
+    __slots__ = ('tracer', 'name', 'cat', 'start')
+
+    def __init__(self, tracer, name, cat):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.complete(self.name, self.start, time.perf_counter(), cat=self.cat)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullTracer:
+    """
+    Tracer that does nothing. Used when tracing is disabled.
+    """
+    enabled = False
+    _span = _NullSpan()
+
+    def span(self, name, cat='part'):
+        return self._span
+
+    def complete(self, name, start, end, cat='part'):
+        pass
+
+    def instant(self, name, cat='part'):
+        pass
+
+    def flush(self, path=None):
+        pass
+
+
+class Tracer:
+    """
+    Collects trace events in a bounded in memory buffer. The oldest events
+    are dropped once `max_events` is reached.
+    """
+    enabled = True
+
+    def __init__(self, path=None, max_events=100000):
+        """
+        Parameters
+        ----------
+        path : str
+            Default file the events are written to by flush().
+        max_events : int
+            Size of the event buffer.
+        """
+        self.path = os.path.expanduser(path) if path else None
+        self.events = deque(maxlen=max_events)
+        self.thread_names = {}
+        # parts add events from their own threads while flush reads them
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.t0 = time.perf_counter()
+
+    def _tid(self):
+        tid = threading.get_ident()
+        if tid not in self.thread_names:
+            with self.lock:
+                self.thread_names[tid] = threading.current_thread().name
+        return tid
+
+    def _add(self, event):
+        with self.lock:
+            self.events.append(event)
+
+    def span(self, name, cat='part'):
+        """
+        Return a context manager that records the time spent in its block.
+        """
+        return Span(self, name, cat)
+
+    def complete(self, name, start, end, cat='part'):
+        """
+        Record a span from two time.perf_counter() values.
+        """
+        self._add({'name': name,
+                   'cat': cat,
+                   'ph': 'X',
+                   'ts': (start - self.t0) * 1e6,
+                   'dur': (end - start) * 1e6,
+                   'pid': self.pid,
+                   'tid': self._tid()})
+
+    def instant(self, name, cat='part'):
+        """
+        Record a point in time.
+        """
+        self._add({'name': name,
+                   'cat': cat,
+                   'ph': 'i',
+                   's': 't',
+                   'ts': (time.perf_counter() - self.t0) * 1e6,
+                   'pid': self.pid,
+                   'tid': self._tid()})
+
+    def to_dict(self):
+        with self.lock:
+            thread_names = list(self.thread_names.items())
+            events = list(self.events)
+        meta = [{'name': 'thread_name',
+                 'ph': 'M',
+                 'pid': self.pid,
+                 'tid': tid,
+                 'args': {'name': name}}
+                for tid, name in thread_names]
+        return {'traceEvents': meta + events,
+                'displayTimeUnit': 'ms'}
+
+    def flush(self, path=None):
+        """
+        Write the buffered events to a json file and return its path.
+        """
+        path = os.path.expanduser(path) if path else self.path
+        if path is None:
+            return None
+
+        trace = self.to_dict()
+        with open(path, 'w') as f:
+            json.dump(trace, f)
+        logger.info('Wrote {} trace events to {}'.format(len(trace['traceEvents']), path))
+        return path
+
+
+_tracer = NullTracer()
+
+
+def get_tracer():
+    """
+    Return the tracer in use. A NullTracer if tracing is disabled.
+    """
+    return _tracer
+
+
+def set_tracer(tracer):
+    """
+    Set the tracer used by the vehicle, the parts and training.
+    Pass None to disable tracing.
+    """
+    global _tracer
+    _tracer = tracer if tracer is not None else NullTracer()
+    return _tracer
+
+
+def traced_generator(gen, name, cat='train'):
+    """
+    Wrap a generator so the time spent waiting on each item is traced.
+    """
+    while True:
+        with get_tracer().span(name, cat=cat):
+            try:
+                item = next(gen)
+            except StopIteration:
+                return
+        yield item
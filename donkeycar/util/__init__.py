@@ -1,4 +1,5 @@
 from . import (proc,
+               binning,
                data,
                files,
                img,
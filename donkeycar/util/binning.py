@@ -0,0 +1,112 @@
+"""
+Conversion of continuous labels to categorical arrays and back, on whole
+arrays at once.
+"""
+import numpy as np
+
+
+class LinearBinner:
+    """
+    Splits the range [low, high] into n_bins evenly spaced bin centers.
+    The first center is low and the last one is high.
+
+    >>> binner = LinearBinner(15, -1, 1)
+    >>> binner.indices([-1, 0, 1])
+    array([ 0,  7, 14])
+    """
+
+    def __init__(self, n_bins=15, low=-1.0, high=1.0):
+        """
+        Parameters
+        ----------
+        n_bins : int
+            Number of categories.
+        low : float
+            Value of the first bin.
+        high : float
+            Value of the last bin.
+        """
+        if n_bins < 2:
+            raise ValueError('n_bins must be at least 2')
+        if high <= low:
+            raise ValueError('high must be greater than low')
+        self.n_bins = int(n_bins)
+        self.low = float(low)
+        self.high = float(high)
+        self.step = (self.high - self.low) / (self.n_bins - 1)
+        self.eye = np.eye(self.n_bins)
+
+    def __repr__(self):
+        return 'LinearBinner(n_bins={}, low={}, high={})'.format(self.n_bins, self.low, self.high)
+
+    def __eq__(self, other):
+        return (isinstance(other, LinearBinner) and
+                (self.n_bins, self.low, self.high) == (other.n_bins, other.low, other.high))
+
+    def __hash__(self):
+        return hash((self.n_bins, self.low, self.high))
+
+    def indices(self, values):
+        """
+        Return the index of the nearest bin of every value.
+        Raises IndexError for values outside of [low, high].
+        """
+        values = np.asarray(values)
+        if values.dtype.kind not in 'biuf':
+            raise TypeError('values must be numbers, not {}'.format(values.dtype))
+        b = np.round((values.astype(np.float64) - self.low) / self.step).astype(np.int64)
+        if b.size and (b.min() < 0 or b.max() >= self.n_bins):
+            raise IndexError('values must be between {} and {}'.format(self.low, self.high))
+        return b
+
+    def one_hot(self, indices):
+        """
+        Return the categorical arrays of bin indices. The last axis has n_bins items.
+        """
+        return self.eye[indices]
+
+    def encode(self, values):
+        """
+        Convert values to categorical arrays.
+        """
+        return self.one_hot(self.indices(values))
+
+    def decode(self, arr):
+        """
+        Convert categorical arrays, ie a softmax output, to the value of their
+        most likely bin. The last axis must have n_bins items.
+        """
+        arr = np.asarray(arr)
+        if arr.shape[-1] != self.n_bins:
+            raise ValueError('Illegal array length, must be {}'.format(self.n_bins))
+        return np.argmax(arr, axis=-1) * self.step + self.low
+
+
+DEFAULT_BINNER = LinearBinner()
+
+
+def make_binners(bins):
+    """
+    Create a binner per label from a dict of key to (n_bins, low, high),
+    the format of BINS in config.py.
+    """
+    return {key: LinearBinner(*args) for key, args in bins.items()}
+
+
+def soften(probs, temperature=1.0):
+    """
+    Flatten (temperature > 1) or sharpen (temperature < 1) distributions
+    over bins along the last axis, ie softmax outputs of a teacher model.
+    """
+    probs = np.asarray(probs, dtype=np.float64)
+    if temperature == 1.0:
+        return probs
+    p = np.power(np.maximum(probs, 1e-12), 1.0 / temperature)
+    return p / p.sum(axis=-1, keepdims=True)
+
+
+def bin_key(key):
+    """
+    Name of the tub column caching the bin indices of a label.
+    """
+    return key + '/bin'
@@ -1,9 +1,10 @@
 """
 Assorted functions for manipulating data.
 """
-import numpy as np
 import itertools
 
+from .binning import DEFAULT_BINNER
+
 
 def linear_bin(a):
     """
@@ -19,11 +20,7 @@ def linear_bin(a):
     list of int
         A list of length 15 with one item set to 1, which represents the linear value, and all other items set to 0.
     """
-    a = a + 1
-    b = round(a / (2 / 14))
-    arr = np.zeros(15)
-    arr[int(b)] = 1
-    return arr
+    return DEFAULT_BINNER.encode(a)
 
 
 def linear_unbin(arr):
@@ -34,11 +31,7 @@ def linear_unbin(arr):
     --------
     linear_bin
     """
-    if not len(arr) == 15:
-        raise ValueError('Illegal array length, must be 15')
-    b = np.argmax(arr)
-    a = b * (2 / 14) - 1
-    return a
+    return float(DEFAULT_BINNER.decode(arr))
 
 
 def bin_Y(Y):
@@ -56,10 +49,9 @@ def bin_Y(Y):
 
     See Also
     --------
-    linear_bin
+    linear_bin, donkeycar.util.binning.LinearBinner
     """
-    d = [ linear_bin(y) for y in Y ]
-    return np.array(d)
+    return DEFAULT_BINNER.encode(Y)
 
 
 def unbin_Y(Y):
@@ -68,10 +60,9 @@ def unbin_Y(Y):
 
     See Also
     --------
-    linear_bin
+    linear_bin, donkeycar.util.binning.LinearBinner
     """
-    d = [ linear_unbin(y) for y in Y ]
-    return np.array(d)
+    return DEFAULT_BINNER.decode(Y)
 
 
 def map_range(x, X_min, X_max, Y_min, Y_max):
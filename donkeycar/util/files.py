@@ -3,6 +3,7 @@ Utilities to manipulate files and directories.
 """
 
 import glob
+import json
 import zipfile
 import os
 
@@ -47,6 +48,31 @@ def time_since_last_file_edited(path):
 
 
 
+def model_meta_path(model_path):
+    """
+    Path of the json file kept next to a model with its training metadata.
+    """
+    return os.path.expanduser(model_path) + '.meta.json'
+
+
+def load_model_meta(model_path):
+    """
+    Return the metadata saved with a model, or an empty dict.
+    """
+    path = model_meta_path(model_path)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_model_meta(model_path, meta):
+    path = model_meta_path(model_path)
+    with open(path, 'w') as f:
+        json.dump(meta, f, indent=2)
+    return path
+
+
 def expand_path_mask(path):
     matches = []
     path = os.path.expanduser(path)
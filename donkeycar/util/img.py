@@ -67,6 +67,143 @@ def binary_to_img(binary):
     return Image.open(img)
 
 
+def crop_box(size, roi, scale=(1.0, 1.0)):
+    """
+    accepts: (width, height) of an image, roi ((top, bottom), (left, right))
+             pixels to trim off the full resolution image, and the (x, y)
+             scale of the image compared to the full resolution
+    returns: PIL crop box (left, upper, right, lower)
+    """
+    (top, bottom), (left, right) = roi
+    width, height = size
+    return (int(round(left * scale[0])),
+            int(round(top * scale[1])),
+            width - int(round(right * scale[0])),
+            height - int(round(bottom * scale[1])))
+
+
+def draft_size(size, target_size, roi=None):
+    """
+    accepts: (width, height) of the full image, target_size (height, width)
+             and roi ((top, bottom), (left, right)) as in load_scaled_image
+    returns: smallest (width, height) of the full image that still gives
+             target_size after the crop
+    """
+    full_w, full_h = size
+    (top, bottom), (left, right) = roi or ((0, 0), (0, 0))
+    crop_w = full_w - left - right
+    crop_h = full_h - top - bottom
+    return (int(np.ceil(full_w * target_size[1] / crop_w)),
+            int(np.ceil(full_h * target_size[0] / crop_h)))
+
+
+def draft_scale(size, requested):
+    """
+    accepts: (width, height) of the full image and the requested size
+    returns: the 1, 2, 4 or 8 scale a jpeg draft of that size decodes at,
+             the largest one keeping the image at least as large
+    """
+    scale = min(size[0] // requested[0], size[1] // requested[1])
+    for s in (8, 4, 2):
+        if scale >= s:
+            return s
+    return 1
+
+
+def crop_resize(img, full_size, target_size=None, roi=None):
+    """
+    Crop the roi, given in full resolution pixels, out of an image that
+    may have been scaled down from full_size, and resize it bilinearly to
+    target_size.
+    """
+    if roi is not None:
+        scale = (img.size[0] / full_size[0], img.size[1] / full_size[1])
+        img = img.crop(crop_box(img.size, roi, scale))
+
+    if target_size is not None and img.size != (target_size[1], target_size[0]):
+        img = img.resize((target_size[1], target_size[0]), Image.BILINEAR)
+
+    return img
+
+
+def load_scaled_image(path, target_size=None, roi=None):
+    """
+    Decode a jpeg at reduced resolution.
+
+    accepts: path of the image, target_size (height, width) of the returned
+             array and roi ((top, bottom), (left, right)) pixels to trim
+             off the full resolution image, like Cropping2D.
+    returns: numpy array of the cropped image at target_size
+
+    The jpeg decoder is asked to scale by 1/2, 1/4 or 1/8 in the DCT
+    domain (PIL draft mode) so the decode cost drops with the square of the
+    scale. The image is cropped before it's converted to an array.
+    """
+    img = Image.open(path)
+    if target_size is None and roi is None:
+        return np.asarray(img)
+
+    full_size = img.size
+    if target_size is not None:
+        img.draft(img.mode, draft_size(full_size, target_size, roi))
+
+    return np.asarray(crop_resize(img, full_size, target_size, roi))
+
+
+def preprocess_arr(arr, target_size=None, roi=None):
+    """
+    Crop and resize a camera frame the same way load_scaled_image does, so
+    the pilot sees the same images while driving as in training. The frame
+    is first shrunk by the scale the jpeg draft would decode the tub image
+    at, averaging the pixels (Image.reduce).
+    """
+    if target_size is None or (roi is None and arr.shape[:2] == tuple(target_size)):
+        if roi is not None:
+            (top, bottom), (left, right) = roi
+            h, w = arr.shape[:2]
+            arr = arr[top:h - bottom, left:w - right]
+        return arr
+
+    img = Image.fromarray(np.uint8(arr))
+    full_size = img.size
+    scale = draft_scale(full_size, draft_size(full_size, target_size, roi))
+    if scale > 1:
+        img = img.reduce(scale)
+
+    return np.asarray(crop_resize(img, full_size, target_size, roi))
+
+
+def image_shape(resolution, target_size=None, roi=None, channels=3):
+    """
+    accepts: camera (height, width), target_size and roi as in load_scaled_image
+    returns: shape of the images the pilot sees
+    """
+    if target_size is not None:
+        return tuple(target_size) + (channels,)
+    if roi is not None:
+        (top, bottom), (left, right) = roi
+        return (resolution[0] - top - bottom, resolution[1] - left - right, channels)
+    return tuple(resolution) + (channels,)
+
+
+def rgb_to_luma(rgb):
+    """
+    accepts: numpy array with shape (Height, Width, 3) and values 0-255
+    returns: uint8 array (Height, Width) with the BT.601 luma, computed with
+             integer arithmetic
+    """
+    rgb = np.asarray(rgb)
+    if rgb.dtype != np.uint8:
+        rgb = np.clip(rgb, 0, 255).astype(np.uint8)
+    # weights are 0.299, 0.587 and 0.114 scaled by 256
+    rgb = rgb.astype(np.uint16)
+    luma = rgb[..., 0] * 77
+    luma += rgb[..., 1] * 150
+    luma += rgb[..., 2] * 29
+    luma += 128
+    return (luma >> 8).astype(np.uint8)
+
+
 def norm_img(img):
     return (img - img.mean() / np.std(img))/255.0
 
@@ -40,3 +40,99 @@ def kill(proc_id):
 
 def eprint(*args, **kwargs):
     print(*args, file=sys.stderr, **kwargs)
+
+
+def set_cpu_affinity(cpus):
+    """
+    Pin the calling thread to the given cpu cores.
+    Returns False if the platform or permissions don't allow it.
+    """
+    try:
+        os.sched_setaffinity(0, set(cpus))
+        return True
+    except (AttributeError, OSError, ValueError):
+        return False
+
+
+def set_thread_priority(nice=None, realtime=None):
+    """
+    Change the scheduling of the calling thread.
+
+    nice : int
+        Niceness from -20 (highest priority) to 19.
+    realtime : int
+        Request SCHED_FIFO with this priority (1-99). Usually needs root
+        or CAP_SYS_NICE.
+
+    Returns False if any request was not permitted.
+    """
+    ok = True
+    if realtime is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(realtime))
+        except (AttributeError, OSError, ValueError):
+            ok = False
+    if nice is not None:
+        try:
+            # on linux this only changes the calling thread
+            os.setpriority(os.PRIO_PROCESS, 0, nice)
+        except (AttributeError, OSError, ValueError):
+            ok = False
+    return ok
+
+
+def get_scheduling():
+    """
+    Return the cpu affinity, scheduling policy and niceness of the calling
+    thread, to be given back to restore_scheduling. Values the platform
+    doesn't report are None.
+    """
+    state = {'cpus': None, 'policy': None, 'nice': None}
+    try:
+        state['cpus'] = os.sched_getaffinity(0)
+    except (AttributeError, OSError):
+        pass
+    try:
+        state['policy'] = (os.sched_getscheduler(0), os.sched_getparam(0))
+    except (AttributeError, OSError):
+        pass
+    try:
+        state['nice'] = os.getpriority(os.PRIO_PROCESS, 0)
+    except (AttributeError, OSError):
+        pass
+    return state
+
+
+def restore_scheduling(state):
+    """
+    Give the calling thread back the scheduling of get_scheduling.
+    Returns False if any of it could not be restored, ie lowering the
+    niceness without CAP_SYS_NICE.
+    """
+    ok = True
+    if state['cpus'] is not None:
+        ok = set_cpu_affinity(state['cpus']) and ok
+    if state['policy'] is not None:
+        try:
+            os.sched_setscheduler(0, *state['policy'])
+        except (AttributeError, OSError, ValueError):
+            ok = False
+    if state['nice'] is not None:
+        try:
+            os.setpriority(os.PRIO_PROCESS, 0, state['nice'])
+        except (AttributeError, OSError, ValueError):
+            ok = False
+    return ok
+
+
+def peak_rss_mb():
+    """
+    Peak resident memory of the process in MB, or None if unknown.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # linux reports kilobytes, macOS bytes
+    return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0
@@ -0,0 +1,159 @@
+"""
+Utilities to measure where time is spent.
+"""
+import json
+import time
+
+from .proc import peak_rss_mb
+
+
+class Timer:
+    """
+    Context manager that adds the time spent in its block to a Timings stage.
+    """
+    __slots__ = ('timings', 'name', 'start')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Timings:
+    """
+    Accumulates the time spent in named stages.
+
+    >>> timings = Timings()
+    >>> with timings.time('decode'):
+    ...     pass
+    >>> timings.report()['decode']['count']
+    1
+    """
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+
+    def add(self, name, seconds, count=1):
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + count
+
+    def time(self, name):
+        return Timer(self, name)
+
+    def total(self, name):
+        return self.totals.get(name, 0.0)
+
+    def reset(self):
+        self.totals = {}
+        self.counts = {}
+
+    def report(self):
+        """
+        Return a dict of stage name to total seconds, count and mean ms.
+        """
+        return {name: {'total_s': total,
+                       'count': self.counts[name],
+                       'mean_ms': total / self.counts[name] * 1000 if self.counts[name] else 0.0}
+                for name, total in self.totals.items()}
+
+    def __str__(self):
+        return ', '.join('{}: {:.1f}ms x{}'.format(name, r['mean_ms'], r['count'])
+                         for name, r in self.report().items())
+
+
+def timed_generator(gen, timings, name):
+    """
+    Wrap a generator so the time spent producing each item is added to
+    the `name` stage of timings.
+    """
+    while True:
+        with timings.time(name):
+            try:
+                item = next(gen)
+            except StopIteration:
+                return
+        yield item
+
+
+class ThroughputMonitor:
+    """
+    Splits the training time of each epoch into time blocked waiting for
+    the next batch and time in the train step, and writes one json entry
+    per epoch with the samples/s, the pipeline stage timings and the peak
+    memory.
+
+    Call step_begin/step_end around every train step and epoch_begin/
+    epoch_end around every epoch, ie from a keras callback.
+    """
+
+    def __init__(self, path=None, pipeline_timings=None):
+        """
+        Parameters
+        ----------
+        path : str
+            Json file the epochs are written to after each epoch.
+        pipeline_timings : dict
+            Name to Timings of the input pipelines, ie the train and val
+            Timings passed to Tub.get_train_val_gen. Reset every epoch.
+        """
+        self.path = path
+        self.pipeline_timings = pipeline_timings or {}
+        self.epochs = []
+        self.epoch_begin(0)
+
+    def epoch_begin(self, epoch):
+        self.epoch_start = self.last_step_end = time.perf_counter()
+        self.input_wait = 0.0
+        self.compute = 0.0
+        self.steps = 0
+        self.samples = 0
+        for timings in self.pipeline_timings.values():
+            timings.reset()
+
+    def step_begin(self):
+        self.step_start = time.perf_counter()
+        # the time since the last step is spent waiting for this batch
+        self.input_wait += self.step_start - self.last_step_end
+
+    def step_end(self, size=0):
+        self.last_step_end = time.perf_counter()
+        self.compute += self.last_step_end - self.step_start
+        self.steps += 1
+        self.samples += size
+
+    def epoch_end(self, epoch, metrics=None):
+        """
+        Add the entry of the epoch, write the log and return the entry.
+        """
+        train_s = self.input_wait + self.compute
+        entry = {'epoch': epoch,
+                 'steps': self.steps,
+                 'samples': self.samples,
+                 'epoch_s': time.perf_counter() - self.epoch_start,
+                 'train_s': train_s,
+                 'input_wait_s': self.input_wait,
+                 'compute_s': self.compute,
+                 'input_wait_frac': self.input_wait / train_s if train_s else 0.0,
+                 'samples_per_s': self.samples / train_s if train_s else 0.0,
+                 'pipeline': {name: t.report() for name, t in self.pipeline_timings.items()},
+                 'peak_rss_mb': peak_rss_mb(),
+                 'metrics': {k: float(v) for k, v in (metrics or {}).items()}}
+        self.epochs.append(entry)
+        if self.path:
+            with open(self.path, 'w') as f:
+                json.dump({'epochs': self.epochs}, f, indent=2)
+        return entry
+
+    @staticmethod
+    def summary(entry):
+        return 'epoch {}: {:.0f} samples/s, {:.0%} of {:.1f}s waiting for input, peak rss {} MB'.format(
+            entry['epoch'], entry['samples_per_s'], entry['input_wait_frac'], entry['train_s'],
+            '?' if entry['peak_rss_mb'] is None else '{:.0f}'.format(entry['peak_rss_mb']))
@@ -6,25 +6,41 @@ Created on Sun Jun 25 10:44:24 2017
 @author: wroscoe
 """
 
+import gc
 import time
+from collections import deque
 from threading import Thread
 from .memory import Memory
 from .log import get_logger
+from .tracer import get_tracer
+from .util.proc import set_cpu_affinity, set_thread_priority, get_scheduling, restore_scheduling
 
 logger = get_logger(__name__)
 
 
 class Vehicle:
-    def __init__(self, mem=None):
+    def __init__(self, mem=None, recorder=None):
+        """
+        Parameters
+        ----------
+            mem : Memory
+                Memory shared by the parts. A new one is created if None.
+            recorder : FlightRecorder
+                Optional recorder that captures every channel after each loop.
+        """
         if not mem:
             mem = Memory()
         self.mem = mem
+        self.recorder = recorder
         self.parts = []
         self.on = True
         self.threads = []
+        # durations of the latest loops, used to report jitter
+        self.loop_times = deque(maxlen=1000)
 
     def add(self, part, inputs=[], outputs=[],
-            threaded=False, run_condition=None):
+            threaded=False, run_condition=None,
+            cpus=None, nice=None, realtime=None):
         """
         Method to add a part to the vehicle drive loop.
 
@@ -38,6 +54,13 @@ class Vehicle:
                 If a part should be run in a separate thread.
             run_condition: boolean
                 If a part should be run at all.
+            cpus : list
+                Cores the part's thread should be pinned to. Threaded parts only.
+            nice : int
+                Niceness of the part's thread. Threaded parts only.
+            realtime : int
+                SCHED_FIFO priority (1-99) of the part's thread. Threaded
+                parts only. Falls back to normal scheduling if not permitted.
         """
 
         p = part
@@ -47,14 +70,62 @@ class Vehicle:
         entry['inputs'] = inputs
         entry['outputs'] = outputs
         entry['run_condition'] = run_condition
+        # reused every loop so getting the inputs doesn't allocate
+        entry['input_buffer'] = [None] * len(inputs)
+
+        # inputs like 'cam/image_array[-3:]' need the channel's history
+        for key in inputs:
+            self.mem.add_history_key(key)
 
         if threaded:
-            t = Thread(target=part.update, args=())
+            t = Thread(target=self.run_thread, args=(part, cpus, nice, realtime))
             t.daemon = True
             entry['thread'] = t
         self.parts.append(entry)
 
-    def start(self, rate_hz=10, max_loop_count=None):
+    def run_thread(self, part, cpus=None, nice=None, realtime=None):
+        """
+        Target of a threaded part. Applies its scheduling then runs update.
+        """
+        self.set_scheduling(part.__class__.__name__, cpus, nice, realtime)
+        part.update()
+
+    def set_scheduling(self, name, cpus=None, nice=None, realtime=None):
+        """
+        Pin the calling thread and change its priority, logging a warning
+        when the system doesn't allow it.
+        """
+        if cpus is not None:
+            if set_cpu_affinity(cpus):
+                logger.info('{} pinned to cpus {}'.format(name, list(cpus)))
+            else:
+                logger.warning('Could not pin {} to cpus {}'.format(name, list(cpus)))
+
+        if nice is not None or realtime is not None:
+            if not set_thread_priority(nice=nice, realtime=realtime):
+                logger.warning('Could not set priority of {} (nice={}, realtime={}).'
+                               ' Running with normal priority.'.format(name, nice, realtime))
+
+    def loop_stats(self, rate_hz):
+        """
+        Statistics in milliseconds of the latest loop periods and their
+        jitter, the distance from the target period.
+        """
+        periods = sorted(self.loop_times)
+        if not periods:
+            return None
+        target = 1.0 / rate_hz
+        jitter = sorted(abs(p - target) for p in periods)
+        n = len(periods)
+        return {'loops': n,
+                'mean_ms': sum(periods) / n * 1000,
+                'max_ms': periods[-1] * 1000,
+                'jitter_mean_ms': sum(jitter) / n * 1000,
+                'jitter_p99_ms': jitter[min(n - 1, int(n * 0.99))] * 1000,
+                'jitter_max_ms': jitter[-1] * 1000}
+
+    def start(self, rate_hz=10, max_loop_count=None, gc_freeze=False,
+              cpus=None, nice=None, realtime=None):
         """
         Start vehicle's main drive loop.
 
@@ -71,10 +142,22 @@ class Vehicle:
         max_loop_count : int
             Maxiumum number of loops the drive loop should execute. This is
             used for testing the all the parts of the vehicle work.
+        gc_freeze : boolean
+            Freeze the objects created during start up and disable automatic
+            garbage collection while driving. The youngest generation is
+            collected when the loop has time left before the next tick.
+        cpus, nice, realtime :
+            Scheduling of the drive loop thread, see `add`.
         """
+        gc_was_enabled = gc.isenabled()
+        # the drive loop runs on the calling thread, give it back its scheduling
+        scheduling = None
+        if cpus is not None or nice is not None or realtime is not None:
+            scheduling = get_scheduling()
 
         try:
             self.on = True
+            self.set_scheduling('drive loop', cpus, nice, realtime)
 
             for entry in self.parts:
                 if entry.get('thread'):
@@ -85,53 +168,96 @@ class Vehicle:
             logger.info('Starting vehicle...')
             time.sleep(1)
 
+            if gc_freeze:
+                gc.collect()
+                if hasattr(gc, 'freeze'):
+                    gc.freeze()
+                gc.disable()
+
             loop_count = 0
+            last_start = None
             while self.on:
                 start_time = time.time()
                 loop_count += 1
+                if last_start is not None:
+                    self.loop_times.append(start_time - last_start)
+                last_start = start_time
 
-                self.update_parts()
+                with get_tracer().span('Vehicle.loop', cat='loop'):
+                    self.update_parts()
 
                 # stop drive loop if loop_count exceeds max_loopcount
                 if max_loop_count and loop_count > max_loop_count:
                     self.on = False
 
+                # collect the youngest generation only when the loop has time left
+                if gc_freeze and 1.0 / rate_hz - (time.time() - start_time) > 0.0:
+                    gc.collect(0)
+
                 sleep_time = 1.0 / rate_hz - (time.time() - start_time)
                 if sleep_time > 0.0:
-                    time.sleep(sleep_time)
+                    with get_tracer().span('Vehicle.sleep', cat='loop'):
+                        time.sleep(sleep_time)
 
         except KeyboardInterrupt:
             pass
+        except Exception:
+            if self.recorder is not None:
+                try:
+                    self.recorder.dump(reason='crash')
+                except Exception:
+                    # don't hide the crash behind a failed dump
+                    logger.exception('Could not dump the flight recorder')
+            raise
         finally:
+            if gc_freeze:
+                if hasattr(gc, 'unfreeze'):
+                    gc.unfreeze()
+                if gc_was_enabled:
+                    gc.enable()
+
+            if scheduling is not None and not restore_scheduling(scheduling):
+                logger.warning('Could not restore the scheduling of the drive loop thread')
+
+            stats = self.loop_stats(rate_hz)
+            if stats:
+                logger.info('Drive loop: {loops} loops, period mean {mean_ms:.1f}ms max {max_ms:.1f}ms, '
+                            'jitter mean {jitter_mean_ms:.2f}ms p99 {jitter_p99_ms:.2f}ms '
+                            'max {jitter_max_ms:.2f}ms'.format(**stats))
             self.stop()
 
     def update_parts(self):
         """
         loop over all parts
         """
+        tracer = get_tracer()
         for entry in self.parts:
             # don't run if there is a run condition that is False
             run = True
             if entry.get('run_condition'):
                 run_condition = entry.get('run_condition')
-                run = self.mem.get([run_condition])[0]
+                run = self.mem.d.get(run_condition)
                 # print('run_condition', entry['part'], entry.get('run_condition'), run)
 
             if run:
                 p = entry['part']
                 # get inputs from memory
-                inputs = self.mem.get(entry['inputs'])
+                inputs = self.mem.get(entry['inputs'], out=entry['input_buffer'])
 
                 # run the part
-                if entry.get('thread'):
-                    outputs = p.run_threaded(*inputs)
-                else:
-                    outputs = p.run(*inputs)
+                with tracer.span(p.__class__.__name__):
+                    if entry.get('thread'):
+                        outputs = p.run_threaded(*inputs)
+                    else:
+                        outputs = p.run(*inputs)
 
                 # save the output to memory
                 if outputs is not None:
                     self.mem.put(entry['outputs'], outputs)
 
+        if self.recorder is not None:
+            self.recorder.record(self.mem)
+
     def stop(self):
         logger.info('Shutting down vehicle and its parts...')
         for entry in self.parts:
@@ -139,3 +265,8 @@ class Vehicle:
                 entry['part'].shutdown()
             except Exception as e:
                 logger.debug(e)
+
+        if self.recorder is not None:
+            self.recorder.shutdown()
+
+        get_tracer().flush()